@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Automatic white balance for BGR / BGRA frames
+
+Channel gains are estimated every N frames from a strided subsample of
+the frame (gray-world or white-patch), smoothed over time and applied in
+place through a saturating per-channel lookup table. Between estimates
+the per-frame cost is a single LUT pass.
+
+Usage:
+    awb = AutoWhiteBalance(method="gray_world", interval=10)
+    while True:
+        ret, frame = cap.read()
+        awb.process(frame)   # frame is corrected in place
+"""
+
+import numpy as np
+
+from strip_parallel import make_op
+
+
+METHODS = ("gray_world", "white_patch")
+
+
+def estimate_gray_world(sample):
+    """Gains that make the average of every channel equal to green"""
+    means = sample.reshape(-1, sample.shape[-1]).mean(axis=0)
+    means = np.maximum(means, 1.0)
+    return means[1] / means
+
+
+def estimate_white_patch(sample, percentile=99.0):
+    """Gains that map the brightest patch of every channel to the same level
+
+    A high percentile is used instead of the maximum so single hot pixels
+    and specular highlights do not drive the estimate.
+    """
+    pixels = sample.reshape(-1, sample.shape[-1])
+    highs = np.percentile(pixels, percentile, axis=0)
+    highs = np.maximum(highs, 1.0)
+    return highs[1] / highs
+
+
+class AutoWhiteBalance:
+    def __init__(self, method="gray_world", interval=10, stride=8,
+                 smoothing=0.2, min_gain=0.25, max_gain=4.0):
+        if method not in METHODS:
+            raise ValueError(f"Unknown AWB method: {method} (use one of {METHODS})")
+        self.method = method
+        # estimate every `interval` frames from every `stride`-th pixel
+        self.interval = max(1, int(interval))
+        self.stride = max(1, int(stride))
+        # weight of a new estimate in the running gains (1.0 = no smoothing)
+        self.smoothing = smoothing
+        self.min_gain = min_gain
+        self.max_gain = max_gain
+
+        self.frame_count = 0
+        self.gains = np.ones(3, dtype=np.float64)   # b, g, r
+        self.lut = None
+        self.op = None
+        self._build_lut()
+
+    def reset(self):
+        self.frame_count = 0
+        self.gains = np.ones(3, dtype=np.float64)
+        self._build_lut()
+
+    def get_gains(self):
+        b, g, r = self.gains
+        return {"b_gain": round(float(b), 4), "g_gain": round(float(g), 4), "r_gain": round(float(r), 4)}
+
+    def estimate(self, frame):
+        """Estimate gains from a strided subsample and fold them into the running gains"""
+        sample = frame[::self.stride, ::self.stride, :3]
+        if self.method == "gray_world":
+            new_gains = estimate_gray_world(sample)
+        else:
+            new_gains = estimate_white_patch(sample)
+        new_gains = np.clip(new_gains, self.min_gain, self.max_gain)
+
+        # exponential smoothing keeps the picture from flickering
+        self.gains = (1.0 - self.smoothing) * self.gains + self.smoothing * new_gains
+        self._build_lut()
+        return self.gains
+
+    def _build_lut(self):
+        # one saturating table per channel, so no float temporaries per frame
+        levels = np.arange(256, dtype=np.float64)[:, None]
+        lut = np.clip(np.rint(levels * self.gains[None, :]), 0, 255)
+        self.lut = lut.astype(np.uint8)
+        self.op = make_op("lut", lut=self.lut)
+
+    def apply(self, frame, out=None, executor=None):
+        """Apply the current gains, in place unless out is given"""
+        if out is None:
+            out = frame
+        if executor is not None:
+            return executor.run(frame, [self.op], out=out)
+        self.op.kernel(frame, out)
+        return out
+
+    def process(self, frame, out=None, executor=None):
+        """Re-estimate every `interval` frames, then apply the gains"""
+        if self.frame_count % self.interval == 0:
+            self.estimate(frame)
+        self.frame_count += 1
+        return self.apply(frame, out=out, executor=executor)
+
+
+if __name__ == "__main__":
+    import time
+
+    # synthetic scene with a strong blue cast, then a per-frame cost check
+    rng = np.random.default_rng(0)
+    scene = rng.integers(40, 200, (1080, 1920, 3), dtype=np.uint8)
+    scene[:, :, 0] = np.clip(scene[:, :, 0] * 1.4, 0, 255).astype(np.uint8)
+
+    for method in METHODS:
+        awb = AutoWhiteBalance(method=method, interval=10)
+        frame = scene.copy()
+        start = time.perf_counter()
+        frames = 100
+        for _ in range(frames):
+            frame[...] = scene
+            awb.process(frame)
+        ms = (time.perf_counter() - start) / frames * 1000
+        means = frame.reshape(-1, 3).mean(axis=0)
+        print(f"{method:12} gains={awb.get_gains()} "
+              f"means(b,g,r)=({means[0]:.1f}, {means[1]:.1f}, {means[2]:.1f}) "
+              f"{ms:.2f} ms/frame (incl. copy)")
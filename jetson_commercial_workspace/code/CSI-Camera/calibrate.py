@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Gain / exposure calibration sweep
+
+Steps through a grid of gain and exposure values, waits at every point
+until the image has settled, then measures the mean level and the temporal
+noise over a few frames (vectorized over the whole frame stack). A linear
+sensor model is fitted to the points that are not clipped:
+
+    mean  = black + k * exposure * 10^(gain / 20000)
+    noise^2 = a * (mean - black) + b * 10^(gain / 10000)
+
+(gain is in the driver's 0.001 dB units, exposure in us.) The measured grid
+and the model go to a small .npz table. ResponseTable.solve() then returns
+the gain / exposure that reach a target brightness with the least gain, so
+auto exposure and presets can jump straight there instead of searching.
+
+The sweep talks to a camera through two calls, set_controls(dict) and
+read(), so SimulatedSensor can stand in for the hardware. A new setting only
+shows some frames after the write (sensor.latency, several frames on Argus),
+so settling first drops those frames and then waits for the level to move
+toward the value expected from the previous point before it may count as
+stable; a stable level from the old setting is never measured.
+
+Usage:
+    python3 calibrate.py sim /tmp/response.npz     # simulated sensor
+    python3 calibrate.py /dev/video0                # real camera, writes response.npz
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# default table location, picked up by PresetEngine.load_response()
+RESPONSE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "response.npz")
+
+DEFAULT_GAINS = (0, 3016, 6032, 12064, 18096, 24024)
+DEFAULT_EXPOSURES = (1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+# levels above this count as clipped and stay out of the fit
+CLIP_LEVEL = 250.0
+
+# frames dropped after the first write of a sweep, there is no earlier
+# point to tell whether the setting has taken effect
+FIRST_SETTLE_FRAMES = 30
+
+
+def gain_factor(gain):
+    """Linear amplification of a gain setting in 0.001 dB"""
+    return 10.0 ** (np.asarray(gain, dtype=np.float64) / 20000.0)
+
+
+class SimulatedSensor:
+    """Linear sensor with shot and read noise and a few frames of control latency"""
+
+    def __init__(self, size=(320, 180), k=0.004, black=4.0, shot=0.6, read_noise=0.8,
+                 latency=4, seed=0):
+        self.k = k
+        self.black = black
+        self.shot = shot
+        self.read_noise = read_noise
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+        # fixed scene reflectance, a gradient with some texture
+        w, h = size
+        x = np.linspace(0.3, 1.0, w, dtype=np.float32)
+        scene = np.tile(x, (h, 1)) * (0.9 + 0.1 * self.rng.random((h, w), dtype=np.float32))
+        self.scene = scene[:, :, None] * np.array([0.9, 1.0, 0.8], dtype=np.float32)
+        self.controls = {"gain": 0, "exposure": 10000, "black_level": 0}
+        self._queue = []             # (frames until effective, controls)
+        self._active = dict(self.controls)
+
+    def set_controls(self, controls):
+        self.controls.update(controls)
+        self._queue.append([self.latency, dict(self.controls)])
+
+    def read(self):
+        for item in self._queue:
+            item[0] -= 1
+        while self._queue and self._queue[0][0] <= 0:
+            self._active = self._queue.pop(0)[1]
+        g = float(gain_factor(self._active["gain"]))
+        signal = self.scene * (self.k * self._active["exposure"] * g)
+        noise_sd = np.sqrt(self.shot * signal + (self.read_noise * g) ** 2)
+        frame = self.black + signal + noise_sd * self.rng.standard_normal(signal.shape, dtype=np.float32)
+        return True, np.clip(frame, 0, 255).astype(np.uint8)
+
+
+class DeviceSensor:
+    """Camera pipeline plus batched v4l2 control writes"""
+
+    def __init__(self, device="/dev/video0", pipeline=None, latency=6):
+        import cv2
+        from presets import PresetEngine
+
+        # frames between a control write and the first frame showing it
+        self.latency = latency
+        self.engine = PresetEngine(device)
+        self.cap = cv2.VideoCapture(pipeline or (
+            "nvarguscamerasrc sensor-id=0 aelock=1 ! "
+            "video/x-raw(memory:NVMM), width=5440, height=3648, framerate=20/1 ! "
+            "nvvidconv ! video/x-raw, width=960, height=540, format=(string)BGRx ! "
+            "videoconvert ! video/x-raw, format=BGR ! appsink drop=true max-buffers=1"
+        ), cv2.CAP_GSTREAMER)
+        if not self.cap.isOpened():
+            raise RuntimeError("Could not open camera")
+
+    def set_controls(self, controls):
+        self.engine.set_controls(controls)
+
+    def read(self):
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+
+def frame_level(frame):
+    return float(frame[::8, ::8].mean())
+
+
+def settle(sensor, latency=0, before=None, expected=None, tolerance=0.5, max_frames=40):
+    """Read frames until a new setting shows and the level stops moving, returns frames read
+
+    The first `latency` frames are dropped, the sensor cannot show the setting
+    yet. Given the level under the previous setting (before) and the level
+    expected now, the level also has to cover half the way from one to the
+    other, which catches a real latency longer than configured.
+    """
+    must_move = (before is not None and expected is not None
+                 and abs(expected - before) >= 4 * tolerance)
+    last = None
+    for i in range(1, max_frames + 1):
+        ret, frame = sensor.read()
+        if not ret or i <= latency:
+            continue
+        mean = frame_level(frame)
+        if must_move and abs(mean - before) < 0.5 * abs(expected - before):
+            # still the old setting
+            last = None
+            continue
+        if last is not None and abs(mean - last) < tolerance:
+            return i
+        last = mean
+    return max_frames
+
+
+def expected_level(reference, new_gain, new_exposure):
+    """Level a setting should give, scaled from the (gain, exposure, level) of an unclipped point"""
+    gain, exposure, level = reference
+    ratio = (new_exposure * gain_factor(new_gain)) / (exposure * gain_factor(gain))
+    return float(min(level * ratio, 255.0))
+
+
+def measure(sensor, frames=4):
+    """Mean level, temporal noise and clipped fraction over a stack of frames"""
+    stack = []
+    while len(stack) < frames:
+        ret, frame = sensor.read()
+        if ret:
+            stack.append(frame)
+    stack = np.stack(stack).astype(np.float32)
+    # temporal noise: per pixel spread over the stack, so scene texture does not count
+    noise = float(np.sqrt(stack.var(axis=0, ddof=1).mean()))
+    return float(stack.mean()), noise, float((stack >= CLIP_LEVEL).mean())
+
+
+def sweep(sensor, gains=DEFAULT_GAINS, exposures=DEFAULT_EXPOSURES, frames=4, black_level=0):
+    latency = getattr(sensor, "latency", 0)
+    means = np.zeros((len(gains), len(exposures)), dtype=np.float32)
+    noise = np.zeros_like(means)
+    clipped = np.zeros_like(means)
+    before = None                # level of the previous point
+    reference = None             # (gain, exposure, level) of the last unclipped point
+    for i, gain in enumerate(gains):
+        for j, exposure in enumerate(exposures):
+            sensor.set_controls({"gain": gain, "exposure": exposure, "black_level": black_level})
+            if before is None:
+                settled = settle(sensor, max(latency, FIRST_SETTLE_FRAMES))
+            else:
+                expected = expected_level(reference, gain, exposure) if reference else None
+                settled = settle(sensor, latency, before, expected)
+            means[i, j], noise[i, j], clipped[i, j] = measure(sensor, frames)
+            before = float(means[i, j])
+            if before < CLIP_LEVEL and before > 1.0:
+                reference = (gain, exposure, before)
+            print(f"gain={gain:6d} exposure={exposure:7d}  mean={means[i, j]:6.1f} "
+                  f"noise={noise[i, j]:5.2f} clipped={clipped[i, j]:.3f} (settled in {settled})")
+    return means, noise, clipped
+
+
+def fit_model(gains, exposures, means, noise, clipped):
+    """Least squares fit of the linear sensor model to the unclipped points"""
+    g = gain_factor(gains)[:, None]
+    x = (np.asarray(exposures, dtype=np.float64)[None, :] * g).ravel()
+    m = means.astype(np.float64).ravel()
+    ok = (clipped.ravel() < 0.01) & (m < CLIP_LEVEL) & (m > 1.0)
+    if ok.sum() < 2:
+        raise ValueError("Not enough unclipped points to fit the response")
+
+    k, black = np.linalg.lstsq(np.stack([x[ok], np.ones(ok.sum())], axis=1), m[ok], rcond=None)[0]
+    signal = np.maximum(m - black, 0.0)
+    g2 = np.broadcast_to(g ** 2, means.shape).ravel()
+    (a, b), *_ = np.linalg.lstsq(np.stack([signal[ok], g2[ok]], axis=1),
+                                 noise.astype(np.float64).ravel()[ok] ** 2, rcond=None)
+    return {"k": float(k), "black": float(black), "shot": float(max(a, 0.0)), "read": float(max(b, 0.0))}
+
+
+class ResponseTable:
+    def __init__(self, gains, exposures, means, noise, model):
+        self.gains = np.asarray(gains)
+        self.exposures = np.asarray(exposures)
+        self.means = means
+        self.noise = noise
+        self.model = model
+
+    def save(self, path):
+        # float16 keeps the grid at a few hundred bytes
+        np.savez_compressed(
+            path,
+            gains=self.gains.astype(np.int32),
+            exposures=self.exposures.astype(np.int32),
+            means=self.means.astype(np.float16),
+            noise=self.noise.astype(np.float16),
+            model=np.array([self.model[k] for k in ("k", "black", "shot", "read")]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = dict(zip(("k", "black", "shot", "read"), data["model"].tolist()))
+            return cls(data["gains"], data["exposures"],
+                       data["means"].astype(np.float32), data["noise"].astype(np.float32), model)
+
+    def predict(self, gain, exposure):
+        """(mean level, noise) the model expects for a setting"""
+        m = self.model
+        signal = m["k"] * exposure * gain_factor(gain)
+        noise = np.sqrt(m["shot"] * signal + m["read"] * gain_factor(gain) ** 2)
+        return float(min(m["black"] + signal, 255.0)), float(noise)
+
+    def solve(self, target, max_exposure=None, max_gain=27000, min_exposure=1):
+        """(gain, exposure) for a mean level, exposure first since gain adds noise"""
+        m = self.model
+        needed = max(target - m["black"], 0.0) / m["k"]          # exposure * gain factor
+        max_exposure = max_exposure or int(self.exposures.max())
+        exposure = int(round(min(max(needed, min_exposure), max_exposure)))
+        gain = 0
+        if needed > exposure:
+            gain = int(round(20000.0 * np.log10(needed / exposure)))
+            gain = min(gain, max_gain)
+        return gain, exposure
+
+
+def calibrate(sensor, path, gains=DEFAULT_GAINS, exposures=DEFAULT_EXPOSURES, frames=4):
+    start = time.monotonic()
+    means, noise, clipped = sweep(sensor, gains, exposures, frames)
+    model = fit_model(gains, exposures, means, noise, clipped)
+    table = ResponseTable(gains, exposures, means, noise, model)
+    table.save(path)
+    print(f"Model: {model}")
+    print(f"Saved {path} ({len(gains)}x{len(exposures)} points, {time.monotonic() - start:.1f} s)")
+    return table
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python3 calibrate.py <sim | /dev/videoN> [table.npz]")
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) > 2 else RESPONSE_FILE
+    if sys.argv[1] == "sim":
+        calibrate(SimulatedSensor(), path)
+    else:
+        sensor = DeviceSensor(sys.argv[1])
+        try:
+            calibrate(sensor, path)
+        finally:
+            sensor.release()
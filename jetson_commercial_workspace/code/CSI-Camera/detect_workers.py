@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Asynchronous detection worker pool
+
+Detection runs on a pool of worker threads, each with its own detector
+(CascadeClassifier is not safe to share between threads). OpenCV releases
+the GIL inside detectMultiScale, so the workers use separate cores.
+
+Frames are handed over with drop-if-busy semantics: there is a single
+pending slot, a new frame replaces a frame nobody has picked up yet, and
+idle workers always take the newest one. Results come back tagged with
+the sequence number of the frame they belong to, so the display loop can
+overlay the most recent results at full camera rate.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from face_tracker import load_cascade
+
+
+class CascadeFaceDetector:
+    """Face + eye detection on one gray frame, one instance per worker"""
+
+    def __init__(self, detect_scale=1.0, scale_factor=1.3, min_neighbors=5, eyes=True):
+        self.face_cascade = load_cascade("haarcascade_frontalface_default.xml")
+        self.eye_cascade = load_cascade("haarcascade_eye.xml") if eyes else None
+        self.detect_scale = detect_scale
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def __call__(self, gray):
+        s = self.detect_scale
+        small = gray
+        if s != 1.0:
+            small = cv2.resize(gray, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+        faces = self.face_cascade.detectMultiScale(small, self.scale_factor, self.min_neighbors)
+        results = []
+        for face in faces:
+            x, y, w, h = (int(round(v / s)) for v in face)
+            eyes = []
+            if self.eye_cascade is not None:
+                roi = gray[y : y + h, x : x + w]
+                eyes = [tuple(int(v) for v in e) for e in self.eye_cascade.detectMultiScale(roi)]
+            results.append(((x, y, w, h), eyes))
+        return results
+
+
+class DetectionResult:
+    def __init__(self, seq, results, submitted, started, finished):
+        self.seq = seq
+        self.results = results
+        self.submitted = submitted
+        self.started = started
+        self.finished = finished
+
+    @property
+    def latency(self):
+        # frame handed over -> result available
+        return self.finished - self.submitted
+
+
+class DetectionWorkerPool:
+    def __init__(self, detector_factory=CascadeFaceDetector, num_workers=None, history=200):
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.detector_factory = detector_factory
+
+        self._cond = threading.Condition()
+        self._pending = None          # (seq, frame, submitted)
+        self._running = False
+        self._threads = []
+
+        self.latest = None            # newest DetectionResult by frame seq
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.stale = 0                # finished after a newer frame's result
+        self._latencies = deque(maxlen=history)
+
+    def start(self):
+        self._running = True
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._worker, name=f"detect-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, seq, frame):
+        """Offer a frame, replacing one that no worker has picked up yet"""
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (seq, frame, time.monotonic())
+            self.submitted += 1
+            self._cond.notify()
+
+    def _worker(self):
+        # each worker owns its detector
+        detect = self.detector_factory()
+        while True:
+            with self._cond:
+                while self._running and self._pending is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                seq, frame, submitted = self._pending
+                self._pending = None
+
+            started = time.monotonic()
+            results = detect(frame)
+            result = DetectionResult(seq, results, submitted, started, time.monotonic())
+
+            with self._cond:
+                self.completed += 1
+                self._latencies.append(result.latency)
+                # workers may finish out of order, never go back in time
+                if self.latest is None or result.seq > self.latest.seq:
+                    self.latest = result
+                else:
+                    self.stale += 1
+
+    def latest_result(self):
+        return self.latest
+
+    def get_stats(self):
+        with self._cond:
+            latencies = np.array(self._latencies) * 1000.0
+            stats = {
+                "workers": self.num_workers,
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "completed": self.completed,
+                "stale": self.stale,
+            }
+        if latencies.size:
+            stats.update({
+                "latency_ms_mean": round(float(latencies.mean()), 2),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+            })
+        return stats
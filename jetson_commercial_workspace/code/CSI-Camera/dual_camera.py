@@ -14,6 +14,10 @@
 import cv2
 import threading
 import numpy as np
+import time
+
+from frame_source import open_source, reads_bounded
+from stall_watchdog import StallWatchdog
 
 
 class CSI_Camera:
@@ -29,12 +33,19 @@ class CSI_Camera:
         self.read_thread = None
         self.read_lock = threading.Lock()
         self.running = False
-
+        # kept so a stalled pipeline can be reopened
+        self.pipeline = None
+        self.watchdog = StallWatchdog()
+        # reads time out within the stall deadline, so a stalled pipeline fails
+        # read() on the read thread, which reopens it
+        self.read_timeout_ms = self.watchdog.min_timeout * 1000.0
+
+    # also takes "replay:<dir>" or "synthetic:WxH@fps", see frame_source.py
     def open(self, gstreamer_pipeline_string):
+        self.pipeline = gstreamer_pipeline_string
         try:
-            self.video_capture = cv2.VideoCapture(
-                gstreamer_pipeline_string, cv2.CAP_GSTREAMER
-            )
+            self.video_capture = open_source(gstreamer_pipeline_string, self.read_timeout_ms)
+            self.watchdog.bounded_reads = reads_bounded(self.video_capture)
             # Grab the first frame to start the video capturing
             self.grabbed, self.frame = self.video_capture.read()
 
@@ -53,26 +64,52 @@ class CSI_Camera:
             self.running = True
             self.read_thread = threading.Thread(target=self.updateCamera)
             self.read_thread.start()
+            # flags reads that stay blocked past the deadline
+            self.watchdog.start_monitor()
         return self
 
     def stop(self):
         self.running = False
+        self.watchdog.stop_monitor()
         # Kill the thread
         self.read_thread.join()
         self.read_thread = None
 
     def updateCamera(self):
         # This is the thread to read images from the camera
+        self.watchdog.arm()
         while self.running:
             try:
                 grabbed, frame = self.video_capture.read()
+            except RuntimeError:
+                print("Could not read image from camera")
+                grabbed, frame = False, None
+            if grabbed:
+                self.watchdog.frame()
                 with self.read_lock:
                     self.grabbed = grabbed
                     self.frame = frame
-            except RuntimeError:
-                print("Could not read image from camera")
-        # FIX ME - stop and cleanup thread
-        # Something bad happened
+            elif self.watchdog.expired():
+                # no frames within the deadline, restart the pipeline
+                self.reopen()
+            else:
+                time.sleep(0.01)
+
+    # release and reopen the pipeline with exponential backoff
+    # the last good frame stays readable meanwhile
+    def reopen(self):
+        self.watchdog.stall()
+        print("Camera stalled, reopening: " + self.pipeline)
+        while self.running:
+            if self.video_capture is not None:
+                self.video_capture.release()
+            time.sleep(self.watchdog.next_backoff())
+            self.video_capture = open_source(self.pipeline, self.read_timeout_ms)
+            if self.video_capture.isOpened():
+                self.watchdog.bounded_reads = reads_bounded(self.video_capture)
+                self.watchdog.arm()
+                return True
+        return False
 
     def read(self):
         with self.read_lock:
@@ -80,13 +117,17 @@ class CSI_Camera:
             grabbed = self.grabbed
         return grabbed, frame
 
+    # the read thread owns the capture: stop it first (its reads time out),
+    # then release the capture once nothing reads from it
     def release(self):
+        self.running = False
+        self.watchdog.stop_monitor()
+        if self.read_thread != None:
+            self.read_thread.join()
+            self.read_thread = None
         if self.video_capture != None:
             self.video_capture.release()
             self.video_capture = None
-        # Now kill the thread
-        if self.read_thread != None:
-            self.read_thread.join()
 
 
 """ 
@@ -6,8 +6,13 @@
 # On the Jetson Nano, OpenCV comes preinstalled
 # Data files are in /usr/sharc/OpenCV
 
+import time
+
 import cv2
 
+from detect_workers import CascadeFaceDetector, DetectionWorkerPool
+from face_tracker import DetectTrackScheduler, draw_faces, load_cascade
+
 # gstreamer_pipeline returns a GStreamer pipeline for capturing from the CSI camera
 # Defaults to 1920x1080 @ 30fps
 # Flip the image by setting the flip_method (most common values: 0 and 2)
@@ -41,14 +46,40 @@ def gstreamer_pipeline(
     )
 
 
-def face_detect():
-    window_title = "Face Detect"
-    face_cascade = cv2.CascadeClassifier(
-        "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml"
-    )
-    eye_cascade = cv2.CascadeClassifier(
-        "/usr/share/opencv4/haarcascades/haarcascade_eye.xml"
+def print_detection_stats(pool, frames, elapsed, lag):
+    stats = pool.get_stats()
+    print(
+        "display fps: %.1f, detections: %d, dropped: %d, latency p50/p95: %s/%s ms, lag: %d frames"
+        % (
+            frames / elapsed,
+            stats["completed"],
+            stats["dropped"],
+            stats.get("latency_ms_p50", "-"),
+            stats.get("latency_ms_p95", "-"),
+            lag,
+        )
     )
+
+
+def face_detect(async_detection=True):
+    window_title = "Face Detect"
+    if async_detection:
+        # detection on a pool of workers, display at full camera rate
+        pool = DetectionWorkerPool(lambda: CascadeFaceDetector(detect_scale=0.5)).start()
+    else:
+        # full cascade every 10 frames on a half size frame, tracking in between
+        face_cascade = load_cascade("haarcascade_frontalface_default.xml")
+        eye_cascade = load_cascade("haarcascade_eye.xml")
+        scheduler = DetectTrackScheduler(
+            face_cascade,
+            eye_cascade,
+            detect_interval=10,
+            detect_scale=0.5,
+            eye_interval=5,
+        )
+    seq = 0
+    lag = 0
+    start_time = time.monotonic()
     video_capture = cv2.VideoCapture(gstreamer_pipeline(), cv2.CAP_GSTREAMER)
     if video_capture.isOpened():
         try:
@@ -56,17 +87,19 @@ def face_detect():
             while True:
                 ret, frame = video_capture.read()
                 gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-
-                for (x, y, w, h) in faces:
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-                    roi_gray = gray[y : y + h, x : x + w]
-                    roi_color = frame[y : y + h, x : x + w]
-                    eyes = eye_cascade.detectMultiScale(roi_gray)
-                    for (ex, ey, ew, eh) in eyes:
-                        cv2.rectangle(
-                            roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), 2
-                        )
+                if async_detection:
+                    pool.submit(seq, gray)
+                    # overlay the most recent results, whichever frame they came from
+                    latest = pool.latest_result()
+                    if latest is not None:
+                        draw_faces(frame, latest.results)
+                        lag = seq - latest.seq
+                    if seq % 100 == 99:
+                        print_detection_stats(pool, seq + 1, time.monotonic() - start_time, lag)
+                else:
+                    faces = scheduler.update(gray)
+                    draw_faces(frame, faces)
+                seq += 1
                 # Check to see if the user closed the window
                 # Under GTK+ (Jetson Default), WND_PROP_VISIBLE does not work correctly. Under Qt it does
                 # GTK - Substitute WND_PROP_AUTOSIZE to detect if window has been closed by user
@@ -79,9 +112,14 @@ def face_detect():
                 if keyCode == 27 or keyCode == ord('q'):
                     break
         finally:
+            if async_detection:
+                pool.stop()
+                print_detection_stats(pool, max(seq, 1), time.monotonic() - start_time, lag)
             video_capture.release()
             cv2.destroyAllWindows()
     else:
+        if async_detection:
+            pool.stop()
         print("Unable to open camera")
 
 
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Frame sources: camera, recording, replay and synthetic
+
+Every source behaves like cv2.VideoCapture (isOpened, read, grab, retrieve,
+get, release), so capture loops take any of them. open_source() picks one from
+a spec string:
+
+    "nvarguscamerasrc ! ... ! appsink"     GStreamer pipeline (the camera)
+    "replay:/path/to/recording"            recorded frames, original timing
+    "replay:/path/to/recording?fast"       recorded frames, as fast as possible
+    "replay:/path/to/recording?loop"       ... and start over at the end
+    "synthetic:1920x1080@30"               generated test pattern
+    "synthetic:1920x1080@30?fast"
+    "v4l2:/dev/video0?5440x3648,RG12"      raw sensor frames over V4L2 mmap streaming
+
+A recording is a directory holding a FrameStore (frames.fst, see
+frame_store.py): every frame with its buffer timestamp, arrival time and
+the control values at capture. Replay memory-maps the store, so only the
+frames being read are loaded.
+
+Usage:
+    source = RecordingSource(open_source(pipeline), "/tmp/rec", controls=get_controls)
+    ...
+    cap = open_source("replay:/tmp/rec")
+    ret, frame = cap.read()
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+from frame_store import FrameStore
+
+STORE_NAME = "frames.fst"
+
+
+def is_hardware(spec):
+    return not (spec.startswith("replay:") or spec.startswith("synthetic:"))
+
+
+def _split_options(spec):
+    spec, _, options = spec.partition("?")
+    return spec, set(filter(None, options.split(",")))
+
+
+# bound a blocking read inside the capture backend, so a stalled pipeline
+# makes read() return False instead of hanging the capture thread
+# False if this OpenCV build or backend cannot
+def set_read_timeout(cap, timeout_ms):
+    prop = getattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC", None)
+    return bool(prop is not None and cap.set(prop, float(timeout_ms)))
+
+
+# True if a read from cap cannot block indefinitely: the sources here all
+# time out or never wait, a cv2 capture only with a read timeout set
+def reads_bounded(cap):
+    cap = getattr(cap, "source", cap)    # RecordingSource
+    if not isinstance(cap, cv2.VideoCapture):
+        return True
+    prop = getattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC", None)
+    return bool(prop is not None and cap.get(prop) > 0)
+
+
+# read_timeout_ms bounds reads of GStreamer pipelines, see reads_bounded()
+def open_source(spec, read_timeout_ms=None):
+    if spec.startswith("replay:"):
+        path, options = _split_options(spec[len("replay:"):])
+        return ReplaySource(path, realtime="fast" not in options, loop="loop" in options)
+    if spec.startswith("synthetic:"):
+        desc, options = _split_options(spec[len("synthetic:"):])
+        size, _, fps = desc.partition("@")
+        width, height = (int(v) for v in size.split("x"))
+        return SyntheticSource((width, height), float(fps or 30), realtime="fast" not in options)
+    if spec.startswith("v4l2:"):
+        from v4l2_capture import V4L2Capture
+        device, options = _split_options(spec[len("v4l2:"):])
+        kwargs = {}
+        for option in options:
+            if "x" in option and option.replace("x", "").isdigit():
+                kwargs["width"], kwargs["height"] = (int(v) for v in option.split("x"))
+            else:
+                kwargs["pixelformat"] = option
+        return V4L2Capture(device, **kwargs)
+    cap = cv2.VideoCapture(spec, cv2.CAP_GSTREAMER)
+    if read_timeout_ms and cap.isOpened() and not set_read_timeout(cap, read_timeout_ms):
+        print("This OpenCV build cannot time out GStreamer reads, a stalled pipeline will block")
+    return cap
+
+
+class FrameRecorder:
+    """Appends frames with their timestamps and control values to a directory"""
+
+    def __init__(self, path, codec=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.store = FrameStore(os.path.join(path, STORE_NAME), "a", codec=codec)
+        self.count = 0
+
+    def write(self, frame, buffer_ms=None, arrival=None, controls=None):
+        # the store timestamp is the arrival time, replay paces on it
+        self.store.append(
+            frame,
+            timestamp=time.monotonic() if arrival is None else arrival,
+            buffer_ms=buffer_ms,
+            controls=controls,
+        )
+        self.count += 1
+
+    def close(self):
+        self.store.close()
+
+
+class RecordingSource:
+    """Wraps a source and records every frame read from it"""
+
+    def __init__(self, source, path, controls=None):
+        self.source = source
+        self.recorder = FrameRecorder(path)
+        # controls() -> dict of control values stored with each frame
+        self.controls = controls
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def read(self):
+        ret, frame = self.source.read()
+        if ret:
+            self._record(frame)
+        return ret, frame
+
+    # grab() + retrieve() records the frame when it is retrieved
+    def grab(self):
+        return self.source.grab()
+
+    def retrieve(self):
+        ret, frame = self.source.retrieve()
+        if ret:
+            self._record(frame)
+        return ret, frame
+
+    def _record(self, frame):
+        self.recorder.write(
+            frame,
+            buffer_ms=self.source.get(cv2.CAP_PROP_POS_MSEC),
+            arrival=time.monotonic(),
+            controls=self.controls() if self.controls else None,
+        )
+
+    def get(self, prop):
+        return self.source.get(prop)
+
+    def release(self):
+        self.source.release()
+        self.recorder.close()
+
+
+class _PacedSource:
+    """Frame timing shared by replay and synthetic sources"""
+
+    def __init__(self, realtime):
+        self.realtime = realtime
+        self.position = 0
+        self.buffer_ms = 0.0
+        self._opened = True
+        self._start = None           # (wall clock, stream time in s) of the first read
+        self._grabbed = None         # frame read by grab(), for retrieve()
+
+    def isOpened(self):
+        return self._opened
+
+    # wait until stream time t (seconds) is due
+    def _pace(self, t):
+        if not self.realtime:
+            return
+        now = time.monotonic()
+        if self._start is None:
+            self._start = (now, t)
+            return
+        delay = self._start[0] + (t - self._start[1]) - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def grab(self):
+        ret, self._grabbed = self.read()
+        return ret
+
+    def retrieve(self):
+        frame, self._grabbed = self._grabbed, None
+        return frame is not None, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.buffer_ms
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(getattr(self, "fps", 0.0))
+        return 0.0
+
+    def release(self):
+        self._opened = False
+
+
+class ReplaySource(_PacedSource):
+    def __init__(self, path, realtime=True, loop=False):
+        super().__init__(realtime)
+        self.path = path
+        self.loop = loop
+        self.store = FrameStore(os.path.join(path, STORE_NAME))
+        self.controls = None         # control values of the last frame read
+        # added to the recorded times on every loop, so stream time keeps increasing
+        self._offset = 0.0           # seconds
+        self._buffer_offset = 0.0    # ms
+        self.fps = 0.0
+        if len(self.store) > 1:
+            span = float(self.store.timestamps[-1] - self.store.timestamps[0])
+            self.fps = (len(self.store) - 1) / span if span > 0 else 0.0
+
+    def __len__(self):
+        return len(self.store)
+
+    # span of the recording plus one mean frame interval, in the field's unit
+    def _loop_span(self, field):
+        first = self.store.header(0)[field] or 0.0
+        last = self.store.header(len(self.store) - 1)[field] or 0.0
+        gaps = len(self.store) - 1
+        return (last - first) * (gaps + 1) / gaps if gaps else 0.0
+
+    def frame(self, i):
+        # copy, consumers process frames in place
+        return np.array(self.store[i])
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        if self.position >= len(self.store):
+            if not self.loop or not len(self.store):
+                return False, None
+            # start over, keep stream time increasing: the next loop starts one
+            # mean frame interval after the last frame of this one
+            self._offset += self._loop_span("timestamp")
+            self._buffer_offset += self._loop_span("buffer_ms")
+            self.position = 0
+        header = self.store.header(self.position)
+        self._pace(header["timestamp"] + self._offset)
+        frame = self.frame(self.position)
+        self.buffer_ms = (header["buffer_ms"] or 0.0) + self._buffer_offset
+        self.controls = header["controls"]
+        self.position += 1
+        return True, frame
+
+
+class SyntheticSource(_PacedSource):
+    """Deterministic moving test pattern, frame n is always the same image"""
+
+    def __init__(self, size=(1920, 1080), fps=30.0, realtime=True, frames=None):
+        super().__init__(realtime)
+        self.size = size
+        self.fps = fps
+        # None = endless
+        self.frames = frames
+        w, h = size
+        gx = np.linspace(0, 255, w, dtype=np.float32)
+        gy = np.linspace(0, 255, h, dtype=np.float32)
+        self._background = np.dstack([
+            np.tile(gx, (h, 1)),
+            np.tile(gy[:, None], (1, w)),
+            np.full((h, w), 96, np.float32),
+        ]).astype(np.uint8)
+
+    def render(self, n):
+        w, h = self.size
+        frame = self._background.copy()
+        # a box that circles the center, one turn every 4 s
+        angle = 2.0 * np.pi * n / (4.0 * self.fps)
+        cx = int(w / 2 + w / 4 * np.cos(angle))
+        cy = int(h / 2 + h / 4 * np.sin(angle))
+        r = max(4, min(w, h) // 10)
+        cv2.rectangle(frame, (cx - r, cy - r), (cx + r, cy + r), (255, 255, 255), -1)
+        cv2.putText(frame, str(n), (10, max(20, h // 12)), cv2.FONT_HERSHEY_SIMPLEX,
+                    max(0.5, h / 540.0), (0, 0, 0), 2)
+        return frame
+
+    def read(self):
+        if not self._opened or (self.frames is not None and self.position >= self.frames):
+            return False, None
+        t = self.position / self.fps
+        self._pace(t)
+        frame = self.render(self.position)
+        self.buffer_ms = t * 1000.0
+        self.position += 1
+        return True, frame
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Append-only frame store
+
+Keeps lossless frame sequences for offline analysis in two files:
+
+    name.fst        records: [512 byte header][chunk table][payload], 64 byte aligned
+    name.fst.idx    one 32 byte entry per record: offset, size, timestamp, raw bytes
+
+The header is fixed size: magic, frame number, timestamp, buffer timestamp,
+dtype, shape, codec, and the control values at capture as JSON. The index
+is loaded as a NumPy record array, so timestamps of thousands of frames can
+be scanned without touching the frame file.
+
+Uncompressed frames are read as NumPy views straight from an mmap of the
+store, nothing is loaded until the pixels are used. With a codec ("zlib",
+or "lz4" / "zstd" when installed) the payload is split into chunks of whole
+rows that are compressed one by one, so reading a band of rows only
+decompresses the chunks it covers.
+
+Records are only ever appended. If the index is behind the frame file
+(the writer died between the two writes) it is rebuilt from the headers on
+open, a half written record at the end is cut off.
+
+Usage:
+    store = FrameStore("captures.fst", "a", codec="zlib")
+    store.append(frame, timestamp=time.time(), controls={"gain": 0, "exposure": 10000})
+    store.close()
+
+    store = FrameStore("captures.fst")
+    frame = store[10]                     # view (or decoded copy if compressed)
+    band = store.rows(10, 1000, 1200)     # rows 1000..1199 only
+    print(store.timestamps[:5], store.header(10)["controls"])
+    python3 frame_store.py captures.fst   # summary of a store
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+
+MAGIC = b"FST1"
+HEADER_SIZE = 512
+ALIGN = 64
+DEFAULT_CHUNK_BYTES = 1 << 20
+
+# magic, frame number, timestamp, buffer ms, dtype, ndim, codec, shape,
+# stored payload bytes, raw bytes, chunk count, rows per chunk
+_HEADER = struct.Struct("<4sIdd8sBB2x4IQQII")
+CONTROLS_SIZE = HEADER_SIZE - _HEADER.size
+
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("size", "<u8"),
+    ("timestamp", "<f8"),
+    ("raw_bytes", "<u8"),
+])
+
+
+def _codecs():
+    codecs = {
+        "none": (0, None, None),
+        "zlib": (1, lambda b: zlib.compress(b, 1), zlib.decompress),
+    }
+    try:
+        import lz4.frame
+        codecs["lz4"] = (2, lz4.frame.compress, lz4.frame.decompress)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        codecs["zstd"] = (3, zstandard.ZstdCompressor(level=1).compress,
+                          zstandard.ZstdDecompressor().decompress)
+    except ImportError:
+        pass
+    return codecs
+
+
+CODECS = _codecs()
+CODEC_IDS = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class FrameStore:
+    def __init__(self, path, mode="r", codec=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+        if mode not in ("r", "a"):
+            raise ValueError(f"mode must be 'r' or 'a', not {mode!r}")
+        codec = codec or "none"
+        if codec not in CODECS:
+            raise ValueError(f"Codec {codec} is not available (have {', '.join(CODECS)})")
+        self.path = path
+        self.index_path = path + ".idx"
+        self.mode = mode
+        self.codec = codec
+        self.chunk_bytes = chunk_bytes
+
+        if mode == "a":
+            open(path, "ab").close()
+        self.index = self._load_index()
+        self._recover()
+
+        self._map = None
+        self._frames = open(path, "ab") if mode == "a" else None
+        self._index_file = open(self.index_path, "ab") if mode == "a" else None
+
+    # --- index ---
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        count = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize
+        return np.fromfile(self.index_path, dtype=INDEX_DTYPE, count=count)
+
+    def _end(self):
+        if not len(self.index):
+            return 0
+        last = self.index[-1]
+        return _aligned(int(last["offset"]) + int(last["size"]))
+
+    # rebuild index entries for records past the last indexed one
+    def _recover(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        indexed = len(self.index)
+        # entries past the end of the frame file are from a lost write
+        ends = self.index["offset"] + self.index["size"]
+        self.index = self.index[:int(np.searchsorted(ends, size, side="right"))]
+        offset = self._end()
+        entries = []
+        with open(self.path, "rb") as f:
+            while offset + HEADER_SIZE <= size:
+                f.seek(offset)
+                header = self._unpack_header(f.read(HEADER_SIZE))
+                if header is None:
+                    break
+                record = HEADER_SIZE + 4 * header["chunks"] + header["stored_bytes"]
+                if offset + record > size:
+                    break
+                entries.append((offset, record, header["timestamp"], header["raw_bytes"]))
+                offset = _aligned(offset + record)
+        if entries:
+            self.index = np.concatenate([self.index, np.array(entries, dtype=INDEX_DTYPE)])
+            print(f"Recovered {len(entries)} index entries for {self.path}")
+        if self.mode != "a":
+            return
+        if offset < size:
+            # half written record from an interrupted writer
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        if entries or len(self.index) != indexed or index_size != indexed * INDEX_DTYPE.itemsize:
+            self.index.tofile(self.index_path)
+
+    def refresh(self):
+        """Pick up frames appended by another process"""
+        self.index = self._load_index()
+        self._map = None
+
+    # --- headers ---
+
+    def _pack_header(self, number, frame, timestamp, buffer_ms, codec_id, stored, chunks, chunk_rows, controls):
+        if frame.ndim > 4:
+            raise ValueError("frames have at most 4 dimensions")
+        shape = list(frame.shape) + [0] * (4 - frame.ndim)
+        fixed = _HEADER.pack(
+            MAGIC, number, timestamp, float("nan") if buffer_ms is None else buffer_ms,
+            frame.dtype.str.encode(), frame.ndim, codec_id, *shape,
+            stored, frame.nbytes, chunks, chunk_rows,
+        )
+        text = json.dumps(controls or {}, separators=(",", ":")).encode()
+        if len(text) > CONTROLS_SIZE:
+            raise ValueError(f"controls take {len(text)} bytes, the header has room for {CONTROLS_SIZE}")
+        return fixed + text.ljust(CONTROLS_SIZE, b"\0")
+
+    def _unpack_header(self, data):
+        if len(data) < HEADER_SIZE or data[:4] != MAGIC:
+            return None
+        (_, number, timestamp, buffer_ms, dtype, ndim, codec_id, s0, s1, s2, s3,
+         stored, raw, chunks, chunk_rows) = _HEADER.unpack_from(data)
+        controls = data[_HEADER.size:].rstrip(b"\0")
+        return {
+            "frame": number,
+            "timestamp": timestamp,
+            "buffer_ms": None if buffer_ms != buffer_ms else buffer_ms,
+            "dtype": np.dtype(dtype.rstrip(b"\0").decode()),
+            "shape": (s0, s1, s2, s3)[:ndim],
+            "codec": CODEC_IDS.get(codec_id, codec_id),
+            "stored_bytes": stored,
+            "raw_bytes": raw,
+            "chunks": chunks,
+            "chunk_rows": chunk_rows,
+            "controls": json.loads(controls) if controls else {},
+        }
+
+    # --- writing ---
+
+    def append(self, frame, timestamp=None, buffer_ms=None, controls=None):
+        """Add a frame, returns its number"""
+        if self._frames is None:
+            raise ValueError("store is opened read-only")
+        frame = np.ascontiguousarray(frame)
+        codec_id, compress, _ = CODECS[self.codec]
+        number = len(self.index)
+        timestamp = time.time() if timestamp is None else timestamp
+
+        if compress is None:
+            table = b""
+            payload = [frame.data]
+            stored = frame.nbytes
+            chunk_rows = frame.shape[0] if frame.ndim else 1
+        else:
+            # whole rows per chunk, so a band of rows maps to a range of chunks
+            row_bytes = frame.nbytes // frame.shape[0] if frame.ndim and frame.shape[0] else frame.nbytes
+            chunk_rows = max(1, self.chunk_bytes // max(1, row_bytes))
+            rows = frame.reshape(frame.shape[0], -1) if frame.ndim else frame.reshape(1, -1)
+            payload = [compress(rows[r:r + chunk_rows].tobytes()) for r in range(0, len(rows), chunk_rows)]
+            table = np.array([len(p) for p in payload], dtype="<u4").tobytes()
+            stored = sum(len(p) for p in payload)
+
+        header = self._pack_header(number, frame, timestamp, buffer_ms, codec_id, stored,
+                                   len(table) // 4, chunk_rows, controls)
+        offset = self._end()
+        record = HEADER_SIZE + len(table) + stored
+        self._frames.write(header)
+        self._frames.write(table)
+        for part in payload:
+            self._frames.write(part)
+        self._frames.write(b"\0" * (_aligned(offset + record) - offset - record))
+
+        entry = np.array([(offset, record, timestamp, frame.nbytes)], dtype=INDEX_DTYPE)
+        self._index_file.write(entry.tobytes())
+        self.index = np.concatenate([self.index, entry])
+        return number
+
+    def flush(self):
+        # frames before index, the index never points past written data
+        if self._frames:
+            self._frames.flush()
+            self._index_file.flush()
+
+    def close(self):
+        self.flush()
+        if self._frames:
+            self._frames.close()
+            self._index_file.close()
+            self._frames = self._index_file = None
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- reading ---
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.read(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read(i)
+
+    @property
+    def timestamps(self):
+        return self.index["timestamp"]
+
+    def _mapped(self, end):
+        if self._map is None or len(self._map) < end:
+            self.flush()
+            # a read-only map, views handed out cannot corrupt the store
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _record(self, i):
+        entry = self.index[i]
+        offset = int(entry["offset"])
+        data = self._mapped(offset + int(entry["size"]))
+        return data, offset, self._unpack_header(data[offset:offset + HEADER_SIZE])
+
+    def header(self, i):
+        return self._record(i)[2]
+
+    def read(self, i, out=None):
+        """Frame i: a read-only view of the mmap, or decoded into out (or a new array)"""
+        data, offset, header = self._record(i)
+        if header["codec"] == "none":
+            view = np.frombuffer(data, dtype=header["dtype"], count=int(np.prod(header["shape"])),
+                                 offset=offset + HEADER_SIZE)
+            return view.reshape(header["shape"])
+        return self._decode(data, offset, header, 0, header["chunks"], out)
+
+    def rows(self, i, start, stop):
+        """Rows start..stop-1 of frame i, only the chunks holding them are decoded"""
+        data, offset, header = self._record(i)
+        if header["codec"] == "none":
+            return self.read(i)[start:stop]
+        n = header["chunk_rows"]
+        first, last = start // n, (max(start, stop - 1)) // n + 1
+        band = self._decode(data, offset, header, first, min(last, header["chunks"]))
+        return band[start - first * n:stop - first * n]
+
+    def _decode(self, data, offset, header, first, last, out=None):
+        _, _, decompress = CODECS[header["codec"]]
+        chunks = header["chunks"]
+        sizes = np.frombuffer(data, dtype="<u4", count=chunks, offset=offset + HEADER_SIZE)
+        starts = offset + HEADER_SIZE + 4 * chunks + np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+        shape = header["shape"]
+        rows = min(shape[0], last * header["chunk_rows"]) - first * header["chunk_rows"]
+        if out is None:
+            out = np.empty((rows,) + tuple(shape[1:]), dtype=header["dtype"])
+        flat = out.reshape(-1).view(np.uint8)
+        pos = 0
+        for c in range(first, last):
+            chunk = decompress(data[int(starts[c]):int(starts[c + 1])])
+            flat[pos:pos + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+            pos += len(chunk)
+        return out
+
+    def get_stats(self):
+        raw = int(self.index["raw_bytes"].sum())
+        stored = int(self.index["size"].sum())
+        stats = {
+            "frames": len(self),
+            "codec": self.codec if self._frames else None,
+            "raw_mb": round(raw / 1e6, 1),
+            "stored_mb": round(stored / 1e6, 1),
+            "ratio": round(raw / stored, 2) if stored else None,
+        }
+        if len(self) > 1:
+            span = float(self.timestamps[-1] - self.timestamps[0])
+            stats["fps"] = round((len(self) - 1) / span, 2) if span > 0 else None
+        return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python3 frame_store.py <store.fst>")
+        sys.exit(1)
+    store = FrameStore(sys.argv[1])
+    print(store.get_stats())
+    if len(store):
+        first = store.header(0)
+        print(f"frame 0: {first['shape']} {first['dtype']} {first['codec']} controls {first['controls']}")
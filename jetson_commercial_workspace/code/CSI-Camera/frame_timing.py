@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Frame timestamps, drop detection and jitter accounting
+
+Every captured frame gets a FrameStamp: the buffer timestamp reported by the
+capture backend (CAP_PROP_POS_MSEC, the GStreamer buffer PTS) and the
+monotonic time the frame reached Python. From consecutive stamps FrameTimer
+derives the frame interval, the jitter against the configured framerate and
+the frames the pipeline dropped on the way (an interval of about k periods
+means k - 1 frames never arrived). The buffer timestamp is used when the
+backend provides one, the arrival time otherwise.
+
+Values go into fixed-size rolling histograms, so memory and the cost of
+reporting stay constant however long the camera runs.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+# bucket upper bounds in ms, the last bucket takes everything above
+DEFAULT_EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class RollingHistogram:
+    """Histogram of the last `size` values"""
+
+    def __init__(self, size=512, edges=DEFAULT_EDGES_MS):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.values = np.zeros(size, dtype=np.float64)
+        self.buckets = np.zeros(size, dtype=np.int32)
+        self.counts = np.zeros(len(edges) + 1, dtype=np.int64)
+        self.n = 0                   # values ever added
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        bucket = int(np.searchsorted(self.edges, value, side="left"))
+        with self._lock:
+            i = self.n % self.values.size
+            if self.n >= self.values.size:
+                # the slot's old value leaves the window
+                self.counts[self.buckets[i]] -= 1
+            self.values[i] = value
+            self.buckets[i] = bucket
+            self.counts[bucket] += 1
+            self.n += 1
+
+    def get_stats(self):
+        with self._lock:
+            window = self.values[: min(self.n, self.values.size)].copy()
+            counts = self.counts.tolist()
+        if not window.size:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(window, (50, 95, 99))
+        labels = ["<=%g" % e for e in self.edges] + [">%g" % self.edges[-1]]
+        return {
+            "count": int(window.size),
+            "mean": round(float(window.mean()), 2),
+            "p50": round(float(p50), 2),
+            "p95": round(float(p95), 2),
+            "p99": round(float(p99), 2),
+            "max": round(float(window.max()), 2),
+            "histogram": dict(zip(labels, counts)),
+        }
+
+
+class FrameStamp:
+    __slots__ = ("index", "buffer_ms", "arrival")
+
+    def __init__(self, index, buffer_ms, arrival):
+        self.index = index
+        self.buffer_ms = buffer_ms   # backend buffer timestamp, None if unknown
+        self.arrival = arrival       # time.monotonic() when read() returned
+
+
+class FrameTimer:
+    def __init__(self, framerate, size=512):
+        self.framerate = framerate
+        self.period_ms = 1000.0 / framerate
+        self.interval = RollingHistogram(size)
+        self.jitter = RollingHistogram(size)
+        self.latency = RollingHistogram(size)
+
+        self.frames = 0
+        self.dropped = 0
+        self.source = None           # "buffer" or "arrival"
+        self._last = None
+
+    def reset(self):
+        # a reopened pipeline restarts its timestamps
+        self._last = None
+
+    # tag a frame that was just read, buffer_ms from cap.get(CAP_PROP_POS_MSEC)
+    def stamp(self, buffer_ms=None, arrival=None):
+        arrival = time.monotonic() if arrival is None else arrival
+        if buffer_ms is not None and buffer_ms <= 0:
+            buffer_ms = None
+        stamp = FrameStamp(self.frames, buffer_ms, arrival)
+        self.frames += 1
+
+        last = self._last
+        self._last = stamp
+        if last is None:
+            return stamp
+
+        if stamp.buffer_ms is not None and last.buffer_ms is not None:
+            interval_ms = stamp.buffer_ms - last.buffer_ms
+            self.source = "buffer"
+        else:
+            interval_ms = (stamp.arrival - last.arrival) * 1000.0
+            self.source = "arrival"
+        if interval_ms <= 0:
+            return stamp
+
+        periods = int(round(interval_ms / self.period_ms))
+        if periods > 1:
+            self.dropped += periods - 1
+        self.interval.add(interval_ms)
+        # deviation from the nearest whole number of frame periods,
+        # so a drop counts as a drop and not as jitter
+        self.jitter.add(abs(interval_ms - max(1, periods) * self.period_ms))
+        return stamp
+
+    # the frame, or an image made from it, became available to clients
+    def published(self, stamp, now=None):
+        now = time.monotonic() if now is None else now
+        self.latency.add((now - stamp.arrival) * 1000.0)
+
+    def get_stats(self):
+        expected = self.frames + self.dropped
+        return {
+            "framerate": self.framerate,
+            "timestamp_source": self.source,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "drop_rate": round(self.dropped / expected, 4) if expected else 0.0,
+            "interval_ms": self.interval.get_stats(),
+            "jitter_ms": self.jitter.get_stats(),
+            "latency_ms": self.latency.get_stats(),
+        }
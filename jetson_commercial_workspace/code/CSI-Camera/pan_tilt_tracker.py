@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Closed-loop pan-tilt tracking
+
+Every frame goes through four stages, each timed against its own budget:
+
+    capture -> detect -> control -> i2c
+
+The loop grabs the next frame first. Waiting for it is idle time and is
+reported on its own ("wait"), outside the budgets; "capture" is only the
+retrieve of the grabbed frame. Frame age counts from the capture time: the
+buffer timestamp for a live camera (mapped onto time.monotonic() by
+CaptureClock), the moment grab() returned otherwise. "total" is that age
+when the servo write finishes, so time a frame spent queued in the
+pipeline counts against the end-to-end budget.
+
+detect is the face DetectTrackScheduler (cascade every few frames,
+template tracking in between). control picks the largest face, turns its
+offset from the image center into an angle error and runs one PID per
+axis. The target position is first extrapolated by the frame's age using
+the target velocity, so the loop commands where the target is now rather
+than where it was at capture. i2c writes pan and tilt in one PCA9685 block
+write.
+
+A frame whose age since capture already exceeds the end-to-end budget at
+the control stage is not acted on: moving the head on stale data only adds
+overshoot.
+
+A replayed clip stands in for a wide scene: VirtualHead crops the part the
+head would see at the current pan / tilt angles, so servo commands move
+the view and the loop is closed without hardware.
+
+Run end to end on a recorded clip with a fake servo bus:
+    python3 pan_tilt_tracker.py clip.mp4
+or on the CSI camera and the real PCA9685:
+    python3 pan_tilt_tracker.py csi i2c
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from face_tracker import DetectTrackScheduler, load_cascade
+from frame_timing import RollingHistogram
+
+# servo driver lives with the servo tests
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "servo_led_pwm_tests"))
+from pca9685_driver import FakeSMBus, PCA9685, ServoDriver, open_bus
+
+
+PAN_CHANNEL = 12
+TILT_CHANNEL = 13
+# field of view of the lens in degrees (horizontal, vertical)
+FOV = (62.0, 37.0)
+
+# per stage budgets in ms, total is the end-to-end limit
+DEFAULT_BUDGET_MS = {
+    "capture": 10.0,
+    "detect": 25.0,
+    "control": 1.0,
+    "i2c": 2.0,
+    "total": 40.0,
+}
+STAGES = ("capture", "detect", "control", "i2c", "total")
+
+
+# capture time of a frame on the time.monotonic() clock from the backend
+# buffer timestamp (CAP_PROP_POS_MSEC, the GStreamer running time). The
+# smallest arrival - buffer offset seen is the quickest a frame got through
+# the pipeline; a frame that sat in the appsink queue comes out older than
+# its arrival by the time it waited. The fixed sensor-to-appsink latency is
+# not included.
+class CaptureClock:
+    def __init__(self):
+        self.offset = None
+        self.last_ms = None
+
+    def capture_time(self, buffer_ms, arrival):
+        if not buffer_ms or buffer_ms <= 0:
+            return arrival
+        if self.last_ms is not None and buffer_ms < self.last_ms:
+            # pipeline restarted, its running time did too
+            self.offset = None
+        self.last_ms = buffer_ms
+        offset = arrival - buffer_ms / 1000.0
+        if self.offset is None or offset < self.offset:
+            self.offset = offset
+        return buffer_ms / 1000.0 + self.offset
+
+
+class PID:
+    def __init__(self, kp=0.5, ki=0.05, kd=0.05, limit=10.0, integral_limit=20.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        # largest correction per update, degrees
+        self.limit = limit
+        self.integral_limit = integral_limit
+        self.integral = 0.0
+        self.last_error = None
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_error = None
+
+    def update(self, error, dt):
+        self.integral = float(np.clip(self.integral + error * dt, -self.integral_limit, self.integral_limit))
+        derivative = 0.0 if self.last_error is None or dt <= 0 else (error - self.last_error) / dt
+        self.last_error = error
+        out = self.kp * error + self.ki * self.integral + self.kd * derivative
+        return float(np.clip(out, -self.limit, self.limit))
+
+
+# constant velocity extrapolation of the target center
+class TargetPredictor:
+    def __init__(self, smoothing=0.5):
+        self.smoothing = smoothing
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.time = None
+
+    def reset(self):
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.time = None
+
+    def update(self, position, t):
+        position = np.asarray(position, dtype=np.float64)
+        if self.position is not None and t > self.time:
+            velocity = (position - self.position) / (t - self.time)
+            self.velocity = self.smoothing * velocity + (1.0 - self.smoothing) * self.velocity
+        self.position = position
+        self.time = t
+
+    def predict(self, t):
+        return self.position + self.velocity * (t - self.time)
+
+
+class PanTiltTracker:
+    # buffer_timestamps: take capture times from the backend (live cameras);
+    # a replayed file's position is not a capture clock
+    def __init__(self, servos, detector=None, frame_size=(960, 540), fov=FOV,
+                 budget_ms=None, pid_args=None, predict=True, buffer_timestamps=False):
+        # servos: ServoDriver for [pan, tilt]
+        self.servos = servos
+        if detector is None:
+            scheduler = DetectTrackScheduler(load_cascade("haarcascade_frontalface_default.xml"), None)
+            detector = scheduler.update
+        # detector(gray) -> [(box, eyes), ...]
+        self.detector = detector
+        self.frame_size = frame_size
+        self.fov = fov
+        self.budget_ms = dict(DEFAULT_BUDGET_MS, **(budget_ms or {}))
+        self.pan_pid = PID(**(pid_args or {}))
+        self.tilt_pid = PID(**(pid_args or {}))
+        self.predictor = TargetPredictor() if predict else None
+        self.clock = CaptureClock() if buffer_timestamps else None
+
+        self.angles = np.array([90.0, 90.0])
+        self.servos.set_angles(self.angles)
+        self.last_control = None
+
+        self.timings = {stage: RollingHistogram(512) for stage in STAGES}
+        # idle time in grab() waiting for the next frame, not budgeted
+        self.wait = RollingHistogram(512)
+        self.over_budget = {stage: 0 for stage in STAGES}
+        self.frames = 0
+        self.stale = 0
+        self.lost = 0
+
+    def _record(self, stage, ms):
+        self.timings[stage].add(ms)
+        if ms > self.budget_ms[stage]:
+            self.over_budget[stage] += 1
+
+    # one loop iteration, capture has grab() / retrieve() / get() like
+    # cv2.VideoCapture; False at end of stream
+    def step(self, capture):
+        t_wait = time.monotonic()
+        if not capture.grab():
+            return False
+        t_start = time.monotonic()
+        ret, frame = capture.retrieve()
+        t_retrieved = time.monotonic()
+        if not ret:
+            return False
+        t_captured = t_start
+        if self.clock is not None:
+            t_captured = min(t_start, self.clock.capture_time(capture.get(cv2.CAP_PROP_POS_MSEC), t_start))
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        results = self.detector(gray)
+        t_detected = time.monotonic()
+
+        command = self._control(results, t_captured, t_detected)
+        t_controlled = time.monotonic()
+
+        if command is not None:
+            self.servos.set_angles(command)
+        t_written = time.monotonic()
+
+        self.frames += 1
+        self.wait.add((t_start - t_wait) * 1000.0)
+        self._record("capture", (t_retrieved - t_start) * 1000.0)
+        self._record("detect", (t_detected - t_retrieved) * 1000.0)
+        self._record("control", (t_controlled - t_detected) * 1000.0)
+        self._record("i2c", (t_written - t_controlled) * 1000.0)
+        self._record("total", (t_written - t_captured) * 1000.0)
+        return True
+
+    def _control(self, results, t_captured, now):
+        if not results:
+            self.lost += 1
+            self.pan_pid.reset()
+            self.tilt_pid.reset()
+            if self.predictor:
+                self.predictor.reset()
+            return None
+
+        # frame is older than the whole budget since capture, do not steer on it
+        if (now - t_captured) * 1000.0 > self.budget_ms["total"]:
+            self.stale += 1
+            return None
+
+        (x, y, w, h), _ = max(results, key=lambda r: r[0][2] * r[0][3])
+        center = np.array([x + w / 2.0, y + h / 2.0])
+        if self.predictor:
+            self.predictor.update(center, t_captured)
+            # where the target is by the time the servos move
+            center = self.predictor.predict(now)
+
+        size = np.array(self.frame_size, dtype=np.float64)
+        error = (center / size - 0.5) * np.array(self.fov)   # degrees off center
+        dt = now - self.last_control if self.last_control else 0.0
+        self.last_control = now
+
+        # pan right for a target on the right, tilt down for one below center
+        self.angles = np.clip(
+            self.angles + [self.pan_pid.update(error[0], dt), self.tilt_pid.update(error[1], dt)],
+            0.0, 180.0,
+        )
+        return self.angles
+
+    def get_stats(self):
+        stats = {
+            "frames": self.frames,
+            "stale": self.stale,
+            "lost": self.lost,
+            "angles": [round(float(a), 2) for a in self.angles],
+            "stages": {},
+        }
+        for stage in STAGES:
+            s = self.timings[stage].get_stats()
+            s.pop("histogram", None)
+            s["budget_ms"] = self.budget_ms[stage]
+            s["over_budget"] = self.over_budget[stage]
+            stats["stages"][stage] = s
+        wait = self.wait.get_stats()
+        wait.pop("histogram", None)
+        stats["wait"] = wait
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"frames: {stats['frames']}  stale: {stats['stale']}  no target: {stats['lost']}")
+        print(f"{'stage':8} {'p50':>7} {'p95':>7} {'max':>7} {'budget':>7} {'over':>6}")
+        for stage, s in stats["stages"].items():
+            if not s["count"]:
+                continue
+            print(f"{stage:8} {s['p50']:7.2f} {s['p95']:7.2f} {s['max']:7.2f} "
+                  f"{s['budget_ms']:7.1f} {s['over_budget']:6d}")
+        if stats["wait"]["count"]:
+            w = stats["wait"]
+            print(f"{'wait':8} {w['p50']:7.2f} {w['p95']:7.2f} {w['max']:7.2f}       -      -")
+
+
+# view of a replayed frame through a pan-tilt head
+# the crop is view_fraction of the clip and covers the lens field of view
+class VirtualHead:
+    def __init__(self, capture, tracker, view_fraction=0.5):
+        self.capture = capture
+        self.tracker = tracker
+        self.view_fraction = view_fraction
+
+    def grab(self):
+        return self.capture.grab()
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def retrieve(self):
+        ret, frame = self.capture.retrieve()
+        if not ret:
+            return ret, frame
+        h, w = frame.shape[:2]
+        vw, vh = int(w * self.view_fraction), int(h * self.view_fraction)
+        px_per_deg = np.array([vw / self.tracker.fov[0], vh / self.tracker.fov[1]])
+        offset = (self.tracker.angles - 90.0) * px_per_deg
+        x = int(np.clip((w - vw) / 2.0 + offset[0], 0, w - vw))
+        y = int(np.clip((h - vh) / 2.0 + offset[1], 0, h - vh))
+        return True, frame[y:y + vh, x:x + vw]
+
+
+def run(source="csi", bus="fake", realtime=True):
+    if source == "csi":
+        pipeline = (
+            "nvarguscamerasrc sensor-id=0 ! "
+            "video/x-raw(memory:NVMM), width=1920, height=1080, framerate=30/1 ! "
+            "nvvidconv ! video/x-raw, width=960, height=540, format=(string)BGRx ! "
+            "videoconvert ! video/x-raw, format=(string)BGR ! appsink drop=true max-buffers=1"
+        )
+        capture = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+        frame_period = 0.0
+    else:
+        capture = cv2.VideoCapture(source)
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_period = 1.0 / fps if realtime else 0.0
+    if not capture.isOpened():
+        print("Unable to open " + source)
+        return None
+
+    smbus = open_bus(0) if bus == "i2c" else FakeSMBus(write_delay=0.0004)
+    pca = PCA9685(smbus)
+    tracker = PanTiltTracker(ServoDriver(pca, [PAN_CHANNEL, TILT_CHANNEL]), buffer_timestamps=source == "csi")
+    frames = capture if source == "csi" else VirtualHead(capture, tracker)
+
+    # replayed clips are paced at their own frame rate
+    next_frame = time.monotonic()
+    try:
+        while tracker.step(frames):
+            if frame_period:
+                next_frame += frame_period
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if tracker.frames % 100 == 0:
+                tracker.print_stats()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.release()
+    tracker.print_stats()
+    print(pca.get_stats())
+    return tracker
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python3 pan_tilt_tracker.py <clip | csi> [fake | i2c]")
+        sys.exit(1)
+    run(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "fake")
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Declarative v4l2 control presets
+
+Presets live in a JSON file (presets.json next to this module):
+
+    {
+        "nighttime": {"controls": {"gain": 12064, "exposure": 140000}, "ramp_frames": 10},
+        ...
+    }
+
+A preset is checked against the control ranges reported by
+`v4l2-ctl --list-ctrls` (queried once per device and cached), snapped to
+each control's step and compiled into batches holding only the controls
+that differ from the last values written. Every batch goes to the device
+as a single `v4l2-ctl --set-ctrl=a=1,b=2` call. With ramp_frames > 1 the
+values move linearly over that many frames, one batch per frame, driven
+by calling on_frame() from the capture loop.
+
+Controls the device does not have are left out of the batches and
+reported as skipped, values outside a control's range are an error.
+
+A preset may give "target_level" (mean 0-255, optionally "max_exposure")
+instead of gain and exposure. They are then looked up in the response
+table written by calibrate.py, see load_response().
+
+Usage:
+    engine = PresetEngine("/dev/video0")
+    engine.load()
+    engine.apply("nighttime")
+    while True:
+        ret, frame = cap.read()
+        engine.on_frame()
+"""
+
+import json
+import os
+import re
+import subprocess
+import threading
+
+
+PRESETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "presets.json")
+
+# "   gain 0x009a2009 (int64)  : min=0 max=27000 step=26 default=0 value=3016 flags=slider"
+_CTRL_LINE = re.compile(r"^\s*(\w+)\s+0x[0-9a-fA-F]+\s+\((\w+)\)\s*:(.*)$")
+
+_range_cache = {}
+_range_lock = threading.Lock()
+
+
+class PresetError(ValueError):
+    pass
+
+
+class ControlRange:
+    def __init__(self, name, type, minimum=None, maximum=None, step=1, default=None, value=None, flags=()):
+        self.name = name
+        self.type = type
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step or 1
+        self.default = default
+        self.value = value
+        self.flags = flags
+
+    @property
+    def writable(self):
+        return "read-only" not in self.flags and self.type not in ("button",)
+
+    # value in range and on the step grid, raises PresetError
+    def validate(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise PresetError(f"{self.name}: value must be a number, got {value!r}")
+        if self.minimum is not None and value < self.minimum:
+            raise PresetError(f"{self.name}: {value} below minimum {self.minimum}")
+        if self.maximum is not None and value > self.maximum:
+            raise PresetError(f"{self.name}: {value} above maximum {self.maximum}")
+        return self.snap(value)
+
+    def snap(self, value):
+        base = self.minimum or 0
+        value = base + int(round((value - base) / float(self.step))) * self.step
+        if self.maximum is not None:
+            value = min(value, self.maximum)
+        return int(value)
+
+
+def parse_ctrl_list(text):
+    """{name: ControlRange} from `v4l2-ctl --list-ctrls` output"""
+    ranges = {}
+    for line in text.splitlines():
+        match = _CTRL_LINE.match(line)
+        if not match:
+            continue
+        name, ctype, rest = match.groups()
+        rest, _, flag_text = rest.partition("flags=")
+        flags = tuple(f.strip() for f in flag_text.split(",") if f.strip())
+        fields = {}
+        for item in rest.split():
+            key, _, val = item.partition("=")
+            try:
+                fields[key] = int(val)
+            except ValueError:
+                pass
+        if ctype == "bool":
+            fields.setdefault("min", 0)
+            fields.setdefault("max", 1)
+        ranges[name] = ControlRange(
+            name, ctype, fields.get("min"), fields.get("max"), fields.get("step", 1),
+            fields.get("default"), fields.get("value"), flags,
+        )
+    return ranges
+
+
+def query_ranges(device, refresh=False):
+    """Control ranges of a device, None if v4l2-ctl cannot be run"""
+    with _range_lock:
+        if device in _range_cache and not refresh:
+            return _range_cache[device]
+    try:
+        result = subprocess.run(["v4l2-ctl", "-d", device, "--list-ctrls"],
+                                capture_output=True, text=True)
+        ranges = parse_ctrl_list(result.stdout) if result.returncode == 0 else None
+    except FileNotFoundError:
+        ranges = None
+    with _range_lock:
+        _range_cache[device] = ranges
+    return ranges
+
+
+def load_presets(path=PRESETS_FILE):
+    with open(path) as f:
+        presets = json.load(f)
+    for name, preset in presets.items():
+        if not isinstance(preset.get("controls"), dict):
+            raise PresetError(f"Preset '{name}' has no controls")
+    return presets
+
+
+class PresetPlan:
+    """Compiled preset: one batch of control changes per frame"""
+
+    def __init__(self, name, batches, skipped):
+        self.name = name
+        self.batches = batches       # [ {control: value}, ... ], empty batches removed
+        self.skipped = skipped       # controls the device does not have
+        self.next = 0
+
+    @property
+    def done(self):
+        return self.next >= len(self.batches)
+
+    @property
+    def writes(self):
+        return len(self.batches)
+
+
+class PresetEngine:
+    def __init__(self, device="/dev/video0", ranges=None, presets=None):
+        # None = no device (replayed / synthetic source), writes only update state
+        self.device = device
+        # None = not queried yet, {} after a failed query disables validation
+        self._ranges = {} if device is None and ranges is None else ranges
+        self.presets = presets or {}
+        # last value written per control
+        self.state = {}
+        self.lock = threading.Lock()
+        self.transition = None
+        self._step_lock = threading.Lock()
+        self.active = None
+        self.writes = 0
+        # calibrate.ResponseTable for target_level presets
+        self.response = None
+
+    @property
+    def ranges(self):
+        if self._ranges is None:
+            self._ranges = query_ranges(self.device) or {}
+        return self._ranges
+
+    def load(self, path=PRESETS_FILE):
+        self.presets = load_presets(path)
+        return self.presets
+
+    # response table from calibrate.py, False if there is none yet
+    def load_response(self, path=None):
+        from calibrate import RESPONSE_FILE, ResponseTable
+
+        path = path or RESPONSE_FILE
+        if not os.path.exists(path):
+            return False
+        self.response = ResponseTable.load(path)
+        return True
+
+    # controls of a preset, target_level resolved through the response table
+    def preset_controls(self, name):
+        preset = self.presets.get(name)
+        if preset is None:
+            raise PresetError(f"Unknown preset: {name}")
+        controls = dict(preset["controls"])
+        if "target_level" in preset:
+            if self.response is None:
+                raise PresetError(f"Preset '{name}' needs a response table, run calibrate.py")
+            gain, exposure = self.response.solve(preset["target_level"], preset.get("max_exposure"))
+            controls.update({"gain": gain, "exposure": exposure})
+        return controls
+
+    # validate controls, returns ({control: value}, skipped names)
+    def validate(self, controls):
+        ranges = self.ranges
+        valid = {}
+        skipped = []
+        for name, value in controls.items():
+            if not ranges:
+                valid[name] = int(value)
+                continue
+            control = ranges.get(name)
+            if control is None or not control.writable:
+                skipped.append(name)
+                continue
+            valid[name] = control.validate(value)
+        return valid, skipped
+
+    def compile(self, name, ramp_frames=None, force=False):
+        controls = self.preset_controls(name)
+        if ramp_frames is None:
+            ramp_frames = self.presets[name].get("ramp_frames", 0)
+        return self.compile_controls(controls, ramp_frames, name=name, force=force)
+
+    # diff batches that take the device from the last written state to controls
+    def compile_controls(self, controls, ramp_frames=0, name=None, force=False):
+        target, skipped = self.validate(controls)
+        if controls and not target:
+            raise PresetError(f"None of the controls in '{name or 'request'}' exist on {self.device}")
+
+        with self.lock:
+            start = dict(self.state)
+        frames = max(1, int(ramp_frames or 1))
+        batches = []
+        previous = {} if force else dict(start)
+        for i in range(1, frames + 1):
+            batch = {}
+            for control, end in target.items():
+                begin = start.get(control)
+                if begin is None or i == frames:
+                    value = end
+                else:
+                    value = begin + (end - begin) * i / float(frames)
+                    value = self.ranges[control].snap(value) if control in self.ranges else int(round(value))
+                if previous.get(control) != value:
+                    batch[control] = value
+                    previous[control] = value
+            if batch:
+                batches.append(batch)
+        return PresetPlan(name, batches, skipped)
+
+    # one v4l2-ctl call for the whole batch, raises CalledProcessError
+    def write(self, batch):
+        if not batch:
+            return
+        if self.device is not None:
+            ctrls = ",".join(f"{k}={v}" for k, v in batch.items())
+            subprocess.run(["v4l2-ctl", "-d", self.device, f"--set-ctrl={ctrls}"], check=True)
+        with self.lock:
+            self.state.update(batch)
+            self.writes += 1
+
+    # start a preset, the first batch is written now, the rest by on_frame()
+    def apply(self, name, ramp_frames=None):
+        plan = self.compile(name, ramp_frames)
+        self.transition = plan
+        self.active = name
+        self.on_frame()
+        return plan
+
+    # write controls right away, only those that changed unless force
+    def set_controls(self, controls, force=False):
+        plan = self.compile_controls(controls, force=force)
+        self.transition = None
+        for batch in plan.batches:
+            self.write(batch)
+        return plan
+
+    # write the last written state again after the device lost it (pipeline
+    # reopened), a running ramp carries on from there
+    # defaults cover controls that were never written
+    def restore(self, defaults=None):
+        with self.lock:
+            controls = dict(defaults or {}, **self.state)
+        plan = self.compile_controls(controls, force=True)
+        for batch in plan.batches:
+            self.write(batch)
+        return plan
+
+    # advance a running ramp by one frame, True while it has more batches
+    def on_frame(self):
+        with self._step_lock:
+            plan = self.transition
+            if plan is None:
+                return False
+            if not plan.done:
+                batch = plan.batches[plan.next]
+                plan.next += 1
+                self.write(batch)
+            if plan.done:
+                self.transition = None
+                return False
+            return True
+
+    def get_status(self):
+        plan = self.transition
+        return {
+            "active": self.active,
+            "ramping": plan is not None,
+            "ramp_progress": f"{plan.next}/{plan.writes}" if plan else None,
+            "writes": self.writes,
+            "state": dict(self.state),
+            "presets": sorted(self.presets),
+        }
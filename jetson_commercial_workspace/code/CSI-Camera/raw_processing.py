@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Raw Bayer processing for the IMX183
+
+Turns raw sensor buffers (from V4L2Capture or a recording) into images:
+
+    unpack -> black level -> demosaic (OpenCV) -> BGR
+    preview: 2x2 Bayer cells binned straight from the buffer, half resolution
+
+Packed MIPI formats are unpacked with NumPy slicing, no Python loops:
+
+    RAW10  4 pixels in 5 bytes: 4 high bytes, then one byte of 2 bit lows
+    RAW12  2 pixels in 3 bytes: 2 high bytes, then one byte of 4 bit lows
+
+16 bit container formats (RG10 / RG12) are used as they are, shifted down
+if the samples are MSB aligned.
+
+The preview skips unpacking altogether: the high bytes already are an 8 bit
+image, each Bayer cell becomes one BGR pixel (the two greens averaged).
+
+All outputs go into buffers allocated once per RawProcessor. The arrays
+returned are those buffers, so copy them if they must outlive the next call.
+
+The sensor's black_level control runs 0..100000 (see "thong so camera"),
+it is read as a fraction of full scale in 1/100000 steps; pass black= in
+sensor counts to override.
+
+Usage:
+    proc = RawProcessor(5440, 3648, bits=12, packed=True, black_level=1000)
+    bgr = proc.process(buffer)       # full resolution, 8 bit BGR
+    small = proc.preview(buffer)     # 2720x1824 BGR
+    python3 raw_processing.py [width height bits]     # benchmark on synthetic frames
+"""
+
+import sys
+import time
+
+import cv2
+import numpy as np
+
+
+# OpenCV names Bayer codes after the second row, so RGGB is "BG"
+BAYER_TO_BGR = {
+    "RGGB": cv2.COLOR_BayerBG2BGR,
+    "BGGR": cv2.COLOR_BayerRG2BGR,
+    "GRBG": cv2.COLOR_BayerGB2BGR,
+    "GBRG": cv2.COLOR_BayerGR2BGR,
+}
+
+# V4L2 fourcc -> (pattern, bits, packed)
+RAW_FORMATS = {
+    "pRAA": ("RGGB", 10, True), "pBAA": ("BGGR", 10, True),
+    "pgAA": ("GRBG", 10, True), "pGAA": ("GBRG", 10, True),
+    "pRCC": ("RGGB", 12, True), "pBCC": ("BGGR", 12, True),
+    "pgCC": ("GRBG", 12, True), "pGCC": ("GBRG", 12, True),
+    "RG10": ("RGGB", 10, False), "BG10": ("BGGR", 10, False),
+    "GR10": ("GRBG", 10, False), "GB10": ("GBRG", 10, False),
+    "RG12": ("RGGB", 12, False), "BG12": ("BGGR", 12, False),
+    "GR12": ("GRBG", 12, False), "GB12": ("GBRG", 12, False),
+}
+
+BLACK_LEVEL_FULL_SCALE = 100000
+
+
+def black_level_counts(black_level, bits):
+    """Sensor black_level control value -> offset in raw counts"""
+    return int(round(black_level / BLACK_LEVEL_FULL_SCALE * ((1 << bits) - 1)))
+
+
+def packed_row_bytes(width, bits):
+    return width * bits // 8
+
+
+def pack_raw(raw, bits):
+    """uint16 samples -> packed MIPI bytes, (h, row bytes) uint8; the inverse of unpacking"""
+    raw = np.asarray(raw, dtype=np.uint16)
+    h, w = raw.shape
+    if bits == 12:
+        p = raw.reshape(h, w // 2, 2)
+        out = np.empty((h, w // 2, 3), dtype=np.uint8)
+        out[..., 0] = p[..., 0] >> 4
+        out[..., 1] = p[..., 1] >> 4
+        out[..., 2] = (p[..., 0] & 0xF) | ((p[..., 1] & 0xF) << 4)
+    elif bits == 10:
+        p = raw.reshape(h, w // 4, 4)
+        out = np.empty((h, w // 4, 5), dtype=np.uint8)
+        out[..., :4] = p >> 2
+        out[..., 4] = ((p[..., 0] & 3) | ((p[..., 1] & 3) << 2)
+                       | ((p[..., 2] & 3) << 4) | ((p[..., 3] & 3) << 6))
+    else:
+        raise ValueError(f"Packed {bits} bit is not supported (10 or 12)")
+    return out.reshape(h, -1)
+
+
+def mosaic(bgr, pattern="RGGB", bits=12):
+    """BGR image -> Bayer samples of the given pattern, for synthetic raw frames"""
+    h, w = bgr.shape[:2]
+    scale = ((1 << bits) - 1) / 255.0
+    raw = np.empty((h, w), dtype=np.uint16)
+    channel = {"R": 2, "G": 1, "B": 0}
+    for i, color in enumerate(pattern):
+        r, c = divmod(i, 2)
+        raw[r::2, c::2] = (bgr[r::2, c::2, channel[color]] * scale).astype(np.uint16)
+    return raw
+
+
+class RawProcessor:
+    def __init__(self, width, height, bits=12, packed=True, pattern="RGGB",
+                 black_level=0, black=None, msb_aligned=False):
+        if pattern not in BAYER_TO_BGR:
+            raise ValueError(f"Unknown Bayer pattern: {pattern}")
+        if packed and bits not in (10, 12):
+            raise ValueError(f"Packed {bits} bit is not supported (10 or 12)")
+        self.width = width
+        self.height = height
+        self.bits = bits
+        self.packed = packed
+        self.pattern = pattern
+        # samples of a container format sit in the top bits
+        self.shift = 16 - bits if msb_aligned else 0
+        self.black = black_level_counts(black_level, bits) if black is None else int(black)
+        self.white = (1 << bits) - 1
+
+        h, w = height, width
+        self.raw = np.empty((h, w), dtype=np.uint16)
+        self.raw8 = np.empty((h, w), dtype=np.uint8)
+        self.bgr = np.empty((h, w, 3), dtype=np.uint8)
+        self.bgr16 = np.empty((h, w, 3), dtype=np.uint16)
+        self.small = np.empty((h // 2, w // 2, 3), dtype=np.uint8)
+        self._lows = np.empty((h, w // 2 if bits == 12 else w // 4), dtype=np.uint16)
+        self._green = np.empty((h // 2, w // 2), dtype=np.uint16)
+
+        self.timings = {}
+
+    @classmethod
+    def for_format(cls, fourcc, width, height, **kwargs):
+        pattern, bits, packed = RAW_FORMATS[fourcc]
+        return cls(width, height, bits=bits, packed=packed, pattern=pattern, **kwargs)
+
+    def set_black_level(self, black_level):
+        self.black = black_level_counts(black_level, self.bits)
+
+    def _rows(self, buffer):
+        """Buffer -> (height, bytes or samples per row) array, stride padding cut off"""
+        if self.packed:
+            if not isinstance(buffer, np.ndarray):
+                data = np.frombuffer(buffer, dtype=np.uint8)
+                buffer = data.reshape(self.height, data.size // self.height)
+            return buffer[:, :packed_row_bytes(self.width, self.bits)]
+        if not isinstance(buffer, np.ndarray):
+            data = np.frombuffer(buffer, dtype=np.uint16)
+            buffer = data.reshape(self.height, data.size // self.height)
+        return buffer[:, :self.width]
+
+    def unpack(self, buffer):
+        """Buffer -> self.raw (uint16 samples, black level subtracted)"""
+        t = time.monotonic()
+        rows = self._rows(buffer)
+        raw = self.raw
+        if not self.packed:
+            if self.shift:
+                np.right_shift(rows, self.shift, out=raw)
+            else:
+                np.copyto(raw, rows)
+        elif self.bits == 12:
+            g = rows.reshape(self.height, self.width // 2, 3)
+            lows = g[..., 2]
+            for k in range(2):
+                out = raw[:, k::2]
+                np.left_shift(g[..., k], 4, out=out, dtype=np.uint16)
+                np.right_shift(lows, 4 * k, out=self._lows, dtype=np.uint16)
+                np.bitwise_and(self._lows, 0xF, out=self._lows)
+                np.bitwise_or(out, self._lows, out=out)
+        else:
+            g = rows.reshape(self.height, self.width // 4, 5)
+            lows = g[..., 4]
+            for k in range(4):
+                out = raw[:, k::4]
+                np.left_shift(g[..., k], 2, out=out, dtype=np.uint16)
+                np.right_shift(lows, 2 * k, out=self._lows, dtype=np.uint16)
+                np.bitwise_and(self._lows, 3, out=self._lows)
+                np.bitwise_or(out, self._lows, out=out)
+        if self.black:
+            # saturating subtract, uint16 would wrap below the black level
+            cv2.subtract(raw, self.black, dst=raw)
+        self.timings["unpack"] = time.monotonic() - t
+        return raw
+
+    def process(self, buffer, depth=8):
+        """Full resolution BGR, 8 bit (scaled to the usable range) or 16 bit"""
+        raw = self.unpack(buffer)
+        t = time.monotonic()
+        code = BAYER_TO_BGR[self.pattern]
+        if depth == 16:
+            out = cv2.cvtColor(raw, code, dst=self.bgr16)
+        else:
+            # scale before demosaicing, 8 bit demosaic is about twice as fast
+            cv2.convertScaleAbs(raw, dst=self.raw8, alpha=255.0 / max(1, self.white - self.black))
+            out = cv2.cvtColor(self.raw8, code, dst=self.bgr)
+        self.timings["demosaic"] = time.monotonic() - t
+        return out
+
+    def preview(self, buffer):
+        """Half resolution 8 bit BGR, one pixel per Bayer cell"""
+        t = time.monotonic()
+        rows = self._rows(buffer)
+        h2, w2 = self.height // 2, self.width // 2
+        planes = {}
+        for i, color in enumerate(self.pattern):
+            r, c = divmod(i, 2)
+            planes.setdefault(color, []).append(self._plane(rows, r, c))
+
+        small = self.small
+        for channel, color in ((0, "B"), (2, "R")):
+            self._copy_plane(small[..., channel], planes[color][0])
+        g1, g2 = planes["G"]
+        green = self._green
+        if self.packed:
+            np.add(g1, g2, out=self._plane_out(green, g1), dtype=np.uint16)
+        else:
+            # container samples, bring both down to 8 bit first
+            shift = self.bits - 8 + self.shift
+            np.add(g1 >> shift, g2 >> shift, out=green, dtype=np.uint16)
+        np.right_shift(green, 1, out=small[..., 1], casting="unsafe")
+        black8 = self.black >> (self.bits - 8)
+        if black8:
+            cv2.subtract(small, (black8, black8, black8, 0), dst=small)
+        self.timings["preview"] = time.monotonic() - t
+        return small
+
+    # one Bayer phase (row parity r, column parity c)
+    # packed: high bytes only, already 8 bit, shaped like the packed groups
+    def _plane(self, rows, r, c):
+        if not self.packed:
+            return rows[r::2, c::2]
+        if self.bits == 12:
+            return rows.reshape(self.height, self.width // 2, 3)[r::2, :, c]
+        # RAW10: pixels 0..3 of a group, the phase picks 0,2 or 1,3
+        return rows.reshape(self.height, self.width // 4, 5)[r::2, :, c:4:2]
+
+    # view of a (h/2, w/2) output laid out like a packed plane
+    def _plane_out(self, out, plane):
+        view = out.view()
+        view.shape = plane.shape     # raises instead of silently copying
+        return view
+
+    def _copy_plane(self, out, plane):
+        if self.packed:
+            np.copyto(self._plane_out(out, plane), plane)
+        else:
+            shift = self.bits - 8 + self.shift
+            np.right_shift(plane, shift, out=out, casting="unsafe")
+
+    def get_timings(self):
+        return {name: round(seconds * 1000.0, 2) for name, seconds in self.timings.items()}
+
+
+def synthetic_raw(width, height, bits=12, packed=True, pattern="RGGB", black=0):
+    """A test pattern frame as the sensor would deliver it"""
+    from frame_source import SyntheticSource
+    bgr = SyntheticSource((width, height), realtime=False).render(7)
+    raw = mosaic(bgr, pattern, bits)
+    raw = np.minimum(raw.astype(np.uint32) + black, (1 << bits) - 1).astype(np.uint16)
+    return (pack_raw(raw, bits) if packed else raw), raw
+
+
+def benchmark(width=5440, height=3648, bits=12, repeat=5):
+    results = {}
+    for packed in (True, False):
+        buffer, reference = synthetic_raw(width, height, bits, packed, black=64)
+        proc = RawProcessor(width, height, bits=bits, packed=packed, black=64)
+        unpacked = proc.unpack(buffer)
+        if not np.array_equal(unpacked, np.maximum(reference, 64) - 64):
+            raise AssertionError("unpack does not match the packed samples")
+
+        name = f"RAW{bits} {'packed' if packed else '16 bit'}"
+        stages = {
+            "unpack": lambda: proc.unpack(buffer),
+            "process 8 bit": lambda: proc.process(buffer),
+            "process 16 bit": lambda: proc.process(buffer, depth=16),
+            "preview": lambda: proc.preview(buffer),
+        }
+        results[name] = {}
+        for stage, fn in stages.items():
+            fn()                                  # warm up
+            t = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            ms = (time.perf_counter() - t) / repeat * 1000.0
+            results[name][stage] = round(ms, 1)
+
+    megapixels = width * height / 1e6
+    print(f"{width}x{height} ({megapixels:.1f} MP), {repeat} runs, ms per frame")
+    for name, stages in results.items():
+        print(name)
+        for stage, ms in stages.items():
+            print(f"  {stage:15} {ms:8.1f} ms  {megapixels / ms * 1000.0:7.1f} MP/s")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (1, 4):
+        print("usage: python3 raw_processing.py [width height bits]")
+        sys.exit(1)
+    if len(sys.argv) == 4:
+        benchmark(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        benchmark()
@@ -7,6 +7,8 @@
 
 import cv2
 
+from frame_store import FrameStore
+
 """ 
 gstreamer_pipeline returns a GStreamer pipeline for capturing from the CSI camera
 Flip the image by setting the flip_method (most common values: 0 and 2)
@@ -48,6 +50,8 @@ def show_camera():
     # To flip the image, modify the flip_method parameter (0 and 2 are the most common)
     print(gstreamer_pipeline(flip_method=0))
     video_capture = cv2.VideoCapture(gstreamer_pipeline(flip_method=0), cv2.CAP_GSTREAMER)
+    # frames saved with 's' are appended here, lossless
+    captures = None
     if video_capture.isOpened():
         try:
             window_handle = cv2.namedWindow(window_title, cv2.WINDOW_AUTOSIZE)
@@ -66,10 +70,14 @@ def show_camera():
                 if keyCode == 27 or keyCode == ord('q'):
                     break
                 if keyCode == ord('s'):
-                    filename = "image.png"
-                    cv2.imwrite(filename, frame)
-                    print("saved photo")
+                    if captures is None:
+                        captures = FrameStore("captures.fst", "a", codec="zlib")
+                    number = captures.append(frame)
+                    captures.flush()
+                    print("saved frame %d to captures.fst" % number)
         finally:
+            if captures is not None:
+                captures.close()
             video_capture.release()
             cv2.destroyAllWindows()
     else:
@@ -6,10 +6,11 @@
 # Drivers for the camera and OpenCV are included in the base image
 
 import cv2
-import numpy as np
 import subprocess
 import time
 
+from strip_parallel import StripExecutor, make_op
+
 subprocess.run("v4l2-ctl -d /dev/video0 --set-ctrl=black_level=1", shell=True)
 
 time.sleep(.05)
@@ -21,13 +22,16 @@ display_width and display_height determine the size of each camera pane in the w
 Default 1920x1080 displayd in a 1/4 size window
 """
 
+# per-pixel adjustments run strip-parallel on all cores
+# results land in buffers reused by the executor between frames
+executor = StripExecutor()
+
 # image adjustment
 def adjust_image(image, contrast=1.0, brightness=0, exposure=0, shadows=0, highlights=0, whites=0, blacks=0):
-    # scaling image for exposure
-    image = np.clip(image * (2 ** exposure), 0, 255).astype(np.uint8)
-
-    # constrast, brightness
-    image = cv2.convertScaleAbs(image, alpha=contrast, beta=brightness)
+    # exposure scaling, contrast and brightness folded into one lookup table
+    image = executor.run(image, [
+        make_op("exposure_contrast", contrast=contrast, brightness=brightness, exposure=exposure),
+    ])
 
     # # convert img to floar32
     # img_float = np.float32(image) / 255.0
@@ -52,54 +56,29 @@ def adjust_image(image, contrast=1.0, brightness=0, exposure=0, shadows=0, highl
 # Function to adjust Temperature (makes the image warmer or cooler)
 def adjust_temperature(image, temp):
     # Blue to Red adjustment (Increase Red and decrease Blue to warm the image)
-    temp_image = image.copy()
-    if temp > 0:
-        temp_image[:, :, 2] = np.clip(temp_image[:, :, 2] + temp * 1.5, 0, 255)  # Increase Red
-        temp_image[:, :, 0] = np.clip(temp_image[:, :, 0] - temp * 1.5, 0, 255)  # Decrease Blue
-    elif temp < 0:
-        temp_image[:, :, 2] = np.clip(temp_image[:, :, 2] + temp * 1.5, 0, 255)  # Increase Red
-        temp_image[:, :, 0] = np.clip(temp_image[:, :, 0] + abs(temp) * 1.5, 0, 255)  # Increase Blue
-    return temp_image
+    return executor.run(image, [make_op("temperature", temp=temp)])
 
 # Function to adjust Tint (green to magenta)
 def adjust_tint(image, tint):
     # Increase or decrease the green/magenta tint
-    tint_image = image.copy()
-    if tint > 0:
-        tint_image[:, :, 1] = np.clip(tint_image[:, :, 1] + tint * 2, 0, 255)  # Increase Green
-    elif tint < 0:
-        tint_image[:, :, 1] = np.clip(tint_image[:, :, 1] + tint * 2, 0, 255)  # Decrease Green
-    return tint_image
+    return executor.run(image, [make_op("tint", tint=tint)])
 
 # Function to adjust Vibrance (boosts less saturated colors)
 def adjust_vibrance(image, vibrance):
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    h, s, v = cv2.split(hsv_image)
-    
-    # Scale the saturation based on vibrance
-    s = np.clip(s + vibrance, 0, 255)
-    hsv_image = cv2.merge([h, s, v])
-    vibrance_image = cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
-    return vibrance_image
+    return executor.run(image, [make_op("vibrance", vibrance=vibrance)])
 
 # Function to adjust Saturation (boosts or reduces all colors equally)
 def adjust_saturation(image, saturation):
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    h, s, v = cv2.split(hsv_image)
-    
-    # Scale the saturation value
-    s = np.clip(s * (1 + saturation / 100.0), 0, 255)
-    hsv_image = cv2.merge([h, s, v])
-    saturation_image = cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
-    return saturation_image
+    return executor.run(image, [make_op("saturation", saturation=saturation)])
 
 def adjust_color(image, temp=0, tint=0, vibrance=0, saturation=0):
-    # Apply temperature, tint, vibrance, and saturation adjustments
-    image = adjust_temperature(image, temp)
-    image = adjust_tint(image, tint)
-    image = adjust_vibrance(image, vibrance)
-    # image = adjust_saturation(image, saturation)
-    return image
+    # Apply temperature, tint and vibrance in a single pass over the frame
+    return executor.run(image, [
+        make_op("temperature", temp=temp),
+        make_op("tint", tint=tint),
+        make_op("vibrance", vibrance=vibrance),
+        # make_op("saturation", saturation=saturation),
+    ])
 
 def gstreamer_pipeline(
     sensor_id=0,
@@ -8,6 +8,9 @@
 import cv2
 import numpy as np
 
+from awb import AutoWhiteBalance
+from strip_parallel import StripExecutor, make_op
+
 """ 
 gstreamer_pipeline returns a GStreamer pipeline for capturing from the CSI camera
 Flip the image by setting the flip_method (most common values: 0 and 2)
@@ -77,6 +80,15 @@ def show_camera():
     g_gain = 1
     r_gain = 1
 
+    # auto white balance replaces the fixed gains above when enabled
+    # off by default so captures keep the fixed gains, 'w' toggles it while running
+    auto_white_balance = False
+    awb = AutoWhiteBalance(method="gray_world", interval=10)
+
+    # gains are applied in place, strip-parallel and saturating at 255
+    executor = StripExecutor()
+    gain_op = make_op("channel_gain", b_gain=b_gain, g_gain=g_gain, r_gain=r_gain)
+
     # To flip the image, modify the flip_method parameter (0 and 2 are the most common)
     print(gstreamer_pipeline(flip_method=0))
     video_capture = cv2.VideoCapture(gstreamer_pipeline(flip_method=0), cv2.CAP_GSTREAMER)
@@ -89,11 +101,10 @@ def show_camera():
                 # Under GTK+ (Jetson Default), WND_PROP_VISIBLE does not work correctly. Under Qt it does
                 # GTK - Substitute WND_PROP_AUTOSIZE to detect if window has been closed by user
                 if cv2.getWindowProperty(window_title, cv2.WND_PROP_AUTOSIZE) >= 0:
-                    frame[:, :, 0] = frame[:, :, 0] * b_gain
-                    frame[:, :, 1] = frame[:, :, 1] * g_gain
-                    frame[:, :, 2] = frame[:, :, 2] * r_gain
-                    
-                    # frame = np.clip(frame, 0, 255)
+                    if auto_white_balance:
+                        awb.process(frame, executor=executor)
+                    else:
+                        executor.run(frame, [gain_op], out=frame)
                     cv2.imshow(window_title, frame)
                 else:
                     break 
@@ -102,11 +113,16 @@ def show_camera():
                 # Stop the program on the ESC key or 'q'
                 if keyCode == 27 or keyCode == ord('q'):
                     break
+                if keyCode == ord('w'):
+                    auto_white_balance = not auto_white_balance
+                    awb.reset()
+                    print("auto white balance: " + ("on" if auto_white_balance else "off"))
                 if keyCode == ord('s'):
                     filename = "image.png"
                     cv2.imwrite(filename, frame)
                     print("saved photo")
         finally:
+            executor.shutdown()
             video_capture.release()
             cv2.destroyAllWindows()
     else:
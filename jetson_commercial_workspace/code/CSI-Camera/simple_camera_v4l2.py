@@ -10,11 +10,31 @@ import time
 import signal
 import sys
 
+from frame_source import is_hardware, open_source
+from frame_store import FrameStore
+from frame_timing import FrameTimer
+from presets import PresetEngine, PresetError
+
 class V4L2CameraController:
-    def __init__(self, device="/dev/video0", sensor_id=0):
+    def __init__(self, device="/dev/video0", sensor_id=0, source=None):
         self.device = device
         self.sensor_id = sensor_id
         self.cap = None
+        # "replay:<dir>" / "synthetic:WxH@fps" instead of the camera, see frame_source.py
+        self.source = source
+        self.framerate = 20
+        
+        # ⏱️ Frame timestamps, drops and jitter
+        self.timing = FrameTimer(self.framerate)
+        self.last_stamp = None
+        
+        # 🗂️ Presets from presets.json, written as one batched v4l2-ctl call
+        # (replayed / synthetic sources have no device, writes only update state)
+        self.presets = PresetEngine(device if source is None or is_hardware(source) else None)
+        try:
+            self.presets.load()
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not load presets: {e}")
         
         # ========================
         # 🎨 ADJUSTABLE PARAMETERS
@@ -79,11 +99,9 @@ class V4L2CameraController:
         else:
             print("❌ Failed to list controls")
     
-    def apply_camera_settings(self):
-        """Apply all camera settings via v4l2"""
-        print("\n⚙️ Applying camera settings...")
-        
-        settings = [
+    def current_settings(self):
+        """Control values held in the attributes below"""
+        return dict([
             # Exposure & Gain
             ("exposure_auto", self.exposure_auto),
             ("exposure_absolute", self.exposure_absolute),
@@ -102,40 +120,69 @@ class V4L2CameraController:
             
             # Noise Reduction
             ("denoise", self.denoise),
-        ]
+        ])
+    
+    def apply_camera_settings(self):
+        """Apply changed camera settings via v4l2 in one batch"""
+        print("\n⚙️ Applying camera settings...")
+        settings = self.current_settings()
+        try:
+            plan = self.presets.set_controls(settings)
+        except (PresetError, subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"❌ Applying settings failed: {e}")
+            return False
         
-        success_count = 0
-        for control, value in settings:
-            if self.set_v4l2_control(control, value):
-                success_count += 1
+        for control in plan.skipped:
+            print(f"⚠️  {control:30} not supported by {self.device}")
+        changed = sum(len(batch) for batch in plan.batches)
+        print(f"✅ Applied {len(settings) - len(plan.skipped)}/{len(settings)} settings "
+              f"({changed} changed, {plan.writes} device write(s))")
+        return len(plan.skipped) < len(settings)
+    
+    def apply_preset(self, name, ramp_frames=None):
+        """Start a preset from presets.json, ramps advance in read_frame()"""
+        try:
+            plan = self.presets.apply(name, ramp_frames)
+        except (PresetError, subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"❌ Preset '{name}' failed: {e}")
+            return False
         
-        print(f"✅ Applied {success_count}/{len(settings)} settings")
-        return success_count > 0
+        # keep the attributes in step with the device, from the values the plan
+        # writes (target_level presets resolve gain/exposure, ranges snap values)
+        resolved = {}
+        for batch in plan.batches:
+            resolved.update(batch)
+        for control, value in resolved.items():
+            if hasattr(self, control):
+                setattr(self, control, value)
+        print(f"✅ Applying {name} preset over {max(plan.writes, 1)} frame(s)")
+        return True
     
     def create_gstreamer_pipeline(self):
         """Create simple GStreamer pipeline (no override)"""
         return (
             f"nvarguscamerasrc sensor-id={self.sensor_id} ! "
-            "video/x-raw(memory:NVMM), width=1920, height=1080, framerate=20/1 ! "
+            f"video/x-raw(memory:NVMM), width=1920, height=1080, framerate={self.framerate}/1 ! "
             "nvvidconv ! video/x-raw, width=1280, height=720 ! "
             "videoconvert ! video/x-raw, format=BGR ! appsink"
         )
     
     def start_camera(self):
         """Start camera with applied settings"""
-        # Apply v4l2 settings first
-        if not self.apply_camera_settings():
-            print("⚠️  Some settings failed to apply, continuing anyway...")
-        
-        # Wait for settings to take effect
-        time.sleep(1)
+        pipeline = self.source or self.create_gstreamer_pipeline()
+        if is_hardware(pipeline):
+            # Apply v4l2 settings first
+            if not self.apply_camera_settings():
+                print("⚠️  Some settings failed to apply, continuing anyway...")
+            
+            # Wait for settings to take effect
+            time.sleep(1)
         
         # Start GStreamer pipeline
-        pipeline = self.create_gstreamer_pipeline()
         print(f"\n📹 Starting camera pipeline...")
         print(f"Pipeline: {pipeline}")
         
-        self.cap = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+        self.cap = open_source(pipeline)
         if not self.cap.isOpened():
             print("❌ Failed to open camera")
             return False
@@ -144,12 +191,33 @@ class V4L2CameraController:
         return True
     
     def read_frame(self):
-        """Read frame from camera"""
+        """Read frame from camera, tagging it with its buffer timestamp"""
         if self.cap and self.cap.isOpened():
             ret, frame = self.cap.read()
+            if ret:
+                self.last_stamp = self.timing.stamp(self.cap.get(cv2.CAP_PROP_POS_MSEC))
+                try:
+                    self.presets.on_frame()
+                except subprocess.CalledProcessError as e:
+                    print(f"❌ Preset ramp write failed: {e}")
+                    self.presets.transition = None
             return ret, frame
         return False, None
     
+    def print_timing(self):
+        """Print frame rate, drops, jitter and latency"""
+        stats = self.timing.get_stats()
+        interval = stats["interval_ms"]
+        jitter = stats["jitter_ms"]
+        latency = stats["latency_ms"]
+        if not interval["count"]:
+            return
+        print(f"📊 FPS: {1000.0 / interval['mean']:.1f} | "
+              f"dropped: {stats['dropped']} ({stats['drop_rate'] * 100:.1f}%) | "
+              f"jitter p95: {jitter['p95']:.1f} ms | "
+              f"display latency p95: {latency.get('p95', 0.0):.1f} ms "
+              f"[{stats['timestamp_source']}]")
+    
     def stop_camera(self):
         """Stop camera and cleanup"""
         if self.cap:
@@ -183,35 +251,19 @@ def signal_handler(sig, frame):
 # 🎯 USAGE EXAMPLES
 # ========================
 
+# Presets are defined in presets.json
+
 def apply_preset_daytime():
     """Preset for daytime outdoor"""
-    camera.exposure_auto = 1
-    camera.exposure_absolute = 50      # Shorter exposure
-    camera.gain = 2                    # Lower gain
-    camera.saturation = 160
-    camera.contrast = 150
-    camera.brightness = 10
-    camera.white_balance_temperature = 5500  # Daylight
-    print("✅ Applied daytime preset")
+    return camera.apply_preset("daytime")
 
 def apply_preset_nighttime():
     """Preset for nighttime"""
-    camera.exposure_auto = 1
-    camera.exposure_absolute = 500     # Longer exposure
-    camera.gain = 12                   # Higher gain
-    camera.saturation = 180
-    camera.contrast = 140
-    camera.brightness = 30
-    camera.white_balance_temperature = 4000  # Warmer
-    print("✅ Applied nighttime preset")
+    return camera.apply_preset("nighttime")
 
 def apply_preset_vivid():
     """Preset for vivid colors"""
-    camera.saturation = 200
-    camera.contrast = 180
-    camera.sharpness = 180
-    camera.brightness = 15
-    print("✅ Applied vivid preset")
+    return camera.apply_preset("vivid")
 
 # ========================
 # 🚀 MAIN EXECUTION
@@ -219,7 +271,9 @@ def apply_preset_vivid():
 
 if __name__ == "__main__":
     # Initialize camera controller
-    camera = V4L2CameraController(device="/dev/video0", sensor_id=0)
+    # python3 simple_camera_v4l2.py [replay:<dir> | synthetic:1280x720@20]
+    camera = V4L2CameraController(device="/dev/video0", sensor_id=0,
+                                  source=sys.argv[1] if len(sys.argv) > 1 else None)
     
     # Setup signal handler
     signal.signal(signal.SIGINT, signal_handler)
@@ -242,7 +296,7 @@ if __name__ == "__main__":
         
         print("\n🎮 Controls:")
         print("  • Press 'q' to quit")
-        print("  • Press 's' to save current frame")
+        print("  • Press 's' to add current frame to captures.fst")
         print("  • Press 'p' to print current settings")
         print("  • Press '1' for Daytime preset")
         print("  • Press '2' for Nighttime preset") 
@@ -250,7 +304,8 @@ if __name__ == "__main__":
         print("  • Adjust parameters in code and restart")
         
         frame_count = 0
-        start_time = time.time()
+        # 💾 Saved frames are kept losslessly with their settings, see frame_store.py
+        captures = None
         
         while True:
             ret, frame = camera.read_frame()
@@ -260,34 +315,36 @@ if __name__ == "__main__":
             
             # Display frame
             cv2.imshow("VC-IMX183C Camera", frame)
+            camera.timing.published(camera.last_stamp)
             
             # Handle key presses
             key = cv2.waitKey(1) & 0xFF
             if key == ord('q'):
                 break
             elif key == ord('s'):
-                filename = f"capture_{int(time.time())}.jpg"
-                cv2.imwrite(filename, frame)
-                print(f"💾 Saved: {filename}")
+                if captures is None:
+                    captures = FrameStore("captures.fst", "a", codec="zlib")
+                number = captures.append(frame, buffer_ms=camera.last_stamp.buffer_ms,
+                                         controls=camera.current_settings())
+                captures.flush()
+                print(f"💾 Saved frame {number} to captures.fst")
             elif key == ord('p'):
                 camera.print_current_settings()
             elif key == ord('1'):
                 apply_preset_daytime()
-                camera.apply_camera_settings()
             elif key == ord('2'):
                 apply_preset_nighttime()
-                camera.apply_camera_settings()
             elif key == ord('3'):
                 apply_preset_vivid()
-                camera.apply_camera_settings()
             
-            # Calculate FPS
+            # FPS, drops and jitter from buffer timestamps
             frame_count += 1
             if frame_count % 30 == 0:
-                fps = frame_count / (time.time() - start_time)
-                print(f"📊 FPS: {fps:.1f}")
+                camera.print_timing()
         
         # Cleanup
+        if captures is not None:
+            captures.close()
         camera.stop_camera()
         cv2.destroyAllWindows()
         print("👋 Bye!")
\ No newline at end of file
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Capture stall watchdog
+
+Tracks the interval between good frames and declares a stall once no frame
+has arrived for a deadline derived from that interval. The capture loop then
+tears the pipeline down and reopens it, waiting next_backoff() seconds
+between attempts (doubling up to backoff_max). The first good frame after a
+stall ends it and records the time to recover.
+
+The watchdog only keeps time, opening and closing the pipeline is left to
+the capture loop that owns it; a capture must only be released on the
+thread reading from it. A stalled GStreamer/Argus pipeline usually blocks
+inside read() rather than failing it, so the read has to be bounded in the
+pipeline itself (open_source(..., read_timeout_ms), see frame_source.py);
+it then returns False and the loop reopens. start_monitor() only watches:
+it flags a deadline that passes while the capture thread is stuck in a
+read, so the stall shows in get_stats() even when the backend cannot bound
+the read.
+"""
+
+import threading
+import time
+
+
+class StallWatchdog:
+    def __init__(self, min_timeout=1.0, interval_factor=5.0, backoff_initial=0.5, backoff_max=16.0):
+        # no frame for max(min_timeout, interval_factor * frame interval) is a stall
+        self.min_timeout = min_timeout
+        self.interval_factor = interval_factor
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self.interval = 0.0          # moving average of the good frame interval
+        self.last_frame = None
+        self.stall_start = None
+        self.backoff = backoff_initial
+        # set by the monitor when the deadline passes without the loop noticing
+        self.read_blocked = False
+        # whether the owner's capture bounds its reads, None if unknown
+        self.bounded_reads = None
+        self._monitor = None
+        self._monitor_stop = threading.Event()
+
+        self.stalls = 0
+        self.reopens = 0
+        self.recoveries = 0
+        self.total_recover = 0.0
+        self.last_recover = None
+        self.blocked_reads = 0       # deadlines caught by the monitor thread
+
+    @property
+    def deadline(self):
+        return max(self.min_timeout, self.interval_factor * self.interval)
+
+    # pipeline (re)opened, the deadline counts from now
+    def arm(self, now=None):
+        with self._lock:
+            self.last_frame = time.monotonic() if now is None else now
+            self.read_blocked = False
+
+    def disarm(self):
+        with self._lock:
+            self.last_frame = None
+            self.interval = 0.0
+            self.read_blocked = False
+
+    # a good frame arrived, ends a stall in progress
+    def frame(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.stall_start is not None:
+                self.last_recover = now - self.stall_start
+                self.total_recover += self.last_recover
+                self.recoveries += 1
+                self.stall_start = None
+                self.backoff = self.backoff_initial
+                self.interval = 0.0
+            elif self.last_frame is not None:
+                interval = now - self.last_frame
+                self.interval = interval if not self.interval else 0.9 * self.interval + 0.1 * interval
+            self.last_frame = now
+            self.read_blocked = False
+
+    # True if the deadline passed without a frame
+    def expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self.last_frame is not None and now - self.last_frame > self.deadline
+
+    # flag deadlines that pass while armed from a daemon thread, also when the
+    # capture thread is stuck inside read(); never touches the capture
+    def start_monitor(self, poll=0.1):
+        if self._monitor is not None:
+            return
+        self._monitor_stop.clear()
+        self._monitor = threading.Thread(target=self._watch, args=(poll,),
+                                         name="stall-monitor", daemon=True)
+        self._monitor.start()
+
+    def stop_monitor(self):
+        if self._monitor is not None:
+            self._monitor_stop.set()
+            self._monitor.join()
+            self._monitor = None
+
+    def _watch(self, poll):
+        while not self._monitor_stop.wait(poll):
+            now = time.monotonic()
+            with self._lock:
+                if (self.read_blocked or self.last_frame is None
+                        or now - self.last_frame <= self.deadline):
+                    continue
+                self.read_blocked = True
+                self.blocked_reads += 1
+                if self.stall_start is None:
+                    self.stall_start = now
+                    self.stalls += 1
+            if not self.bounded_reads:
+                print("Camera read blocked past the deadline, the capture cannot time out")
+
+    @property
+    def stalled(self):
+        return self.stall_start is not None
+
+    # called once per stall before the first reopen
+    def stall(self, now=None):
+        with self._lock:
+            if self.stall_start is None:
+                self.stall_start = time.monotonic() if now is None else now
+                self.stalls += 1
+
+    # seconds to wait before the next reopen attempt
+    def next_backoff(self):
+        with self._lock:
+            delay = self.backoff
+            self.backoff = min(self.backoff * 2.0, self.backoff_max)
+            self.reopens += 1
+            return delay
+
+    def get_stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "stalled": self.stall_start is not None,
+                "stalled_s": round(now - self.stall_start, 2) if self.stall_start is not None else 0.0,
+                "deadline_s": round(self.deadline, 2),
+                "stalls": self.stalls,
+                "reopens": self.reopens,
+                "recoveries": self.recoveries,
+                "last_recover_s": round(self.last_recover, 2) if self.last_recover is not None else None,
+                "mean_recover_s": round(self.total_recover / self.recoveries, 2) if self.recoveries else None,
+                "read_blocked": self.read_blocked,
+                "blocked_reads": self.blocked_reads,
+                "bounded_reads": self.bounded_reads,
+            }
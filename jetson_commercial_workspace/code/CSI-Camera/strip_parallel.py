@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Strip-parallel execution of per-pixel frame operations
+
+A frame is split into horizontal strips and a chain of operations is run
+on every strip in a persistent thread pool. OpenCV and NumPy release the
+GIL inside their kernels, so the strips really run on separate cores.
+Results are written into preallocated buffers that are reused between
+frames, so the steady state does not allocate.
+
+Run this file directly to benchmark the registered operations at 1080p
+and at the full 5440x3648 sensor resolution.
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+# a compiled operation
+# kernel(src_strip, dst_strip) must only touch its own rows
+# channels is the number of output channels (None = same as input)
+StripOp = namedtuple("StripOp", ["name", "kernel", "channels"])
+
+# name -> (factory, channels)
+OPERATIONS = {}
+
+
+def register_op(name, channels=None):
+    """Register an operation factory under a name
+
+    The factory takes the operation parameters and returns a kernel
+    kernel(src, dst) that writes its result into dst.
+    """
+    def decorator(factory):
+        OPERATIONS[name] = (factory, channels)
+        return factory
+    return decorator
+
+
+def make_op(name, **params):
+    """Build a StripOp from a registered operation and its parameters"""
+    if name not in OPERATIONS:
+        raise KeyError(f"Unknown strip operation: {name}")
+    factory, channels = OPERATIONS[name]
+    return StripOp(name, factory(**params), channels)
+
+
+def _apply_lut(lut):
+    # lut is either (256,) for all channels or (256, c) for per-channel
+    lut = np.ascontiguousarray(lut, dtype=np.uint8)
+    luts = {}
+
+    def kernel(src, dst):
+        channels = 1 if src.ndim == 2 else src.shape[2]
+        table = luts.get(channels)
+        if table is None:
+            if lut.ndim == 1 or channels == 1:
+                table = lut if lut.ndim == 1 else lut[:, 0].copy()
+            else:
+                # pad extra channels (alpha) with identity
+                table = np.empty((256, 1, channels), np.uint8)
+                table[:, 0, :] = np.arange(256, dtype=np.uint8)[:, None]
+                table[:, 0, :lut.shape[1]] = lut[:, :channels]
+            luts[channels] = table
+        cv2.LUT(src, table, dst=dst)
+    return kernel
+
+
+# --- registered operations ---
+
+@register_op("gray", channels=1)
+def gray_op():
+    # CameraProducer gray level
+    def kernel(src, dst):
+        code = cv2.COLOR_BGRA2GRAY if src.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        cv2.cvtColor(src, code, dst=dst)
+    return kernel
+
+
+@register_op("channel_gain")
+def channel_gain_op(b_gain=1.0, g_gain=1.0, r_gain=1.0):
+    # simple_camera_12 per-channel gains, saturating instead of wrapping
+    def kernel(src, dst):
+        scale = (b_gain, g_gain, r_gain, 1.0)[:src.shape[2]]
+        cv2.multiply(src, scale, dst=dst)
+    return kernel
+
+
+@register_op("exposure_contrast")
+def exposure_contrast_op(contrast=1.0, brightness=0, exposure=0):
+    # simple_camera_copy adjust_image folded into one lookup table
+    levels = np.arange(256, dtype=np.float64)
+    levels = np.clip(levels * (2 ** exposure), 0, 255).astype(np.uint8)
+    levels = np.abs(levels * float(contrast) + brightness)
+    return _apply_lut(np.clip(np.rint(levels), 0, 255))
+
+
+@register_op("temperature")
+def temperature_op(temp=0):
+    # simple_camera_copy adjust_temperature: warm = more red, less blue
+    levels = np.arange(256, dtype=np.float32)
+    lut = np.stack([levels - temp * 1.5, levels, levels + temp * 1.5], axis=1)
+    return _apply_lut(np.clip(lut, 0, 255))
+
+
+@register_op("tint")
+def tint_op(tint=0):
+    # simple_camera_copy adjust_tint: green / magenta
+    levels = np.arange(256, dtype=np.float32)
+    lut = np.stack([levels, levels + tint * 2, levels], axis=1)
+    return _apply_lut(np.clip(lut, 0, 255))
+
+
+@register_op("lut")
+def lut_op(lut):
+    # precomputed (256,) or (256, c) table, used by awb for channel gains
+    return _apply_lut(lut)
+
+
+# per-thread scratch buffers for kernels that need an intermediate image
+_scratch = threading.local()
+
+
+def _scratch_buffer(name, shape, dtype=np.uint8):
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape:
+        buf = buffers[name] = np.empty(shape, dtype)
+    return buf
+
+
+def _hsv_saturation_op(s_lut):
+    hsv_lut = np.empty((256, 1, 3), np.uint8)
+    hsv_lut[:, 0, 0] = np.arange(256)
+    hsv_lut[:, 0, 1] = np.clip(s_lut, 0, 255)
+    hsv_lut[:, 0, 2] = np.arange(256)
+
+    def kernel(src, dst):
+        hsv = _scratch_buffer("hsv", src.shape[:2] + (3,))
+        if src.shape[2] == 4:
+            bgr = _scratch_buffer("bgr", src.shape[:2] + (3,))
+            alpha = _scratch_buffer("alpha", src.shape[:2])
+            alpha[...] = src[:, :, 3]
+            cv2.cvtColor(src, cv2.COLOR_BGRA2BGR, dst=bgr)
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV, dst=hsv)
+            cv2.LUT(hsv, hsv_lut, dst=hsv)
+            cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=bgr)
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2BGRA, dst=dst)
+            dst[:, :, 3] = alpha
+        else:
+            cv2.cvtColor(src, cv2.COLOR_BGR2HSV, dst=hsv)
+            cv2.LUT(hsv, hsv_lut, dst=hsv)
+            cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=dst)
+    return kernel
+
+
+@register_op("vibrance")
+def vibrance_op(vibrance=0):
+    # simple_camera_copy adjust_vibrance
+    return _hsv_saturation_op(np.arange(256, dtype=np.float32) + vibrance)
+
+
+@register_op("saturation")
+def saturation_op(saturation=0):
+    # simple_camera_copy adjust_saturation
+    return _hsv_saturation_op(np.arange(256, dtype=np.float32) * (1 + saturation / 100.0))
+
+
+# --- executor ---
+
+class StripExecutor:
+    def __init__(self, num_workers=None, min_strip_rows=32):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.min_strip_rows = min_strip_rows
+        # persistent pool, created once and reused for every frame
+        self.pool = None
+        if self.num_workers > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.num_workers,
+                                           thread_name_prefix="strip")
+        # preallocated intermediate and output buffers
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, key, shape, dtype):
+        buf = self._buffers.get(key)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype)
+            self._buffers[key] = buf
+        return buf
+
+    def _strips(self, rows):
+        count = min(self.num_workers, max(1, rows // self.min_strip_rows))
+        bounds = np.linspace(0, rows, count + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def run(self, frame, ops, out=None):
+        """Run a chain of StripOps over frame
+
+        The result is written into out, or into an internal buffer that
+        is reused on the next call with the same chain (copy it if you
+        need to keep it). out may be frame itself for in-place work.
+        """
+        if not ops:
+            return frame
+
+        with self._lock:
+            # one buffer per stage, the last stage writes into out
+            chain_key = tuple(op.name for op in ops)
+            stages = []
+            shape = frame.shape
+            for i, op in enumerate(ops):
+                if op.channels == 1:
+                    shape = shape[:2]
+                elif op.channels is not None:
+                    shape = shape[:2] + (op.channels,)
+                if i == len(ops) - 1 and out is not None:
+                    if out.shape != shape:
+                        raise ValueError(f"out has shape {out.shape}, expected {shape}")
+                    dst = out
+                else:
+                    dst = self._buffer((chain_key, i), shape, frame.dtype)
+                stages.append((op.kernel, dst))
+
+            def work(r0, r1):
+                src = frame[r0:r1]
+                for kernel, dst in stages:
+                    kernel(src, dst[r0:r1])
+                    src = dst[r0:r1]
+
+            strips = self._strips(frame.shape[0])
+            if self.pool is None or len(strips) == 1:
+                work(0, frame.shape[0])
+            else:
+                # list() propagates worker exceptions
+                list(self.pool.map(lambda s: work(*s), strips))
+
+            return stages[-1][1]
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+# --- benchmark ---
+
+def benchmark(repeats=10):
+    # measure strip parallelism alone, not OpenCV's own thread pool
+    cv2.setNumThreads(1)
+
+    chains = {
+        "gray": [make_op("gray")],
+        "channel_gain": [make_op("channel_gain", b_gain=1.1, g_gain=1.0, r_gain=1.3)],
+        "adjust_image+color": [
+            make_op("exposure_contrast", contrast=1.1, brightness=5, exposure=0.5),
+            make_op("temperature", temp=-5),
+            make_op("vibrance", vibrance=10),
+        ],
+    }
+    resolutions = [(1920, 1080), (5440, 3648)]
+    max_workers = os.cpu_count() or 1
+
+    rng = np.random.default_rng(0)
+    for width, height in resolutions:
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        print(f"\n{width}x{height}")
+        print(f"  {'chain':20} {'workers':>7} {'ms':>8} {'speedup':>8}")
+        for name, ops in chains.items():
+            baseline = None
+            for workers in range(1, max_workers + 1):
+                executor = StripExecutor(num_workers=workers)
+                executor.run(frame, ops)  # warm up buffers and pool
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    executor.run(frame, ops)
+                ms = (time.perf_counter() - start) / repeats * 1000
+                executor.shutdown()
+                baseline = baseline or ms
+                print(f"  {name:20} {workers:>7} {ms:>8.2f} {baseline / ms:>7.2f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+V4L2 mmap streaming capture
+
+Reads raw sensor frames straight from /dev/videoN with V4L2 streaming I/O,
+without Argus, nvvidconv or videoconvert:
+
+    S_FMT -> REQBUFS(mmap) -> QUERYBUF + mmap each buffer -> QBUF all -> STREAMON
+    loop: DQBUF -> hand out a NumPy view of the buffer -> QBUF when released
+
+Frames are NumPy views over the mmapped driver buffers, nothing is copied.
+Row stride comes from the driver (bytesperline), so padded rows are handled
+by the view's strides. A frame must be released (or used as a context
+manager) to give its buffer back to the driver; while all buffers are held
+the capture stalls.
+
+On Jetson the VI path needs `v4l2-ctl --set-ctrl=bypass_mode=0` for direct
+capture, pass controls={"bypass_mode": 0} to have it set on open
+(preferred_stride goes the same way if rows should be padded differently).
+
+All kernel access goes through V4L2Device (open, ioctl, mmap, wait), so
+FakeV4L2Device can replace the driver in tests.
+
+Usage:
+    cap = V4L2Capture("/dev/video0", 5440, 3648, "RG12")
+    with cap.frame() as frame:
+        raw = frame.array          # (3648, 5440) uint16 view, valid inside the block
+    ret, copy = cap.read()         # VideoCapture style, returns a copy
+    cap.release()
+
+or through frame_source:
+    cap = open_source("v4l2:/dev/video0?5440x3648,RG12")
+"""
+
+import ctypes
+import errno
+import mmap
+import os
+import select
+import time
+
+import numpy as np
+
+
+# --- kernel structures (linux/videodev2.h), 64-bit layout ---
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_MEMORY_MMAP = 1
+V4L2_FIELD_NONE = 1
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_STREAMING = 0x04000000
+
+
+def fourcc(code):
+    return ord(code[0]) | (ord(code[1]) << 8) | (ord(code[2]) << 16) | (ord(code[3]) << 24)
+
+
+def fourcc_str(value):
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+
+
+# pixel format -> sample dtype of one row
+# 10/12/16 bit Bayer in 16 bit containers, packed formats are handed out as bytes
+PIXEL_DTYPES = {
+    "RG10": np.uint16, "BG10": np.uint16, "GB10": np.uint16, "GR10": np.uint16,
+    "RG12": np.uint16, "BG12": np.uint16, "GB12": np.uint16, "GR12": np.uint16,
+    "RG16": np.uint16, "GREY": np.uint8, "RGGB": np.uint8, "BA81": np.uint8,
+    "pRAA": np.uint8, "pRCC": np.uint8,   # packed RAW10 / RAW12, see raw_processing.py
+}
+# several pixels share bytes, frames are rows of bytes for raw_processing.py
+PACKED_FORMATS = {"pRAA", "pRCC"}
+
+
+class v4l2_capability(ctypes.Structure):
+    _fields_ = [
+        ("driver", ctypes.c_char * 16),
+        ("card", ctypes.c_char * 32),
+        ("bus_info", ctypes.c_char * 32),
+        ("version", ctypes.c_uint32),
+        ("capabilities", ctypes.c_uint32),
+        ("device_caps", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 3),
+    ]
+
+
+class v4l2_pix_format(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_uint32),
+        ("height", ctypes.c_uint32),
+        ("pixelformat", ctypes.c_uint32),
+        ("field", ctypes.c_uint32),
+        ("bytesperline", ctypes.c_uint32),
+        ("sizeimage", ctypes.c_uint32),
+        ("colorspace", ctypes.c_uint32),
+        ("priv", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("ycbcr_enc", ctypes.c_uint32),
+        ("quantization", ctypes.c_uint32),
+        ("xfer_func", ctypes.c_uint32),
+    ]
+
+
+class _v4l2_format_fmt(ctypes.Union):
+    _fields_ = [
+        ("pix", v4l2_pix_format),
+        ("raw_data", ctypes.c_uint8 * 200),
+        # the kernel union holds pointers, which aligns it to 8 bytes
+        ("_align", ctypes.c_void_p),
+    ]
+
+
+class v4l2_format(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("fmt", _v4l2_format_fmt),
+    ]
+
+
+class v4l2_requestbuffers(ctypes.Structure):
+    _fields_ = [
+        ("count", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("memory", ctypes.c_uint32),
+        ("capabilities", ctypes.c_uint32),
+        ("flags", ctypes.c_uint8),
+        ("reserved", ctypes.c_uint8 * 3),
+    ]
+
+
+class timeval(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_usec", ctypes.c_long)]
+
+
+class v4l2_timecode(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("frames", ctypes.c_uint8),
+        ("seconds", ctypes.c_uint8),
+        ("minutes", ctypes.c_uint8),
+        ("hours", ctypes.c_uint8),
+        ("userbits", ctypes.c_uint8 * 4),
+    ]
+
+
+class _v4l2_buffer_m(ctypes.Union):
+    _fields_ = [
+        ("offset", ctypes.c_uint32),
+        ("userptr", ctypes.c_ulong),
+        ("planes", ctypes.c_void_p),
+        ("fd", ctypes.c_int32),
+    ]
+
+
+class v4l2_buffer(ctypes.Structure):
+    _fields_ = [
+        ("index", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("bytesused", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("field", ctypes.c_uint32),
+        ("timestamp", timeval),
+        ("timecode", v4l2_timecode),
+        ("sequence", ctypes.c_uint32),
+        ("memory", ctypes.c_uint32),
+        ("m", _v4l2_buffer_m),
+        ("length", ctypes.c_uint32),
+        ("reserved2", ctypes.c_uint32),
+        ("request_fd", ctypes.c_int32),
+    ]
+
+
+# --- ioctl request numbers (asm-generic/ioctl.h) ---
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _IOC(direction, nr, struct):
+    size = ctypes.sizeof(struct)
+    return (direction << 30) | (size << 16) | (ord("V") << 8) | nr
+
+
+VIDIOC_QUERYCAP = _IOC(_IOC_READ, 0, v4l2_capability)
+VIDIOC_G_FMT = _IOC(_IOC_READ | _IOC_WRITE, 4, v4l2_format)
+VIDIOC_S_FMT = _IOC(_IOC_READ | _IOC_WRITE, 5, v4l2_format)
+VIDIOC_REQBUFS = _IOC(_IOC_READ | _IOC_WRITE, 8, v4l2_requestbuffers)
+VIDIOC_QUERYBUF = _IOC(_IOC_READ | _IOC_WRITE, 9, v4l2_buffer)
+VIDIOC_QBUF = _IOC(_IOC_READ | _IOC_WRITE, 15, v4l2_buffer)
+VIDIOC_DQBUF = _IOC(_IOC_READ | _IOC_WRITE, 17, v4l2_buffer)
+VIDIOC_STREAMON = _IOC(_IOC_WRITE, 18, ctypes.c_int)
+VIDIOC_STREAMOFF = _IOC(_IOC_WRITE, 19, ctypes.c_int)
+
+
+class V4L2Device:
+    """The kernel side: file descriptor, ioctl, mmap and poll"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+
+    def ioctl(self, request, arg):
+        import fcntl
+        # ctypes objects are writable buffers, the kernel fills them in place
+        fcntl.ioctl(self.fd, request, arg)
+        return arg
+
+    def mmap(self, length, offset):
+        return mmap.mmap(self.fd, length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+
+    # True once a buffer can be dequeued
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(readable)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class V4L2Frame:
+    """A dequeued buffer, array is a view valid until release()"""
+
+    def __init__(self, capture, index, array, sequence, timestamp, bytesused):
+        self._capture = capture
+        self.index = index
+        self.array = array
+        self.sequence = sequence
+        self.timestamp = timestamp   # driver timestamp, seconds
+        self.bytesused = bytesused
+
+    def release(self):
+        if self._capture is not None:
+            self._capture._requeue(self.index)
+            self._capture = None
+            self.array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class V4L2Capture:
+    def __init__(self, device="/dev/video0", width=5440, height=3648, pixelformat="RG12",
+                 num_buffers=4, controls=None, opener=V4L2Device):
+        if controls:
+            from presets import PresetEngine
+            # a fake device has no v4l2-ctl target, writes only update state
+            PresetEngine(device if opener is V4L2Device else None).set_controls(controls)
+
+        self.dev = opener(device)
+        self.buffers = []            # mmap objects
+        self.streaming = False
+        self.held = set()            # buffer indexes handed out and not released
+        self.frames = 0
+        self.lost = 0                # gaps in the driver sequence numbers
+        self._last_sequence = None
+        self._last_timestamp = 0.0
+        self._grabbed = None         # frame held by grab() until retrieve()
+        try:
+            self._check_caps()
+            self._set_format(width, height, pixelformat)
+            self._request_buffers(num_buffers)
+            self._start()
+        except Exception:
+            self.release()
+            raise
+
+    def _check_caps(self):
+        cap = self.dev.ioctl(VIDIOC_QUERYCAP, v4l2_capability())
+        caps = cap.device_caps or cap.capabilities
+        if not caps & V4L2_CAP_VIDEO_CAPTURE or not caps & V4L2_CAP_STREAMING:
+            raise RuntimeError(f"{cap.card.decode()} does not support streaming capture")
+        self.card = cap.card.decode()
+
+    def _set_format(self, width, height, pixelformat):
+        fmt = v4l2_format()
+        fmt.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        fmt.fmt.pix.width = width
+        fmt.fmt.pix.height = height
+        fmt.fmt.pix.pixelformat = fourcc(pixelformat)
+        fmt.fmt.pix.field = V4L2_FIELD_NONE
+        self.dev.ioctl(VIDIOC_S_FMT, fmt)
+        # the driver may adjust size and stride, use what it settled on
+        self.dev.ioctl(VIDIOC_G_FMT, fmt)
+        pix = fmt.fmt.pix
+        self.width = pix.width
+        self.height = pix.height
+        self.pixelformat = fourcc_str(pix.pixelformat)
+        self.bytesperline = pix.bytesperline
+        self.sizeimage = pix.sizeimage
+        self.dtype = np.dtype(PIXEL_DTYPES.get(self.pixelformat, np.uint8))
+        if self.bytesperline == 0:
+            self.bytesperline = self.width * self.dtype.itemsize
+        # a view of width samples per row must fit into the stride
+        if self.pixelformat not in PACKED_FORMATS and (
+                self.bytesperline < self.width * self.dtype.itemsize
+                or self.bytesperline % self.dtype.itemsize):
+            raise RuntimeError(f"Driver stride {self.bytesperline} does not fit "
+                               f"{self.width} {self.pixelformat} pixels")
+
+    def _request_buffers(self, count):
+        req = v4l2_requestbuffers()
+        req.count = count
+        req.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        req.memory = V4L2_MEMORY_MMAP
+        self.dev.ioctl(VIDIOC_REQBUFS, req)
+        if req.count < 2:
+            raise RuntimeError(f"Driver granted only {req.count} buffer(s)")
+        for index in range(req.count):
+            buf = self._buffer(index)
+            self.dev.ioctl(VIDIOC_QUERYBUF, buf)
+            self.buffers.append(self.dev.mmap(buf.length, buf.m.offset))
+
+    def _buffer(self, index=0):
+        buf = v4l2_buffer()
+        buf.index = index
+        buf.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        buf.memory = V4L2_MEMORY_MMAP
+        return buf
+
+    def _start(self):
+        for index in range(len(self.buffers)):
+            self.dev.ioctl(VIDIOC_QBUF, self._buffer(index))
+        self.dev.ioctl(VIDIOC_STREAMON, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+        self.streaming = True
+
+    def _requeue(self, index):
+        self.held.discard(index)
+        if self.streaming:
+            self.dev.ioctl(VIDIOC_QBUF, self._buffer(index))
+
+    # zero-copy view of a buffer, rows are bytesperline apart
+    # (height, width) samples, the row padding stays outside the view
+    def _view(self, index):
+        if self.pixelformat in PACKED_FORMATS:
+            # one byte row per line, width in bytes
+            return np.ndarray((self.height, self.bytesperline), dtype=np.uint8,
+                              buffer=self.buffers[index])
+        return np.ndarray((self.height, self.width), dtype=self.dtype, buffer=self.buffers[index],
+                          strides=(self.bytesperline, self.dtype.itemsize))
+
+    def frame(self, timeout=1.0):
+        """Next frame as a V4L2Frame, None on timeout"""
+        if len(self.held) >= len(self.buffers):
+            raise RuntimeError("All buffers are held, release frames before dequeuing more")
+        buf = self._buffer()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.dev.ioctl(VIDIOC_DQBUF, buf)
+                break
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.dev.wait(remaining):
+                    return None
+
+        if self._last_sequence is not None and buf.sequence > self._last_sequence + 1:
+            self.lost += buf.sequence - self._last_sequence - 1
+        self._last_sequence = buf.sequence
+        self._last_timestamp = buf.timestamp.tv_sec + buf.timestamp.tv_usec / 1e6
+        self.frames += 1
+        self.held.add(buf.index)
+        return V4L2Frame(self, buf.index, self._view(buf.index), buf.sequence,
+                         self._last_timestamp, buf.bytesused)
+
+    # --- cv2.VideoCapture style, so frame_source users can take it ---
+
+    def isOpened(self):
+        return self.streaming
+
+    def read(self):
+        self._drop_grabbed()
+        frame = self.frame()
+        if frame is None:
+            return False, None
+        with frame:
+            return True, frame.array.copy()
+
+    # grab() keeps the buffer dequeued, retrieve() copies it out and requeues
+    def grab(self):
+        self._drop_grabbed()
+        self._grabbed = self.frame()
+        return self._grabbed is not None
+
+    def retrieve(self):
+        frame, self._grabbed = self._grabbed, None
+        if frame is None:
+            return False, None
+        with frame:
+            return True, frame.array.copy()
+
+    def _drop_grabbed(self):
+        if self._grabbed is not None:
+            self._grabbed.release()
+            self._grabbed = None
+
+    def get(self, prop):
+        import cv2
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self._last_timestamp * 1000.0
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return 0.0
+
+    def release(self):
+        self._drop_grabbed()
+        if self.streaming:
+            try:
+                self.dev.ioctl(VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+            except OSError as e:
+                print(f"STREAMOFF failed: {e}")
+            self.streaming = False
+        self.held.clear()
+        for buffer in self.buffers:
+            try:
+                buffer.close()
+            except BufferError:
+                # a frame view is still alive, the mapping goes with it
+                pass
+        self.buffers = []
+        if self.dev is not None:
+            self.dev.close()
+            self.dev = None
+
+    def get_stats(self):
+        return {
+            "format": f"{self.pixelformat} {self.width}x{self.height}",
+            "bytesperline": self.bytesperline,
+            "buffers": len(self.buffers),
+            "held": len(self.held),
+            "frames": self.frames,
+            "lost": self.lost,
+        }
+
+
+class FakeV4L2Device:
+    """Driver stand-in: answers the ioctls above with anonymous mmap buffers
+
+    Rows are padded to `align` bytes like the Jetson VI does, frames carry a
+    counter pattern and sequence numbers. drop_every > 0 skips a sequence
+    number now and then.
+    """
+
+    def __init__(self, path="/dev/fake", align=64, drop_every=0):
+        self.path = path
+        self.align = align
+        self.drop_every = drop_every
+        self.fmt = None
+        self.buffers = []
+        self.queue = []
+        self.streaming = False
+        self.sequence = 0
+        self.calls = []
+
+    def ioctl(self, request, arg):
+        self.calls.append(request)
+        if request == VIDIOC_QUERYCAP:
+            arg.card = b"fake imx183"
+            arg.capabilities = arg.device_caps = V4L2_CAP_VIDEO_CAPTURE | V4L2_CAP_STREAMING
+        elif request == VIDIOC_S_FMT:
+            pix = arg.fmt.pix
+            dtype = np.dtype(PIXEL_DTYPES.get(fourcc_str(pix.pixelformat), np.uint8))
+            row = pix.width * dtype.itemsize
+            pix.bytesperline = (row + self.align - 1) // self.align * self.align
+            pix.sizeimage = pix.bytesperline * pix.height
+            self.fmt = v4l2_pix_format.from_buffer_copy(pix)
+        elif request == VIDIOC_G_FMT:
+            ctypes.memmove(ctypes.addressof(arg.fmt.pix), ctypes.addressof(self.fmt), ctypes.sizeof(self.fmt))
+        elif request == VIDIOC_REQBUFS:
+            self.buffers = [mmap.mmap(-1, self.fmt.sizeimage) for _ in range(arg.count)]
+        elif request == VIDIOC_QUERYBUF:
+            arg.length = self.fmt.sizeimage
+            arg.m.offset = arg.index * 4096
+        elif request == VIDIOC_QBUF:
+            if arg.index in self.queue:
+                raise OSError(errno.EINVAL, "buffer already queued")
+            self.queue.append(arg.index)
+        elif request == VIDIOC_DQBUF:
+            if not self.streaming or not self.queue:
+                raise OSError(errno.EAGAIN, "no buffer ready")
+            index = self.queue.pop(0)
+            self._fill(index)
+            self.sequence += 1
+            if self.drop_every and self.sequence % self.drop_every == 0:
+                self.sequence += 1
+            now = time.time()
+            arg.index = index
+            arg.sequence = self.sequence
+            arg.bytesused = self.fmt.sizeimage
+            arg.timestamp.tv_sec = int(now)
+            arg.timestamp.tv_usec = int((now % 1) * 1e6)
+        elif request == VIDIOC_STREAMON:
+            self.streaming = True
+        elif request == VIDIOC_STREAMOFF:
+            self.streaming = False
+            self.queue = []
+        return arg
+
+    def _fill(self, index):
+        # first sample of every row = row number, second = sequence
+        data = np.frombuffer(self.buffers[index], dtype=np.uint8)
+        rows = data.reshape(self.fmt.height, self.fmt.bytesperline)
+        rows[:, 0] = np.arange(self.fmt.height, dtype=np.uint32) & 0xFF
+        rows[:, 1] = 0
+        rows[:, 2] = (self.sequence + 1) & 0xFF
+
+    def mmap(self, length, offset):
+        return self.buffers[offset // 4096]
+
+    def wait(self, timeout):
+        return bool(self.queue)
+
+    def close(self):
+        pass
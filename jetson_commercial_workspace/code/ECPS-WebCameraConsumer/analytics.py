@@ -0,0 +1,197 @@
+import threading
+import time
+
+
+# base class for frame analyzers run by the producer
+# subclass and override analyze(), or pass a function as fn
+class AnalyticsPlugin:
+    def __init__(self, name, fn=None, interval=0.0, budget_ms=20.0):
+        self.name = name
+        self.fn = fn
+        # seconds between runs, 0 = every frame the plugin can keep up with
+        self.interval = interval
+        # a run longer than this is over budget and pushes the next runs back,
+        # None = no budget
+        if budget_ms is not None and not budget_ms > 0:
+            raise ValueError(f"budget_ms of plugin {name} must be above 0 or None")
+        self.budget_ms = budget_ms
+
+    # return a json serializable dict
+    def analyze(self, frame):
+        return self.fn(frame)
+
+
+# runs one plugin on its own thread so a slow plugin only delays itself
+class _PluginRunner:
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = None          # (seq, frame, generation)
+        # bumped by reset(), a run started before it does not publish
+        self.generation = 0
+        self.busy = False
+        self.next_due = 0.0
+        self.backoff_until = 0.0
+        self.running = True
+
+        # published result
+        self.result = None
+        self.result_seq = None
+        self.result_time = None
+
+        # timing and skip counters
+        self.runs = 0
+        self.errors = 0
+        self.skipped_busy = 0        # due while the previous run was still going
+        self.skipped_budget = 0      # held back after an over budget run
+        self.over_budget = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.total_ms = 0.0
+
+        self.thread = threading.Thread(target=self._run, name=f"analytics-{plugin.name}", daemon=True)
+        self.thread.start()
+
+    # called from the capture thread, must stay cheap
+    def offer(self, seq, frame, now):
+        with self.lock:
+            if now < self.backoff_until:
+                self.skipped_budget += 1
+                return
+            if now < self.next_due:
+                return
+            if self.busy or self.pending is not None:
+                self.skipped_busy += 1
+                return
+            self.pending = (seq, frame, self.generation)
+            self.next_due = now + self.plugin.interval
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if not self.running:
+                return
+            with self.lock:
+                if self.pending is None:
+                    continue
+                seq, frame, generation = self.pending
+                self.pending = None
+                self.busy = True
+
+            start = time.monotonic()
+            try:
+                result = self.plugin.analyze(frame)
+                error = None
+            except Exception as e:
+                result = None
+                error = str(e)
+            elapsed_ms = (time.monotonic() - start) * 1000.0
+
+            with self.lock:
+                self.busy = False
+                self.runs += 1
+                self.last_ms = elapsed_ms
+                self.max_ms = max(self.max_ms, elapsed_ms)
+                self.total_ms += elapsed_ms
+                if error is not None:
+                    self.errors += 1
+                    print(f"Analytics plugin '{self.plugin.name}' failed: {error}")
+                elif generation == self.generation:
+                    self.result = result
+                    self.result_seq = seq
+                    self.result_time = time.monotonic()
+                budget_ms = self.plugin.budget_ms
+                if budget_ms is not None and elapsed_ms > budget_ms:
+                    # back off in proportion to the overshoot
+                    self.over_budget += 1
+                    backoff = (elapsed_ms / budget_ms - 1.0) * max(self.plugin.interval, elapsed_ms / 1000.0)
+                    self.backoff_until = time.monotonic() + backoff
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join(timeout=1.0)
+
+    def reset(self):
+        with self.lock:
+            self.generation += 1
+            self.pending = None
+            self.result = None
+            self.result_seq = None
+            self.result_time = None
+
+    def get_result(self, now):
+        with self.lock:
+            if self.result is None:
+                return None
+            return {
+                "seq": self.result_seq,
+                "age_ms": round((now - self.result_time) * 1000.0, 1),
+                "data": self.result,
+            }
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "interval": self.plugin.interval,
+                "budget_ms": self.plugin.budget_ms,
+                "runs": self.runs,
+                "errors": self.errors,
+                "over_budget": self.over_budget,
+                "skipped_busy": self.skipped_busy,
+                "skipped_budget": self.skipped_budget,
+                "last_ms": round(self.last_ms, 2),
+                "mean_ms": round(self.total_ms / self.runs, 2) if self.runs else 0.0,
+                "max_ms": round(self.max_ms, 2),
+            }
+
+
+# fans the latest frame out to the registered plugins
+class AnalyticsManager:
+    def __init__(self):
+        self._runners = {}
+        self._lock = threading.Lock()
+
+    def register(self, plugin):
+        with self._lock:
+            if plugin.name in self._runners:
+                raise ValueError(f"Analytics plugin already registered: {plugin.name}")
+            self._runners[plugin.name] = _PluginRunner(plugin)
+        return plugin
+
+    def unregister(self, name):
+        with self._lock:
+            runner = self._runners.pop(name, None)
+        if runner:
+            runner.stop()
+
+    # called by the capture thread for every frame
+    def offer(self, seq, frame):
+        now = time.monotonic()
+        for runner in list(self._runners.values()):
+            runner.offer(seq, frame, now)
+
+    # drop results when the camera stops
+    def reset(self):
+        for runner in list(self._runners.values()):
+            runner.reset()
+
+    def get_result(self, name):
+        runner = self._runners.get(name)
+        if runner is None:
+            return None
+        return runner.get_result(time.monotonic())
+
+    def get_results(self):
+        now = time.monotonic()
+        return {name: runner.get_result(now) for name, runner in list(self._runners.items())}
+
+    def get_stats(self):
+        return {name: runner.get_stats() for name, runner in list(self._runners.items())}
+
+    def stop(self):
+        for name in list(self._runners):
+            self.unregister(name)
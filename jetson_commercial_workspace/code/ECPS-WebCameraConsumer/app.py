@@ -1,13 +1,69 @@
-from flask import Flask, render_template, Response, request, jsonify
-from camera_producer import CameraProducer
+from flask import Flask, render_template, Response, request, jsonify, abort
+from camera_registry import CameraRegistry
+from stream_variants import parse_roi, parse_size
+from presets import PresetError
+from jpeg_encoders import available_encoders
+import json
+import os
 import time
 
 app = Flask(__name__)
 
-# --- global camera object ---
-# create and start the camera thread
-camera_producer = CameraProducer()
-camera_producer.start()
+# --- camera objects ---
+# one producer per sensor, each with its own capture thread
+# all cameras share one encode pool sized to the cpu count
+# the IMX183 pipelines deliver the full 5440x3648 sensor frame, so
+# /video_feed?roi= zooms into native pixels; the full view is its 1920x1080
+# downscale (done on the cpu, drop source_size to have nvvidconv scale instead)
+# WARM_STANDBY=1 keeps pipelines running across stop/start for a faster
+# restart, at the idle cost reported as startup.standby_cpu_percent
+IMX183_SENSOR = (5440, 3648)
+WARM_STANDBY = os.environ.get("WARM_STANDBY") == "1"
+CAMERAS = {
+    "0": {"sensor_id": 0, "device": "/dev/video0", "source_size": IMX183_SENSOR, "warm_standby": WARM_STANDBY},
+    "1": {"sensor_id": 1, "device": "/dev/video1", "source_size": IMX183_SENSOR, "warm_standby": WARM_STANDBY},
+}
+DEFAULT_CAMERA = "0"
+
+# CAMERA_SOURCE=synthetic:1920x1080@10 or replay:<dir> runs without the cameras
+if os.environ.get("CAMERA_SOURCE"):
+    for config in CAMERAS.values():
+        config["source"] = os.environ["CAMERA_SOURCE"]
+
+# JPEG_ENCODER=turbojpeg or a json spec like {"name": "opencv", "optimize": true},
+# measure the choices with python3 jpeg_encoders.py
+if os.environ.get("JPEG_ENCODER"):
+    spec = os.environ["JPEG_ENCODER"]
+    for config in CAMERAS.values():
+        config["encoder"] = json.loads(spec) if spec.startswith("{") else spec
+
+cameras = CameraRegistry(CAMERAS)
+cameras.start()
+
+# the routes without /cameras/<id> act on the default camera
+camera_producer = cameras.get(DEFAULT_CAMERA)
+
+
+def get_producer(camera_id):
+    producer = cameras.get(camera_id)
+    if producer is None:
+        abort(404, description=f"unknown camera {camera_id}")
+    return producer
+
+
+# the request's json object, None for a missing or malformed body
+def json_body():
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+
+# register a route at /cameras/<camera_id><rule> and, for the default camera, at <rule>
+def camera_route(rule, **options):
+    def decorator(fn):
+        app.route(rule, defaults={'camera_id': DEFAULT_CAMERA}, **options)(fn)
+        app.route('/cameras/<camera_id>' + rule, **options)(fn)
+        return fn
+    return decorator
 
 
 # --- web page routes ---
@@ -25,20 +81,44 @@ def controls():
 
 # --- api routes ---
 
-@app.route('/start_camera', methods=['POST'])
-def start_camera():
+# fps and load of every camera plus the shared encode pool
+@app.route('/cameras')
+def list_cameras():
+    return jsonify(cameras.get_status())
+
+@camera_route('/start_camera', methods=['POST'])
+def start_camera(camera_id):
+    camera_producer = get_producer(camera_id)
     print("Received /start_camera request")
     camera_producer.start_camera()
     return jsonify({"status": "camera starting"})
 
-@app.route('/stop_camera', methods=['POST'])
-def stop_camera():
+@camera_route('/stop_camera', methods=['POST'])
+def stop_camera(camera_id):
+    camera_producer = get_producer(camera_id)
     print("Received /stop_camera request")
     camera_producer.stop_camera()
     return jsonify({"status": "camera stopping"})
 
-@app.route('/set_controls', methods=['POST'])
-def set_controls():
+@camera_route('/set_standby', methods=['POST'])
+def set_standby(camera_id):
+    camera_producer = get_producer(camera_id)
+    # {"warm": true} keeps the pipeline open across stop/start
+    # {"warm": false} or {"release": true} closes a pipeline held in standby
+    data = json_body()
+    if data is None:
+        return jsonify({"status": "error", "message": "expected a json object"}), 400
+    if 'warm' in data and not isinstance(data['warm'], bool):
+        return jsonify({"status": "error", "message": "warm must be true or false"}), 400
+    if 'warm' in data:
+        camera_producer.set_warm_standby(data['warm'])
+    if data.get('release'):
+        camera_producer.release_camera()
+    return jsonify({"status": "standby updated", "startup": camera_producer.get_ttff_stats()})
+
+@camera_route('/set_controls', methods=['POST'])
+def set_controls(camera_id):
+    camera_producer = get_producer(camera_id)
     data = request.json
     try:
         camera_producer.update_controls(
@@ -51,41 +131,227 @@ def set_controls():
         print(f"Error updating controls: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/get_status')
-def get_status():
+@camera_route('/presets')
+def list_presets(camera_id):
+    camera_producer = get_producer(camera_id)
+    presets = camera_producer.presets
+    return jsonify({
+        "presets": {name: p.get("description", "") for name, p in presets.presets.items()},
+        "status": presets.get_status(),
+    })
+
+@camera_route('/apply_preset', methods=['POST'])
+def apply_preset(camera_id):
+    camera_producer = get_producer(camera_id)
+    # {"name": "imx183_night", "ramp_frames": 20 (optional, preset default otherwise)}
+    data = request.json
+    try:
+        plan = camera_producer.apply_preset(data['name'], data.get('ramp_frames'))
+        return jsonify({
+            "status": "preset applying",
+            "writes": plan.writes,
+            "skipped": plan.skipped,
+            "controls": camera_producer.get_controls(),
+        })
+    except PresetError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        print(f"Error applying preset: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@camera_route('/set_awb', methods=['POST'])
+def set_awb(camera_id):
+    camera_producer = get_producer(camera_id)
+    # {"method": "gray_world" | "white_patch" | null, "interval": 10}
+    data = request.json
+    try:
+        camera_producer.set_awb(data.get('method'), data.get('interval', 10))
+        return jsonify({"status": "awb updated", "awb": camera_producer.get_awb()})
+    except Exception as e:
+        print(f"Error updating awb: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@camera_route('/set_encoder', methods=['POST'])
+def set_encoder(camera_id):
+    camera_producer = get_producer(camera_id)
+    # {"name": "opencv" | "turbojpeg" | "simplejpeg" | "pil", "quality": 70, "subsampling": "420", ...}
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"status": "error", "message": "expected an encoder name or object",
+                        "available": available_encoders()}), 400
+    try:
+        encoder = camera_producer.set_encoder(data)
+        return jsonify({"status": "encoder updated", "encoder": encoder})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e), "available": available_encoders()}), 400
+
+@camera_route('/set_focus_assist', methods=['POST'])
+def set_focus_assist(camera_id):
+    camera_producer = get_producer(camera_id)
+    # {"roi": "x,y,w,h" in full-view pixels or "" for the center, "level": "half",
+    #  "zebra_level": 250, "peaking_threshold": 40, "max_rate": 10}
+    data = json_body()
+    if data is None:
+        return jsonify({"status": "error", "message": "expected a json object"}), 400
+    try:
+        roi = data.get('roi')
+        if roi is not None:
+            roi = parse_roi(roi, camera_producer.stream_size) if roi else ()
+        level = parse_size(data['level']) if data.get('level') else None
+        camera_producer.focus_assist.configure(
+            roi=roi, level=level,
+            zebra_level=data.get('zebra_level'),
+            peaking_threshold=data.get('peaking_threshold'),
+            max_rate=data.get('max_rate'),
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "focus assist updated", "focus_assist": camera_producer.get_focus_assist()})
+
+@camera_route('/set_streaming', methods=['POST'])
+def set_streaming(camera_id):
+    camera_producer = get_producer(camera_id)
+    # {"change_threshold": 2.0 or null to always encode, "keepalive": 1.0}
+    data = json_body()
+    if data is None:
+        return jsonify({"status": "error", "message": "expected a json object"}), 400
+    try:
+        camera_producer.set_change_detection(
+            data.get('change_threshold', camera_producer.change_threshold),
+            data.get('keepalive', camera_producer.keepalive),
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "streaming updated", "streaming": camera_producer.get_stream_stats()})
+
+@camera_route('/get_status')
+def get_status(camera_id):
+    camera_producer = get_producer(camera_id)
     status = {
+        'camera_id': camera_producer.camera_id,
+        'load': camera_producer.get_load_stats(),
         'controls': camera_producer.get_controls(),
+        'preset': camera_producer.presets.get_status(),
         'gray_level': camera_producer.gray_level,
+        'awb': camera_producer.get_awb(),
+        'analytics': camera_producer.analytics.get_results(),
+        'analytics_stats': camera_producer.analytics.get_stats(),
+        'streaming': camera_producer.get_stream_stats(),
+        'encoder': camera_producer.encoder.describe(),
+        'focus_assist': camera_producer.get_focus_assist(),
+        'startup': camera_producer.get_ttff_stats(),
+        'watchdog': camera_producer.watchdog.get_stats(),
+        'timing': camera_producer.timing.get_stats(),
         'is_running': camera_producer.is_running # <<< FIX 1: Was _running.is_set()
     }
     return jsonify(status)
 
 # --- video streaming ---
 
-def gen(producer):
-    print("Starting video stream generator...")
-    while True:
-        # wait for a new frame
-        while producer.jpeg_frame is None:
+def gen(producer, roi=None, size="full", assist=False):
+    # subscribing here means the variant is released by the finally below
+    variant = producer.open_assist_stream() if assist else producer.open_stream(roi, size)
+    print(f"Starting video stream generator ({variant.name})...")
+    last_seq = None
+    try:
+        while True:
+            # wait for a frame newer than the last one sent
+            # unchanged scenes produce no new frames apart from keepalives
+            seq, frame, frame_seq, captured = producer.wait_for_jpeg(last_seq, timeout=1.0, variant=variant)
             if not producer.is_running:
                 print("Generator stopping producer is not running")
                 return
-            time.sleep(0.01)
-        
-        frame = producer.jpeg_frame # <<< FIX 2: Was get_latest_frame()
-        
-        if frame:
+            if frame is None or seq == last_seq:
+                continue
+            last_seq = seq
+
+            # capture time as wall clock, clients on a synced clock get the latency
+            headers = 'Content-Length: %d\r\nX-Frame-Seq: %s\r\n' % (len(frame), frame_seq)
+            if captured is not None:
+                headers += 'X-Capture-Time: %.6f\r\n' % (time.time() - (time.monotonic() - captured))
             yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        
-        # slow down if not getting new frames
-        time.sleep(0.03) # approx 30fps
-
-@app.route('/video_feed')
-def video_feed():
-    return Response(gen(camera_producer),
+                   b'Content-Type: image/jpeg\r\n' + headers.encode() + b'\r\n' + frame + b'\r\n')
+    finally:
+        # also runs when the client disconnects
+        producer.close_stream(variant)
+
+# /video_feed?size=full|half|thumb picks a pyramid level
+# /video_feed?roi=x,y,w,h zooms into a region given in full-view pixels,
+# cropped from the source frame, native sensor pixels with the CAMERAS above
+# /video_feed?assist=1 shows the focus / exposure assist overlay
+@camera_route('/video_feed')
+def video_feed(camera_id):
+    camera_producer = get_producer(camera_id)
+    if request.args.get('assist') in ('1', 'true'):
+        return Response(gen(camera_producer, assist=True),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+    roi = request.args.get('roi')
+    try:
+        size = parse_size(request.args.get('size'))
+        roi = parse_roi(roi, camera_producer.stream_size) if roi else None
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return Response(gen(camera_producer, roi, size),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+# snapshots carry an ETag made of the frame seq; seqs restart with the
+# process, the boot id keeps ETags from an earlier run from matching
+BOOT_ID = format(int(time.time() * 1000), "x")
+# longest /snapshot.jpg?wait= in seconds
+MAX_SNAPSHOT_WAIT = 30.0
+
+def snapshot_etag(camera_id, size, seq):
+    return f"{BOOT_ID}-{camera_id}-{size}-{seq}"
+
+# frame seq of an ETag from this process, camera and size, None otherwise
+def etag_seq(tag, camera_id, size):
+    prefix = snapshot_etag(camera_id, size, "")
+    if tag.startswith(prefix) and tag[len(prefix):].isdigit():
+        return int(tag[len(prefix):])
+    return None
+
+# a jpeg with its ETag, or 304 if the client has it already
+def snapshot_response(camera_id, size, seq, frame):
+    if frame is None:
+        return jsonify({"status": "error", "message": "no frame available"}), 503
+    etag = snapshot_etag(camera_id, size, seq)
+    # no-cache: clients and proxies may keep it but must revalidate
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(frame, mimetype='image/jpeg')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# one still jpeg of the latest frame, encoded at most once per frame
+# /snapshot.jpg?size=full|half|thumb
+# If-None-Match with the last ETag answers 304 while the frame is unchanged,
+# adding ?wait=10 holds the request until the next frame (or 10 s)
+@camera_route('/snapshot.jpg')
+def snapshot(camera_id):
+    camera_producer = get_producer(camera_id)
+    try:
+        size = parse_size(request.args.get('size'))
+        wait = min(max(0.0, float(request.args.get('wait', 0))), MAX_SNAPSHOT_WAIT)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if wait:
+        known = [etag_seq(tag, camera_id, size) for tag in request.if_none_match]
+        known = max([seq for seq in known if seq is not None], default=None)
+        seq, frame = camera_producer.wait_for_snapshot(size, known, wait)
+    else:
+        seq, frame = camera_producer.get_snapshot(size)
+    return snapshot_response(camera_id, size, seq, frame)
+
+# single small jpeg for dashboard tiles, same as /snapshot.jpg?size=thumb
+@camera_route('/thumbnail.jpg')
+def thumbnail(camera_id):
+    camera_producer = get_producer(camera_id)
+    seq, frame = camera_producer.get_snapshot("thumb")
+    return snapshot_response(camera_id, "thumb", seq, frame)
+
 
 # --- main ---
 
@@ -93,5 +359,6 @@ if __name__ == '__main__':
     print("Starting Flask server...")
     # debug=True causes server to restart on code changes
     # host='0.0.0.0' makes it accessible on your network
-    app.run(host='0.0.0.0', debug=True, threaded=True, use_reloader=False)
+    # PORT picks another port, e.g. for load_test.py
+    app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=True, threaded=True, use_reloader=False)
 
@@ -2,83 +2,274 @@ import cv2
 import time
 import threading
 import subprocess
-import numpy as np
 import os
+import sys
+from collections import deque
+
+# shared frame processing modules live next to the CSI scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CSI-Camera"))
+from awb import AutoWhiteBalance
+from frame_source import RecordingSource, is_hardware, open_source, reads_bounded
+from frame_timing import FrameTimer
+from presets import PresetEngine
+from stall_watchdog import StallWatchdog
+from strip_parallel import StripExecutor
+
+from analytics import AnalyticsManager, AnalyticsPlugin
+from encode_pool import EncodePool
+from focus_assist import FocusAssist
+from jpeg_encoders import make_encoder
+from stream_variants import (PYRAMID_LEVELS, FramePyramid, StreamVariant, downscale, level_size,
+                             level_view, roi_view)
+
+
+# BT.601 luma weights of cv2.COLOR_BGR2GRAY, in B, G, R order
+GRAY_WEIGHTS = (0.114, 0.587, 0.299)
+
+
+# gray level, the original built-in analysis, now run as a plugin
+class GrayLevelPlugin(AnalyticsPlugin):
+    def __init__(self, interval=0.0, budget_ms=10.0):
+        super().__init__("gray_level", interval=interval, budget_ms=budget_ms)
+
+    # the gray conversion is linear, so the mean gray is the weighted mean of
+    # the channel means: one pass over the frame, no gray image, no threads
+    def analyze(self, frame):
+        means = cv2.mean(frame)
+        return {"gray_level": int(sum(w * m for w, m in zip(GRAY_WEIGHTS, means)))}
+
 
 # this class runs in its own thread
 class CameraProducer(threading.Thread):
-    def __init__(self):
+    # source_size is what the pipeline delivers, stream_size what /video_feed shows
+    # a source larger than the stream lets roi streams use native sensor pixels;
+    # replay and synthetic sources deliver their own size, frames are scaled
+    # by their actual shape
+    # encode_pool and executor (strip-parallel pixel work) are shared between
+    # cameras, private ones are made if not given
+    # source replaces the camera pipeline ("replay:<dir>", "synthetic:WxH@fps",
+    # see frame_source.py), record saves every captured frame to a directory
+    # encoder is a jpeg encoder spec ("opencv", {"name": "turbojpeg", ...}),
+    # see jpeg_encoders.py
+    def __init__(self, camera_id="0", sensor_id=0, device="/dev/video0",
+                 source_size=None, stream_size=(1920, 1080), encode_pool=None,
+                 executor=None, warm_standby=False, framerate=10, source=None, record=None, encoder=None):
         super().__init__()
         self.daemon = True # die when main thread dies
+        self.name = f"camera-{camera_id}"
+
+        self.camera_id = camera_id
+        self.sensor_id = sensor_id
+        self.device = device
+        self.stream_size = stream_size
+        self.source_size = source_size or stream_size
+        self.encode_pool = encode_pool or EncodePool()
+        try:
+            self.encoder = make_encoder(encoder)
+        except ValueError as e:
+            # a configured encoder that is missing or broken must not keep the camera down
+            print(f"Encoder {encoder} unavailable, using opencv: {e}")
+            self.encoder = make_encoder()
+        self.framerate = framerate
         
         # camera pipeline
         self.pipeline = (
-            "nvarguscamerasrc sensor-id=0 aelock=1 ! "
-            "video/x-raw(memory:NVMM), width=5440, height=3648, framerate=10/1 ! "
-            "nvvidconv ! video/x-raw, width=1920, height=1080, format=(string)BGRx ! "
-            "videoconvert ! video/x-raw, format=BGR ! appsink"
+            "nvarguscamerasrc sensor-id=%d aelock=1 ! "
+            "video/x-raw(memory:NVMM), width=5440, height=3648, framerate=%d/1 ! "
+            "nvvidconv ! video/x-raw, width=%d, height=%d, format=(string)BGRx ! "
+            "videoconvert ! video/x-raw, format=BGR ! appsink drop=true max-buffers=1"
+            % ((sensor_id, framerate) + tuple(self.source_size))
         )
+        self.source = source or self.pipeline
+        self.record = record
+
+        # load figures, moving averages over recent frames
+        self.fps = 0.0
+        self.frame_ms = 0.0          # capture thread time spent per frame
+        self._last_frame_time = None
         
         # camera object
         self.cap = None
         self.latest_frame = None
-        self.jpeg_frame = None
-        self.gray_level = 0
+        self.latest_pyramid = None
+        self.frame_seq = 0
+        # notified on every new frame and on stop, for long-polling snapshots
+        self.frame_cond = threading.Condition()
+
+        # skip encoding frames that look like the last sent one
+        # a keepalive frame is still encoded every `keepalive` seconds
+        self.change_threshold = 2.0
+        self.keepalive = 1.0
+
+        # encoded outputs, each is rendered and encoded only while it has subscribers
+        # one persistent variant per pyramid level, roi variants come and go
+        self.variants_lock = threading.Lock()
+        self.variants = {
+            level: StreamVariant(level, level_view(level), self.change_threshold, self.keepalive, persistent=True)
+            for level in PYRAMID_LEVELS
+        }
+        # focus / exposure assist overlay, only rendered while it has viewers
+        self.focus_assist = FocusAssist(self.stream_size)
+        self.variants["assist"] = StreamVariant(
+            "assist", self.focus_assist.render, self.change_threshold, self.keepalive, persistent=True)
+
+        # per-pixel work is split into strips across all cores
+        self.executor = executor or StripExecutor()
+
+        # frame analyzers run off the capture thread with their own budgets
+        self.analytics = AnalyticsManager()
+        self.analytics.register(GrayLevelPlugin())
+
+        # optional auto white balance, None = off
+        self.awb = None
 
         # control values updated from your v4l2-ctl image
         self.gain = 0
         self.exposure = 10000
         self.black_level = 0
         self.is_running = False
+
+        # control writes are batched into one v4l2-ctl call, presets can ramp
+        # replayed and synthetic sources have no device, writes only update state
+        self.presets = PresetEngine(device if is_hardware(self.source) else None)
+        try:
+            self.presets.load()
+            # target_level presets use the table from calibrate.py
+            self.presets.load_response()
+        except (OSError, ValueError) as e:
+            print(f"Could not load presets: {e}")
+
+        # warm standby keeps the pipeline open after stop, so the next start
+        # only resumes delivery instead of renegotiating argus/gstreamer
+        # the pipeline cannot be paused through cv2: argus, nvvidconv and
+        # videoconvert keep running while idle, so it is off unless asked for;
+        # standby_cpu_percent reports what it costs this process (the argus
+        # daemon and the ISP come on top)
+        self.warm_standby = warm_standby
+        self.in_standby = False
+        self._standby_start = None   # (time.monotonic(), time.process_time())
+        self.standby_cpu_percent = None
+
+        # time to first frame of recent starts, ms
+        self._start_requested = None
+        self._start_mode = None
+        self.ttff = {"cold": deque(maxlen=20), "warm": deque(maxlen=20)}
+
+        # reopens the pipeline when frames stop arriving
+        self.watchdog = StallWatchdog()
+
+        # buffer timestamps, dropped frames, jitter and capture to publish latency
+        self.timing = FrameTimer(framerate)
         
         # threading events
         self.start_signal = threading.Event()
         self.stop_signal = threading.Event()
+        self.release_signal = threading.Event()
 
     # main thread signals camera to start
     def start_camera(self):
+        if not self.is_running:
+            self._start_requested = time.monotonic()
         self.start_signal.set()
 
     # main thread signals camera to stop
     def stop_camera(self):
         self.stop_signal.set()
 
+    # close a pipeline held open in standby
+    def release_camera(self):
+        self.release_signal.set()
+
+    def set_warm_standby(self, enabled):
+        self.warm_standby = bool(enabled)
+        if not self.warm_standby:
+            self.release_signal.set()
+
+    # idle with the pipeline open until start or release
+    # appsink drops old buffers, the occasional grab keeps the pipeline pulled
+    def _standby(self):
+        self.in_standby = True
+        self._standby_start = (time.monotonic(), time.process_time())
+        print("Camera in warm standby")
+        while not self.start_signal.is_set():
+            if self.release_signal.is_set():
+                break
+            if self.start_signal.wait(0.5):
+                break
+            if not self.cap.grab():
+                print("Standby grab failed, closing pipeline")
+                break
+        if not self.start_signal.is_set():
+            self.cap.release()
+            self.cap = None
+            print("Camera pipeline released")
+        self.standby_cpu_percent = self._standby_cpu()
+        self.in_standby = False
+        self._standby_start = None
+
+    # process cpu use since standby began, in percent of one core
+    def _standby_cpu(self):
+        start = self._standby_start
+        if start is None:
+            return self.standby_cpu_percent
+        wall = time.monotonic() - start[0]
+        if wall <= 0:
+            return None
+        return round((time.process_time() - start[1]) / wall * 100.0, 1)
+
+    def _record_ttff(self):
+        if self._start_requested is None:
+            return
+        ttff_ms = (time.monotonic() - self._start_requested) * 1000.0
+        self.ttff[self._start_mode].append(ttff_ms)
+        self._start_requested = None
+        print("First frame after %s start in %.0f ms" % (self._start_mode, ttff_ms))
+
+    def get_ttff_stats(self):
+        stats = {"warm_standby": self.warm_standby, "in_standby": self.in_standby,
+                 "standby_cpu_percent": self._standby_cpu()}
+        for mode, values in self.ttff.items():
+            values = list(values)
+            stats[mode] = {
+                "count": len(values),
+                "last_ms": round(values[-1], 1) if values else None,
+                "mean_ms": round(sum(values) / len(values), 1) if values else None,
+            }
+        return stats
+
     # this is the main function of the thread
     def run(self):
         print("Camera thread started and waiting for signal...")
+        # flags a deadline that passes while read() is stuck in the pipeline
+        self.watchdog.start_monitor()
         while True:
             # wait here until start_camera() is called
             self.start_signal.wait()
             self.start_signal.clear() # reset signal
-            
-            print("Connecting to camera...")
+            # a stop sent while stopped must not end this run
+            self.stop_signal.clear()
+            self.release_signal.clear()
+            if self._start_requested is None:
+                self._start_requested = time.monotonic()
+
             self.is_running = True
-            
-            # based on v4l2_01.py
-            # apply v4l2 controls
-            try:
-                self.update_controls(self.gain, self.exposure, self.black_level)
-            except Exception as e:
-                print(f"Error applying controls before open: {e}")
-                self.is_running = False
-                continue # stop and wait for new signal
-                
-            print("Controls set opening camera...")
+            if self.cap is not None:
+                # warm start, pipeline and controls are still in place
+                self._start_mode = "warm"
+                print("Resuming camera from standby...")
+            else:
+                self._start_mode = "cold"
+                print("Connecting to camera...")
 
-            # set gstreamer debug level right before opening
-            print("Setting GStreamer debug level...")
-            os.environ["GST_DEBUG"] = "3"
+                self.cap = self._open_pipeline()
+                if self.cap is None:
+                    self.is_running = False
+                    self._start_requested = None
+                    continue # wait for new signal
 
-            # opn camera 
-            print(self.pipeline)
-            self.cap = cv2.VideoCapture(self.pipeline, cv2.CAP_GSTREAMER)
-            
-            if not self.cap.isOpened():
-                print("Error: Could not open camera")
-                self.is_running = False
-                continue # wait for new signal
-            
             print("Camera is running")
+            self.watchdog.arm()
+            self.timing.reset()
 
             # main camera loop
             while self.is_running:
@@ -88,38 +279,350 @@ class CameraProducer(threading.Thread):
                     self.is_running = False
                     break
                     
+                if self.cap is None:
+                    # recovery was cut short by a stop
+                    continue
                 ret, frame = self.cap.read()
+                arrival = time.monotonic()
                 
                 if not ret:
-                    print("Frame read error skipping")
-                    time.sleep(0.1)
+                    if self.watchdog.expired():
+                        self._recover()
+                    else:
+                        print("Frame read error skipping")
+                        time.sleep(0.1)
                     continue
+
+                frame_start = arrival
+                stamp = self.timing.stamp(self.cap.get(cv2.CAP_PROP_POS_MSEC), arrival)
+                self.watchdog.frame(frame_start)
+                if self.presets.transition is not None:
+                    self._step_preset()
+                if self._start_requested is not None:
+                    self._record_ttff()
+                if self._last_frame_time is not None:
+                    interval = frame_start - self._last_frame_time
+                    if interval > 0:
+                        self.fps = 1.0 / interval if not self.fps else 0.9 * self.fps + 0.1 / interval
+                self._last_frame_time = frame_start
                 
+                # frame process
+                # white balance in place before anything reads the frame
+                awb = self.awb
+                if awb is not None:
+                    awb.process(frame, executor=self.executor)
+
+                # full view at stream size, roi streams crop from the source
+                source = frame
+                if (source.shape[1], source.shape[0]) != self.stream_size:
+                    frame = downscale(source, self.stream_size)
+
                 # store frame for web server
+                self.frame_seq += 1
+                pyramid = FramePyramid(source, frame, self.frame_seq, stamp)
                 self.latest_frame = frame
+                self.latest_pyramid = pyramid
+                with self.frame_cond:
+                    self.frame_cond.notify_all()
+
+                # hand the frame to the analytics plugins, never blocks
+                self.analytics.offer(self.frame_seq, frame)
                 
-                # frame process
-                # calculate gray level
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                self.gray_level = int(np.mean(gray))
-                
-                # pre-encode jpeg
-                ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                if ret:
-                    self.jpeg_frame = buffer.tobytes()
+                # pre-encode jpeg per subscribed variant on the shared pool
+                # pyramid levels are computed there on first use
+                self._encode_variants(pyramid)
+
+                elapsed_ms = (time.monotonic() - frame_start) * 1000.0
+                self.frame_ms = elapsed_ms if not self.frame_ms else 0.9 * self.frame_ms + 0.1 * elapsed_ms
 
                 # slow down loop
                 time.sleep(0.03) # approx 30fps
 
             # cleanup
-            if self.cap:
-                self.cap.release()
-            self.cap = None
+            self.watchdog.disarm()
             self.latest_frame = None
-            self.jpeg_frame = None
-            self.gray_level = 0
+            self.latest_pyramid = None
+            self.fps = 0.0
+            self._last_frame_time = None
+            self.analytics.reset()
+            with self.variants_lock:
+                for variant in self.variants.values():
+                    variant.clear()
+            self.focus_assist.reset()
+            with self.frame_cond:
+                self.frame_cond.notify_all()
+
             print("Camera hardware stopped")
 
+            if self.cap is not None and self.warm_standby and not self.release_signal.is_set():
+                self._standby()
+            elif self.cap is not None:
+                self.cap.release()
+                self.cap = None
+
+    # apply the stored controls and open the pipeline, None on failure
+    def _open_pipeline(self):
+        # recorded and synthetic sources have no device to configure
+        if is_hardware(self.source):
+            # based on v4l2_01.py
+            # apply v4l2 controls, the last written values so a recovery does
+            # not cancel a running preset ramp
+            try:
+                self.presets.restore(self.get_controls())
+                self._sync_controls()
+            except Exception as e:
+                print(f"Error applying controls before open: {e}")
+                return None
+
+            print("Controls set opening camera...")
+
+            # set gstreamer debug level right before opening
+            print("Setting GStreamer debug level...")
+            os.environ["GST_DEBUG"] = "3"
+
+        # opn camera
+        # reads time out within the stall deadline, a stalled pipeline then
+        # fails read() on this thread, which recovers it
+        print(self.source)
+        cap = open_source(self.source, read_timeout_ms=self.watchdog.min_timeout * 1000.0)
+
+        if not cap.isOpened():
+            print("Error: Could not open camera")
+            cap.release()
+            return None
+        self.watchdog.bounded_reads = reads_bounded(cap)
+        if self.record:
+            cap = RecordingSource(cap, self.record, controls=self.get_controls)
+        return cap
+
+    # frames stopped: reopen the pipeline with exponential backoff until it
+    # works or the camera is stopped. is_running stays set and the variants
+    # keep their last jpeg, so streaming clients wait instead of disconnecting
+    def _recover(self):
+        self.watchdog.stall()
+        print("Camera stalled, restarting pipeline...")
+        while not self.stop_signal.is_set():
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+            delay = self.watchdog.next_backoff()
+            print("Reopening camera in %.1f s" % delay)
+            if self.stop_signal.wait(delay):
+                break
+            self.cap = self._open_pipeline()
+            if self.cap is not None:
+                self.watchdog.arm()
+                self.timing.reset()
+                self._last_frame_time = None
+                return True
+        return False
+
+    def _active_variants(self):
+        with self.variants_lock:
+            return [v for v in self.variants.values() if v.subscribers > 0]
+
+    # never blocks: a variant still encoding the previous frame skips this one,
+    # and so does every variant when the shared pool is saturated
+    def _encode_variants(self, pyramid):
+        for variant in self._active_variants():
+            if not variant.begin_encode():
+                continue
+
+            def job(variant=variant):
+                try:
+                    if variant.encode(pyramid, self.encoder) and pyramid.stamp is not None:
+                        self.timing.published(pyramid.stamp)
+                finally:
+                    variant.end_encode()
+
+            if not self.encode_pool.submit(job):
+                variant.end_encode(dropped=True)
+
+    # latest encoded full view, encoded on demand if nobody streams it
+    @property
+    def jpeg_frame(self):
+        return self.get_jpeg("full")[1]
+
+    @property
+    def jpeg_seq(self):
+        return self.variants["full"].seq
+
+    # (seq, jpeg) of a pyramid level for single-shot requests
+    # uses the live stream encode if there is one, otherwise encodes the
+    # latest frame once and reuses it until a new frame arrives
+    # the encode runs on the shared pool like stream encodes, the request
+    # thread only waits for it (up to timeout); a saturated pool serves the
+    # previous jpeg
+    def get_jpeg(self, size="full", timeout=2.0):
+        variant = self.variants[size]
+        pyramid = self.latest_pyramid
+        if pyramid is not None and variant.frame_seq != pyramid.seq and variant.subscribers == 0:
+            if variant.begin_encode():
+                done = threading.Event()
+
+                def job():
+                    try:
+                        variant.encode(pyramid, self.encoder, force=True)
+                    finally:
+                        variant.end_encode()
+                        done.set()
+
+                if self.encode_pool.submit(job):
+                    done.wait(timeout)
+                else:
+                    variant.end_encode(dropped=True)
+        return variant.seq, variant.jpeg
+
+    # (frame seq, jpeg) of a pyramid level, the seq names the captured frame
+    # the jpeg was made from, so it only changes when the image does
+    def get_snapshot(self, size="full"):
+        self.get_jpeg(size)
+        return self.variants[size].snapshot()
+
+    # long-poll: wait up to timeout for a snapshot of a frame other than
+    # known_seq, returns the current one if none arrives or the camera stops
+    # every pass waits for something new, so an unchanged scene sleeps until
+    # the deadline instead of polling get_snapshot
+    def wait_for_snapshot(self, size, known_seq, timeout):
+        deadline = time.monotonic() + timeout
+        variant = self.variants[size]
+        while True:
+            pyramid = self.latest_pyramid
+            pyramid_seq = pyramid.seq if pyramid is not None else None
+            variant_seq = variant.seq
+            seq, jpeg = self.get_snapshot(size)
+            remaining = deadline - time.monotonic()
+            if (jpeg is not None and seq != known_seq) or remaining <= 0 or not self.is_running:
+                return seq, jpeg
+            if variant.subscribers:
+                # a live stream encodes this size and skips unchanged frames,
+                # wait for its next jpeg
+                variant.wait(variant_seq, remaining, lambda: self.is_running)
+            else:
+                # get_snapshot encodes on demand, wait for the next frame
+                with self.frame_cond:
+                    self.frame_cond.wait_for(
+                        lambda: (self.latest_pyramid is not None and self.latest_pyramid.seq != pyramid_seq)
+                        or not self.is_running,
+                        remaining,
+                    )
+
+    # get (and subscribe to) the variant for a stream
+    # roi is in full-view pixels, size is a pyramid level (limits the roi output size)
+    # clients asking for the same view share one encode
+    def open_stream(self, roi=None, size="full"):
+        if roi is None:
+            name = size
+        else:
+            name = "roi:%d,%d,%d,%d@%s" % (roi + (size,))
+        with self.variants_lock:
+            variant = self.variants.get(name)
+            if variant is None:
+                max_size = level_size(size, self.stream_size)
+                render = roi_view(roi, self.stream_size, max_size)
+                variant = StreamVariant(name, render, self.change_threshold, self.keepalive)
+                self.variants[name] = variant
+            variant.subscribers += 1
+        return variant
+
+    # subscribe to the focus assist overlay, released with close_stream
+    def open_assist_stream(self):
+        with self.variants_lock:
+            variant = self.variants["assist"]
+            variant.subscribers += 1
+        return variant
+
+    def get_focus_assist(self):
+        status = self.focus_assist.get_status()
+        status["viewers"] = self.variants["assist"].subscribers
+        return status
+
+    # drop a subscription, unused roi variants are removed
+    def close_stream(self, variant):
+        with self.variants_lock:
+            variant.subscribers -= 1
+            if variant.subscribers <= 0 and not variant.persistent:
+                self.variants.pop(variant.name, None)
+
+    # block until a jpeg newer than last_seq exists or timeout
+    # returns (seq, jpeg bytes or None, frame seq, capture time.monotonic())
+    def wait_for_jpeg(self, last_seq, timeout=1.0, variant=None):
+        variant = variant or self.variants["full"]
+        return variant.wait(last_seq, timeout, lambda: self.is_running)
+
+    # threshold None = encode every frame
+    # raises ValueError for non-numeric or negative values
+    def set_change_detection(self, threshold, keepalive):
+        try:
+            threshold = None if threshold is None else float(threshold)
+            keepalive = float(keepalive)
+        except (TypeError, ValueError):
+            raise ValueError("change_threshold and keepalive must be numbers")
+        if (threshold is not None and threshold < 0) or keepalive < 0:
+            raise ValueError("change_threshold and keepalive must not be negative")
+        with self.variants_lock:
+            self.change_threshold = threshold
+            self.keepalive = keepalive
+            for variant in self.variants.values():
+                variant.change_detector.threshold = self.change_threshold
+                variant.change_detector.keepalive = self.keepalive
+
+    def get_stream_stats(self):
+        with self.variants_lock:
+            return {name: v.get_stats() for name, v in self.variants.items()}
+
+    # fps and load for the camera overview
+    # load is the share of each frame interval spent capturing + encoding
+    def get_load_stats(self):
+        with self.variants_lock:
+            active = [v for v in self.variants.values() if v.subscribers > 0]
+            encode_ms = sum(v.encode_ms for v in active)
+            subscribers = sum(v.subscribers for v in self.variants.values())
+            dropped = sum(v.dropped for v in self.variants.values())
+        interval_ms = 1000.0 / self.fps if self.fps else 0.0
+        return {
+            "camera_id": self.camera_id,
+            "sensor_id": self.sensor_id,
+            "is_running": self.is_running,
+            "fps": round(self.fps, 2),
+            "frame_ms": round(self.frame_ms, 2),
+            "encode_ms": round(encode_ms, 2),
+            "load": round((self.frame_ms + encode_ms) / interval_ms, 3) if interval_ms else 0.0,
+            "subscribers": subscribers,
+            "dropped_encodes": dropped,
+            "stalls": self.watchdog.stalls,
+        }
+
+    # latest gray level from the gray_level plugin
+    @property
+    def gray_level(self):
+        result = self.analytics.get_result("gray_level")
+        if result is None:
+            return 0
+        return result["data"]["gray_level"]
+
+    # register an extra frame analyzer, see analytics.py
+    def register_plugin(self, plugin):
+        return self.analytics.register(plugin)
+
+    # enable auto white balance with a method name, or disable with None
+    def set_awb(self, method=None, interval=10):
+        if method is None:
+            self.awb = None
+        else:
+            self.awb = AutoWhiteBalance(method=method, interval=interval)
+
+    # switch the jpeg encoder, spec as in make_encoder(), raises ValueError
+    def set_encoder(self, spec):
+        self.encoder = make_encoder(spec)
+        return self.encoder.describe()
+
+    def get_awb(self):
+        awb = self.awb
+        if awb is None:
+            return None
+        return {"method": awb.method, "interval": awb.interval, "gains": awb.get_gains()}
+
     # get latest controls
     def get_controls(self):
         return {
@@ -129,29 +632,15 @@ class CameraProducer(threading.Thread):
         }
 
     # update v4l2 hardware controls
-    def update_controls(self, gain, exposure, black_level):
-        # store values
-        self.gain = gain
-        self.exposure = exposure
-        self.black_level = black_level
-        
-        # update hardware
+    # only changed controls are written, in one v4l2-ctl call, unless force
+    def update_controls(self, gain, exposure, black_level, force=False):
+        # a manual change ends a running preset ramp
+        self.presets.transition = None
+        self.presets.active = None
         try:
-            base_cmd = "v4l2-ctl -d /dev/video0"
-            
-            # removed capture_output=True to let logs print to terminal
-            print("Setting gain...")
-            subprocess.run(base_cmd + " --set-ctrl=gain=" + str(gain), 
-                                shell=True, check=True)
-
-            print("Setting exposure...")
-            subprocess.run(base_cmd + " --set-ctrl=exposure=" + str(exposure), 
-                                shell=True, check=True)
-
-            print("Setting black_level...")
-            subprocess.run(base_cmd + " --set-ctrl=black_level=" + str(black_level), 
-                                shell=True, check=True)
-                                
+            self.presets.set_controls(
+                {"gain": gain, "exposure": exposure, "black_level": black_level}, force=force
+            )
             print("Controls updated successfully")
             
         except subprocess.CalledProcessError as e:
@@ -163,4 +652,27 @@ class CameraProducer(threading.Thread):
         except FileNotFoundError as e:
             print("V4L2-CTL FAILED 'v4l2-ctl' command not found. Is it installed?")
             raise e
+        finally:
+            self._sync_controls()
+
+    # start a preset from presets.json, ramps advance once per captured frame
+    def apply_preset(self, name, ramp_frames=None):
+        try:
+            return self.presets.apply(name, ramp_frames)
+        finally:
+            self._sync_controls()
+
+    def _step_preset(self):
+        try:
+            self.presets.on_frame()
+            self._sync_controls()
+        except subprocess.CalledProcessError as e:
+            print(f"Preset ramp write failed: {e}")
+            self.presets.transition = None
 
+    # stored controls follow what was last written to the device
+    def _sync_controls(self):
+        state = self.presets.state
+        self.gain = state.get("gain", self.gain)
+        self.exposure = state.get("exposure", self.exposure)
+        self.black_level = state.get("black_level", self.black_level)
@@ -0,0 +1,35 @@
+from camera_producer import CameraProducer
+from encode_pool import EncodePool
+from strip_parallel import StripExecutor
+
+
+# one CameraProducer per sensor, all sharing one bounded encode pool and one
+# strip executor, so the process never runs more than a pool per core count
+class CameraRegistry:
+    # cameras: {camera_id: {"sensor_id": 0, "device": "/dev/video0", ...}}
+    def __init__(self, cameras, encode_pool=None, executor=None):
+        self.encode_pool = encode_pool or EncodePool()
+        self.executor = executor or StripExecutor()
+        self.producers = {}
+        for camera_id, config in cameras.items():
+            camera_id = str(camera_id)
+            self.producers[camera_id] = CameraProducer(
+                camera_id=camera_id, encode_pool=self.encode_pool, executor=self.executor, **config
+            )
+
+    # start every capture thread, they idle until start_camera()
+    def start(self):
+        for producer in self.producers.values():
+            producer.start()
+
+    def get(self, camera_id):
+        return self.producers.get(str(camera_id))
+
+    def ids(self):
+        return list(self.producers)
+
+    def get_status(self):
+        return {
+            "cameras": [p.get_load_stats() for p in self.producers.values()],
+            "encode_pool": self.encode_pool.get_stats(),
+        }
@@ -0,0 +1,65 @@
+import time
+
+import cv2
+
+
+# decides if a frame differs enough from the last sent one to be worth encoding
+# compares small gray thumbnails, so the cost is one area resize per frame
+class ChangeDetector:
+    def __init__(self, threshold=2.0, keepalive=1.0, thumb_size=(64, 36)):
+        # mean absolute thumbnail difference (0-255) that counts as a change
+        # None disables change detection, every frame is encoded
+        self.threshold = threshold
+        # send a frame at least this often (seconds) even if nothing changed
+        self.keepalive = keepalive
+        self.thumb_size = thumb_size
+
+        self.reference = None
+        self.last_accept = 0.0
+        self.last_diff = 0.0
+        self.accepted = 0
+        self.skipped = 0
+
+    def _thumbnail(self, frame):
+        thumb = cv2.resize(frame, self.thumb_size, interpolation=cv2.INTER_AREA)
+        if thumb.ndim == 3:
+            code = cv2.COLOR_BGRA2GRAY if thumb.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+            thumb = cv2.cvtColor(thumb, code)
+        return thumb
+
+    def reset(self):
+        self.reference = None
+        self.last_accept = 0.0
+
+    # True if the frame should be encoded and sent
+    def update(self, frame):
+        now = time.monotonic()
+        if self.threshold is None:
+            self.accepted += 1
+            return True
+
+        thumb = self._thumbnail(frame)
+        if self.reference is None:
+            changed = True
+        else:
+            # against the last *sent* thumbnail, so slow drift still adds up
+            self.last_diff = cv2.norm(thumb, self.reference, cv2.NORM_L1) / thumb.size
+            changed = self.last_diff >= self.threshold
+
+        if changed or now - self.last_accept >= self.keepalive:
+            self.reference = thumb
+            self.last_accept = now
+            self.accepted += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def get_stats(self):
+        return {
+            "threshold": self.threshold,
+            "keepalive": self.keepalive,
+            "encoded": self.accepted,
+            "skipped": self.skipped,
+            "last_diff": round(float(self.last_diff), 2),
+        }
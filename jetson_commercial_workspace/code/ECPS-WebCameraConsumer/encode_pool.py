@@ -0,0 +1,50 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# jpeg encodes from every camera share this pool so the process never runs
+# more encodes at once than there are cores; work beyond max_pending is refused
+class EncodePool:
+    def __init__(self, num_workers=None, max_pending=None):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        # queued + running encodes before new work is dropped
+        self.max_pending = max_pending or self.num_workers * 2
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="encode")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    # run fn() on the pool, returns False if the pool is saturated
+    def submit(self, fn):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            self.submitted += 1
+        self.executor.submit(self._run, fn)
+        return True
+
+    def _run(self, fn):
+        try:
+            fn()
+        except Exception as e:
+            print(f"Encode failed: {e}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "workers": self.num_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,162 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from stream_variants import level_size
+
+
+# focus and exposure assist for the operator, rendered as its own stream variant
+# everything is computed on a preview pyramid level, never at full resolution,
+# and only while the assist stream has viewers (render runs from the encode)
+#
+# - sharpness: variance of the Laplacian inside the roi, higher = sharper;
+#   peak is the best score since the roi or level last changed
+# - zebra: diagonal stripes over pixels with a channel at or above zebra_level
+# - focus peaking: pixels with a strong Laplacian response tinted green
+class FocusAssist:
+    def __init__(self, stream_size, level="half", roi=None, zebra_level=250,
+                 peaking_threshold=40, max_rate=10.0):
+        self.stream_size = stream_size
+        self.level = level
+        # x, y, w, h in full-view pixels, None = center quarter
+        self.roi = roi
+        self.zebra_level = zebra_level
+        self.peaking_threshold = peaking_threshold
+        # renders per second at most, frames in between reuse the last overlay
+        self.max_rate = max_rate
+
+        self.lock = threading.Lock()
+        self.sharpness = None
+        self.peak = None
+        self.clipped = 0.0           # fraction of clipped pixels
+        self.seq = None              # frame seq of the last result
+        self.compute_ms = 0.0        # moving average of one render
+        self.renders = 0
+        self._last_render = 0.0
+        self._overlay = None
+        self._stripes = None
+        self._colors = None
+
+    # raises ValueError for non-numeric values and a max_rate that is not positive
+    def configure(self, roi=None, level=None, zebra_level=None, peaking_threshold=None, max_rate=None):
+        try:
+            zebra_level = None if zebra_level is None else int(zebra_level)
+            peaking_threshold = None if peaking_threshold is None else float(peaking_threshold)
+            max_rate = None if max_rate is None else float(max_rate)
+        except (TypeError, ValueError):
+            raise ValueError("zebra_level, peaking_threshold and max_rate must be numbers")
+        if max_rate is not None and not max_rate > 0:
+            raise ValueError("max_rate must be above 0")
+        with self.lock:
+            if level is not None and level != self.level:
+                self.level = level
+                self.peak = None
+            if roi is not None:
+                # an empty tuple goes back to the center quarter
+                self.roi = roi or None
+                self.peak = None
+            if zebra_level is not None:
+                self.zebra_level = zebra_level
+            if peaking_threshold is not None:
+                self.peaking_threshold = peaking_threshold
+            if max_rate is not None:
+                self.max_rate = max_rate
+            self._last_render = 0.0
+
+    # roi scaled to the preview level, (x0, y0, x1, y1)
+    def _roi_box(self, size):
+        sx = size[0] / float(self.stream_size[0])
+        sy = size[1] / float(self.stream_size[1])
+        if self.roi is None:
+            x, y, w, h = (self.stream_size[0] // 4, self.stream_size[1] // 4,
+                          self.stream_size[0] // 2, self.stream_size[1] // 2)
+        else:
+            x, y, w, h = self.roi
+        x0, y0 = int(x * sx), int(y * sy)
+        return x0, y0, max(x0 + 3, int((x + w) * sx)), max(y0 + 3, int((y + h) * sy))
+
+    # diagonal stripe mask and solid color images, made once per preview size
+    def _masks(self, shape):
+        if self._stripes is None or self._stripes.shape != shape[:2]:
+            y, x = np.indices(shape[:2])
+            self._stripes = np.where(((x + y) // 6) % 2 == 0, 255, 0).astype(np.uint8)
+            self._colors = {
+                "peaking": np.full(shape, (0, 255, 0), dtype=np.uint8),
+                "zebra": np.full(shape, (255, 0, 255), dtype=np.uint8),
+            }
+        return self._stripes, self._colors
+
+    # StreamVariant render function
+    def render(self, pyramid):
+        now = time.monotonic()
+        with self.lock:
+            if self._overlay is not None and now - self._last_render < 1.0 / self.max_rate:
+                return self._overlay
+            self._last_render = now
+            level, zebra_level, threshold = self.level, self.zebra_level, self.peaking_threshold
+
+        start = time.monotonic()
+        image = pyramid.level(level)
+        size = (image.shape[1], image.shape[0])
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        laplacian = cv2.Laplacian(gray, cv2.CV_16S, ksize=3)
+
+        x0, y0, x1, y1 = self._roi_box(size)
+        _, std = cv2.meanStdDev(laplacian[y0:y1, x0:x1])
+        sharpness = float(std[0, 0]) ** 2
+
+        # zebra on clipped pixels, any channel at the limit
+        # (cv2 per-channel max, numpy's max over the channel axis is ~20x slower)
+        stripes, colors = self._masks(image.shape)
+        brightest = cv2.max(cv2.max(image[:, :, 0], image[:, :, 1]), image[:, :, 2])
+        _, clipped = cv2.threshold(brightest, zebra_level - 1, 255, cv2.THRESH_BINARY)
+        zebra = cv2.bitwise_and(clipped, stripes)
+        _, peaking = cv2.threshold(cv2.convertScaleAbs(laplacian), threshold - 1, 255, cv2.THRESH_BINARY)
+
+        overlay = image.copy()
+        cv2.copyTo(colors["peaking"], peaking, overlay)
+        cv2.copyTo(colors["zebra"], zebra, overlay)
+        cv2.rectangle(overlay, (x0, y0), (x1, y1), (0, 255, 255), 1)
+
+        with self.lock:
+            if self.peak is None or sharpness > self.peak:
+                self.peak = sharpness
+            self.sharpness = sharpness
+            self.clipped = float(np.count_nonzero(clipped)) / clipped.size
+            self.seq = pyramid.seq
+            label = "sharpness %.0f  peak %.0f" % (sharpness, self.peak)
+        cv2.putText(overlay, label, (8, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+
+        elapsed_ms = (time.monotonic() - start) * 1000.0
+        with self.lock:
+            self.compute_ms = elapsed_ms if not self.compute_ms else 0.9 * self.compute_ms + 0.1 * elapsed_ms
+            self.renders += 1
+            self._overlay = overlay
+        return overlay
+
+    def reset(self):
+        with self.lock:
+            self.sharpness = None
+            self.clipped = 0.0
+            self.seq = None
+            self._overlay = None
+
+    def get_status(self):
+        with self.lock:
+            return {
+                "level": self.level,
+                "preview_size": list(level_size(self.level, self.stream_size)),
+                "roi": list(self.roi) if self.roi else None,
+                "sharpness": round(self.sharpness, 1) if self.sharpness is not None else None,
+                "peak": round(self.peak, 1) if self.peak is not None else None,
+                "of_peak": round(self.sharpness / self.peak, 3) if self.peak and self.sharpness is not None else None,
+                "clipped": round(self.clipped, 4),
+                "zebra_level": self.zebra_level,
+                "peaking_threshold": self.peaking_threshold,
+                "max_rate": self.max_rate,
+                "seq": self.seq,
+                "renders": self.renders,
+                "compute_ms": round(self.compute_ms, 2),
+            }
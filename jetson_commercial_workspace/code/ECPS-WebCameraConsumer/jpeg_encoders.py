@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+
+# a jpeg encoder turns a BGR (or BGRx) image into jpeg bytes, None on failure
+# options common to all: quality, subsampling ("444", "422", "420")
+# the camera pipeline delivers BGR (videoconvert runs before appsink), so the
+# BGRx path only pays off for callers holding BGRx frames, see the benchmark
+class JpegEncoder:
+    name = "base"
+    # BGRx frames are encoded without a conversion copy
+    takes_bgrx = False
+
+    def __init__(self, quality=70, subsampling="420"):
+        if subsampling not in ("444", "422", "420"):
+            raise ValueError(f"Unknown subsampling: {subsampling}")
+        self.quality = int(quality)
+        if not 1 <= self.quality <= 100:
+            raise ValueError(f"JPEG quality must be 1..100, got {quality}")
+        self.subsampling = subsampling
+
+    def encode(self, image):
+        raise NotImplementedError
+
+    def describe(self):
+        return {"name": self.name, "quality": self.quality, "subsampling": self.subsampling}
+
+    # BGRx -> BGR for encoders that only take 3 channels
+    def _bgr(self, image):
+        if image.ndim == 3 and image.shape[2] == 4 and not self.takes_bgrx:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        return image
+
+
+# cv2.imencode, always available
+# optimize = optimized huffman tables, restart_interval in MCUs (0 = off)
+class OpenCVEncoder(JpegEncoder):
+    name = "opencv"
+    SAMPLING = {
+        "444": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_444", None),
+        "422": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_422", None),
+        "420": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_420", None),
+    }
+
+    def __init__(self, quality=70, subsampling="420", optimize=False, restart_interval=0, progressive=False):
+        super().__init__(quality, subsampling)
+        self.optimize = optimize
+        self.restart_interval = restart_interval
+        self.progressive = progressive
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        # the defaults (4:2:0, no optimize, no restarts) need no flags
+        if subsampling != "420":
+            if self.SAMPLING[subsampling] is None:
+                raise ValueError("this OpenCV build cannot set jpeg subsampling")
+            self.params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, self.SAMPLING[subsampling]]
+        if optimize:
+            self.params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+        if restart_interval:
+            self.params += [cv2.IMWRITE_JPEG_RST_INTERVAL, int(restart_interval)]
+        if progressive:
+            self.params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+
+    def encode(self, image):
+        ret, buffer = cv2.imencode('.jpg', self._bgr(image), self.params)
+        return buffer.tobytes() if ret else None
+
+    def describe(self):
+        info = super().describe()
+        info.update(optimize=self.optimize, restart_interval=self.restart_interval, progressive=self.progressive)
+        return info
+
+
+# libjpeg-turbo through PyTurboJPEG (pip install PyTurboJPEG), takes BGRx as is
+class TurboJPEGEncoder(JpegEncoder):
+    name = "turbojpeg"
+    takes_bgrx = True
+
+    def __init__(self, quality=70, subsampling="420", fast_dct=True):
+        super().__init__(quality, subsampling)
+        import turbojpeg
+        self.tj = turbojpeg
+        self.jpeg = turbojpeg.TurboJPEG()
+        self.fast_dct = fast_dct
+        self.tj_subsampling = {"444": turbojpeg.TJSAMP_444, "422": turbojpeg.TJSAMP_422,
+                               "420": turbojpeg.TJSAMP_420}[subsampling]
+        self.flags = turbojpeg.TJFLAG_FASTDCT if fast_dct else 0
+
+    def encode(self, image):
+        pixel_format = self.tj.TJPF_BGRX if image.ndim == 3 and image.shape[2] == 4 else self.tj.TJPF_BGR
+        return self.jpeg.encode(image, quality=self.quality, pixel_format=pixel_format,
+                                jpeg_subsample=self.tj_subsampling, flags=self.flags)
+
+    def describe(self):
+        info = super().describe()
+        info["fast_dct"] = self.fast_dct
+        return info
+
+
+# simplejpeg (pip install simplejpeg), libjpeg-turbo as well, takes BGRx as is
+class SimpleJPEGEncoder(JpegEncoder):
+    name = "simplejpeg"
+    takes_bgrx = True
+
+    def __init__(self, quality=70, subsampling="420", fastdct=True):
+        super().__init__(quality, subsampling)
+        import simplejpeg
+        self.simplejpeg = simplejpeg
+        self.fastdct = fastdct
+
+    def encode(self, image):
+        colorspace = "BGRX" if image.ndim == 3 and image.shape[2] == 4 else "BGR"
+        return self.simplejpeg.encode_jpeg(
+            np.ascontiguousarray(image), quality=self.quality, colorspace=colorspace,
+            colorsubsampling=self.subsampling, fastdct=self.fastdct,
+        )
+
+    def describe(self):
+        info = super().describe()
+        info["fastdct"] = self.fastdct
+        return info
+
+
+# Pillow (pip install pillow), needs an RGB copy of every frame
+class PILEncoder(JpegEncoder):
+    name = "pil"
+
+    def __init__(self, quality=70, subsampling="420", optimize=False):
+        super().__init__(quality, subsampling)
+        from PIL import Image
+        self.Image = Image
+        self.optimize = optimize
+        self.pil_subsampling = {"444": 0, "422": 1, "420": 2}[subsampling]
+
+    def encode(self, image):
+        import io
+        rgb = cv2.cvtColor(self._bgr(image), cv2.COLOR_BGR2RGB)
+        out = io.BytesIO()
+        self.Image.fromarray(rgb).save(out, "JPEG", quality=self.quality,
+                                       subsampling=self.pil_subsampling, optimize=self.optimize)
+        return out.getvalue()
+
+    def describe(self):
+        info = super().describe()
+        info["optimize"] = self.optimize
+        return info
+
+
+ENCODERS = {
+    "opencv": OpenCVEncoder,
+    "turbojpeg": TurboJPEGEncoder,
+    "simplejpeg": SimpleJPEGEncoder,
+    "pil": PILEncoder,
+}
+
+
+# names of the encoders whose libraries are installed
+def available_encoders():
+    names = []
+    for name, cls in ENCODERS.items():
+        try:
+            cls()
+        except ImportError:
+            continue
+        except Exception:
+            # installed but broken (e.g. libturbojpeg.so missing)
+            continue
+        names.append(name)
+    return names
+
+
+# spec: None, "opencv" or {"name": "opencv", "quality": 80, "optimize": True, ...}
+# raises ValueError for unknown or unavailable encoders and bad options
+def make_encoder(spec=None):
+    if spec is None:
+        return OpenCVEncoder()
+    if isinstance(spec, JpegEncoder):
+        return spec
+    if isinstance(spec, str):
+        spec = {"name": spec}
+    if not isinstance(spec, dict):
+        raise ValueError("Encoder spec must be a name or an object with a name")
+    options = dict(spec)
+    name = options.pop("name", "opencv")
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown encoder: {name} (use one of {', '.join(ENCODERS)})")
+    try:
+        return ENCODERS[name](**options)
+    except ImportError as e:
+        raise ValueError(f"Encoder {name} is not installed: {e}")
+    except TypeError as e:
+        raise ValueError(f"Bad options for encoder {name}: {e}")
+    except (OSError, RuntimeError) as e:
+        # installed but broken, e.g. PyTurboJPEG without libturbojpeg.so
+        raise ValueError(f"Encoder {name} is not usable: {e}")
+
+
+# --- benchmark: python3 jpeg_encoders.py [image] [repeat] ---
+
+# encoder configurations compared by the benchmark, the first is the default
+BENCHMARK_CONFIGS = [
+    {"name": "opencv"},
+    {"name": "opencv", "optimize": True},
+    {"name": "opencv", "subsampling": "422"},
+    {"name": "opencv", "subsampling": "444"},
+    {"name": "opencv", "restart_interval": 16},
+    {"name": "opencv", "progressive": True},
+    {"name": "turbojpeg"},
+    {"name": "turbojpeg", "subsampling": "444"},
+    {"name": "simplejpeg"},
+    {"name": "pil"},
+    {"name": "pil", "optimize": True},
+]
+
+# our stream sizes: full, half and thumb pyramid levels
+BENCHMARK_SIZES = [(1920, 1080), (960, 540), (320, 180)]
+
+
+def load_test_frame(path=None):
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CSI-Camera", "test_image.jpg")
+    image = cv2.imread(path)
+    if image is None:
+        # no photo around, use the synthetic pattern
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CSI-Camera"))
+        from frame_source import SyntheticSource
+        image = SyntheticSource((1920, 1080), realtime=False).render(7)
+    return image
+
+
+def benchmark(image=None, configs=BENCHMARK_CONFIGS, sizes=BENCHMARK_SIZES, quality=70, repeat=20):
+    image = load_test_frame() if image is None else image
+    results = []
+    for width, height in sizes:
+        frame = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        bgrx = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)
+        for config in configs:
+            try:
+                encoder = make_encoder(dict({"quality": quality}, **config))
+            except ValueError:
+                continue
+            # BGRx input is what nvvidconv delivers before videoconvert
+            inputs = [("bgr", frame)] + ([("bgrx", bgrx)] if encoder.takes_bgrx else [])
+            for input_name, data in inputs:
+                jpeg = encoder.encode(data)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    encoder.encode(data)
+                encode_ms = (time.perf_counter() - start) / repeat * 1000.0
+                decoded = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                info = encoder.describe()
+                options = ",".join(f"{k}={v}" for k, v in info.items() if k not in ("name", "quality") and v)
+                results.append({
+                    "size": f"{width}x{height}",
+                    "encoder": info["name"],
+                    "options": options,
+                    "input": input_name,
+                    "encode_ms": round(encode_ms, 2),
+                    "kb": round(len(jpeg) / 1024.0, 1),
+                    "psnr": round(cv2.PSNR(frame, decoded), 2),
+                })
+    return results
+
+
+def print_results(results):
+    print(f"{'size':10} {'encoder':11} {'options':36} {'input':5} {'ms':>7} {'kB':>7} {'PSNR':>6}")
+    for r in results:
+        print(f"{r['size']:10} {r['encoder']:11} {r['options']:36} {r['input']:5} "
+              f"{r['encode_ms']:7.2f} {r['kb']:7.1f} {r['psnr']:6.2f}")
+
+
+if __name__ == "__main__":
+    image = cv2.imread(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] else None
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print("available encoders: " + ", ".join(available_encoders()))
+    print_results(benchmark(image, repeat=repeat))
@@ -0,0 +1,442 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+
+# load test for app.py: how many viewers and control clients one server takes
+#
+# starts app.py on a synthetic camera (or tests LOAD_URL), then for every
+# client count N: N concurrent /video_feed readers plus one control client
+# moving a slider (/set_controls) and polling /get_status. Per step it reports
+# delivered fps per reader, frame latency (capture to receipt, from the
+# X-Capture-Time part header), control request latency and the server's
+# cpu, threads and rss. The steps form a capacity curve saved as json.
+#
+# usage:
+#   python3 load_test.py [clients] [seconds] [out.json]     clients like 1,2,4,8,16
+#   python3 load_test.py compare a.json b.json ...
+# environment:
+#   CAMERA_SOURCE   source of the started server (default synthetic:1920x1080@10),
+#                   JPEG_ENCODER and other settings are passed on to it as well
+#   LOAD_URL        test a running server, e.g. http://jetson:5000
+#   LOAD_PID        its process id, for cpu / threads / rss (same host only)
+#   LOAD_SIZE       stream size, full | half | thumb (default full)
+#   LOAD_CONTROL_RATE / LOAD_STATUS_RATE   requests per second (default 5 / 1)
+#   LOAD_LABEL      name of the run in the curve (default: git commit + source)
+
+DEFAULT_CLIENTS = (1, 2, 4, 8, 16)
+DEFAULT_SECONDS = 10.0
+DEFAULT_SOURCE = "synthetic:1920x1080@10"
+WARMUP = 2.0
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": None, "p99": None, "max": None}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+# cpu, threads and rss of a local process from /proc
+class ProcessSampler:
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self._mark = None
+
+    def _cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            # fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def sample(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return {
+            "threads": int(status["Threads"]),
+            "rss_mb": round(int(status["VmRSS"].split()[0]) / 1024.0, 1),
+        }
+
+    # start a cpu measurement window
+    def mark(self):
+        self._mark = (time.monotonic(), self._cpu_seconds())
+
+    # cpu use since mark() in percent of one core
+    def cpu_percent(self):
+        t0, cpu0 = self._mark
+        dt = time.monotonic() - t0
+        return round((self._cpu_seconds() - cpu0) / dt * 100.0, 1) if dt > 0 else 0.0
+
+
+# one /video_feed viewer on its own thread
+class StreamReader(threading.Thread):
+    def __init__(self, host, port, path):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.running = True
+        self.conn = None
+        self.lock = threading.Lock()
+        self.arrivals = []           # time.monotonic() per frame
+        self.latencies = []          # (arrival, ms) per frame with a capture time
+        self.bytes = 0
+        self.error = None
+
+    def run(self):
+        try:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            self.conn.request("GET", self.path)
+            response = self.conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            while self.running:
+                self._read_part(response)
+        except Exception as e:
+            if self.running:
+                self.error = str(e)
+
+    def _read_part(self, response):
+        line = response.readline()
+        if not line:
+            raise RuntimeError("stream closed")
+        if not line.startswith(b"--frame"):
+            return
+        headers = {}
+        while True:
+            line = response.readline().strip()
+            if not line:
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        data = response.read(int(headers["content-length"]))
+        response.readline()          # \r\n after the jpeg
+        now = time.monotonic()
+        wall = time.time()
+        with self.lock:
+            self.arrivals.append(now)
+            self.bytes += len(data)
+            if "x-capture-time" in headers:
+                self.latencies.append((now, (wall - float(headers["x-capture-time"])) * 1000.0))
+
+    def window(self, start, end):
+        with self.lock:
+            frames = sum(1 for t in self.arrivals if start <= t < end)
+            latencies = [ms for t, ms in self.latencies if start <= t < end]
+        return frames / (end - start), latencies
+
+    def stop(self):
+        self.running = False
+        try:
+            if self.conn is not None and self.conn.sock is not None:
+                # unblocks the read on the reader thread
+                self.conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# slider traffic: /set_controls at control_rate, /get_status at status_rate
+class ControlClient(threading.Thread):
+    # a gain sweep like an operator dragging the slider back and forth
+    GAINS = [0, 3016, 6032, 12064, 18096, 24024, 18096, 12064, 6032, 3016]
+
+    def __init__(self, host, port, control_rate=5.0, status_rate=1.0):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.control_rate = control_rate
+        self.status_rate = status_rate
+        self.running = True
+        self.lock = threading.Lock()
+        self.samples = {"set_controls": [], "get_status": []}   # (time, ms, ok)
+
+    def _request(self, conn, name, method, path, body=None):
+        start = time.monotonic()
+        ok = False
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+        elapsed_ms = (time.monotonic() - start) * 1000.0
+        with self.lock:
+            self.samples[name].append((start, elapsed_ms, ok))
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        next_control = next_status = time.monotonic()
+        step = 0
+        while self.running:
+            now = time.monotonic()
+            if self.control_rate and now >= next_control:
+                gain = self.GAINS[step % len(self.GAINS)]
+                step += 1
+                self._request(conn, "set_controls", "POST", "/set_controls",
+                              {"gain": gain, "exposure": 10000, "black_level": 0})
+                next_control += 1.0 / self.control_rate
+            if self.status_rate and now >= next_status:
+                self._request(conn, "get_status", "GET", "/get_status")
+                next_status += 1.0 / self.status_rate
+            due = min(next_control if self.control_rate else float("inf"),
+                      next_status if self.status_rate else float("inf"))
+            time.sleep(max(0.0, min(0.1, due - time.monotonic())))
+        conn.close()
+
+    def window(self, start, end):
+        stats = {}
+        with self.lock:
+            for name, samples in self.samples.items():
+                inside = [(ms, ok) for t, ms, ok in samples if start <= t < end]
+                stats[name] = percentiles([ms for ms, _ in inside])
+                stats[name]["errors"] = sum(1 for _, ok in inside if not ok)
+        return stats
+
+    def stop(self):
+        self.running = False
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http_get(host, port, path, timeout=2.0):
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def http_post(host, port, path, body):
+    conn = http.client.HTTPConnection(host, port, timeout=5.0)
+    try:
+        conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+# app.py on a free port with a synthetic camera, returns (process, port)
+def start_server(source):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), CAMERA_SOURCE=source)
+    server = subprocess.Popen(
+        [sys.executable, "app.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30.0
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"app.py exited with {server.returncode}")
+        try:
+            if http_get("127.0.0.1", port, "/get_status")[0] == 200:
+                return server, port
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("app.py did not come up within 30 s")
+
+
+def wait_for_frames(host, port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if http_get(host, port, "/snapshot.jpg?wait=1")[0] == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run_step(host, port, clients, seconds, path, sampler, control_rate, status_rate):
+    readers = [StreamReader(host, port, path) for _ in range(clients)]
+    control = ControlClient(host, port, control_rate, status_rate)
+    for reader in readers:
+        reader.start()
+    control.start()
+
+    time.sleep(WARMUP)
+    start = time.monotonic()
+    if sampler:
+        sampler.mark()
+    server = []
+    while time.monotonic() - start < seconds:
+        time.sleep(min(0.5, seconds - (time.monotonic() - start)))
+        if sampler:
+            server.append(sampler.sample())
+    end = time.monotonic()
+    cpu = sampler.cpu_percent() if sampler else None
+
+    fps = []
+    latencies = []
+    for reader in readers:
+        reader_fps, reader_latencies = reader.window(start, end)
+        fps.append(round(reader_fps, 2))
+        latencies += reader_latencies
+    controls = control.window(start, end)
+
+    control.stop()
+    for reader in readers:
+        reader.stop()
+    for reader in readers + [control]:
+        reader.join(timeout=5.0)
+
+    step = {
+        "clients": clients,
+        "fps_per_client": fps,
+        "fps_mean": round(float(np.mean(fps)), 2),
+        "fps_min": round(float(np.min(fps)), 2),
+        "latency_ms": percentiles(latencies),
+        "control_ms": controls,
+        "reader_errors": [r.error for r in readers if r.error],
+    }
+    if sampler:
+        step["server"] = {
+            "cpu_percent": cpu,
+            "threads": max(s["threads"] for s in server),
+            "rss_mb": max(s["rss_mb"] for s in server),
+        }
+    return step
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(clients=DEFAULT_CLIENTS, seconds=DEFAULT_SECONDS, out=None):
+    source = os.environ.get("CAMERA_SOURCE", DEFAULT_SOURCE)
+    size = os.environ.get("LOAD_SIZE", "full")
+    control_rate = float(os.environ.get("LOAD_CONTROL_RATE", 5.0))
+    status_rate = float(os.environ.get("LOAD_STATUS_RATE", 1.0))
+
+    server = None
+    if os.environ.get("LOAD_URL"):
+        url = urlparse(os.environ["LOAD_URL"])
+        host, port = url.hostname, url.port or 80
+        pid = os.environ.get("LOAD_PID")
+        sampler = ProcessSampler(int(pid)) if pid else None
+    else:
+        server, port = start_server(source)
+        host = "127.0.0.1"
+        sampler = ProcessSampler(server.pid)
+
+    revision = git_revision()
+    curve = {
+        "label": os.environ.get("LOAD_LABEL") or f"{revision} {source}",
+        "revision": revision,
+        "source": source if server else os.environ["LOAD_URL"],
+        "encoder": os.environ.get("JPEG_ENCODER", "opencv"),
+        "size": size,
+        "seconds": seconds,
+        "control_rate": control_rate,
+        "status_rate": status_rate,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "steps": [],
+    }
+    try:
+        http_post(host, port, "/start_camera", {})
+        if not wait_for_frames(host, port):
+            raise RuntimeError("camera did not deliver frames")
+        if sampler:
+            curve["idle"] = sampler.sample()
+        print_header()
+        for n in clients:
+            step = run_step(host, port, n, seconds, f"/video_feed?size={size}", sampler, control_rate, status_rate)
+            curve["steps"].append(step)
+            print_step(step)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    if out:
+        with open(out, "w") as f:
+            json.dump(curve, f, indent=2)
+        print(f"saved {out}")
+    return curve
+
+
+def print_header():
+    print(f"{'clients':>7} {'fps mean':>8} {'fps min':>7} {'lat p50':>7} {'lat p99':>7} "
+          f"{'ctl p50':>7} {'ctl p99':>7} {'stat p99':>8} {'cpu %':>6} {'threads':>7} {'rss MB':>7}")
+
+
+def _fmt(value, width, digits=1):
+    return f"{value:{width}.{digits}f}" if isinstance(value, (int, float)) else f"{'-':>{width}}"
+
+
+def print_step(step):
+    server = step.get("server", {})
+    print(f"{step['clients']:7d} {_fmt(step['fps_mean'], 8)} {_fmt(step['fps_min'], 7)} "
+          f"{_fmt(step['latency_ms']['p50'], 7)} {_fmt(step['latency_ms']['p99'], 7)} "
+          f"{_fmt(step['control_ms']['set_controls']['p50'], 7)} {_fmt(step['control_ms']['set_controls']['p99'], 7)} "
+          f"{_fmt(step['control_ms']['get_status']['p99'], 8)} {_fmt(server.get('cpu_percent'), 6)} "
+          f"{_fmt(server.get('threads'), 7, 0)} {_fmt(server.get('rss_mb'), 7)}")
+    for error in step["reader_errors"]:
+        print(f"        reader error: {error}")
+
+
+# side by side: one row per client count, fps / p99 latency / cpu per run
+def compare(paths):
+    curves = []
+    for path in paths:
+        with open(path) as f:
+            curves.append(json.load(f))
+    for i, curve in enumerate(curves):
+        print(f"[{i}] {curve['label']}  ({curve['date']}, {curve['size']}, encoder {curve['encoder']})")
+    counts = sorted({step["clients"] for curve in curves for step in curve["steps"]})
+    print(f"{'clients':>7} " + " ".join(f"{'[%d] fps / p99 ms / cpu %%' % i:>26}" for i in range(len(curves))))
+    for n in counts:
+        cells = []
+        for curve in curves:
+            step = next((s for s in curve["steps"] if s["clients"] == n), None)
+            if step is None:
+                cells.append(f"{'-':>26}")
+                continue
+            cpu = step.get("server", {}).get("cpu_percent")
+            cells.append(f"{step['fps_mean']:8.1f} / {_fmt(step['latency_ms']['p99'], 7)} / {_fmt(cpu, 5)}")
+        print(f"{n:7d} " + " ".join(f"{c:>26}" for c in cells))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) < 3:
+            print("usage: python3 load_test.py compare a.json b.json ...")
+            sys.exit(1)
+        compare(sys.argv[2:])
+        sys.exit(0)
+    try:
+        clients = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else DEFAULT_CLIENTS
+        seconds = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SECONDS
+    except ValueError:
+        print("usage: python3 load_test.py [clients like 1,2,4,8] [seconds] [out.json]")
+        sys.exit(1)
+    run(clients, seconds, sys.argv[3] if len(sys.argv) > 3 else None)
@@ -0,0 +1,222 @@
+import threading
+import time
+
+import cv2
+
+from change_detector import ChangeDetector
+from jpeg_encoders import OpenCVEncoder
+
+# used when the caller passes no encoder
+DEFAULT_ENCODER = OpenCVEncoder(quality=70)
+
+
+# output sizes of the preview pyramid, as a divisor of the stream size
+PYRAMID_LEVELS = {
+    "full": 1,
+    "half": 2,
+    "thumb": 6,
+}
+
+
+def level_size(level, stream_size):
+    divisor = PYRAMID_LEVELS[level]
+    return (max(1, stream_size[0] // divisor), max(1, stream_size[1] // divisor))
+
+
+# the images derived from one captured frame
+# levels are computed on first use and at most once per frame
+class FramePyramid:
+    def __init__(self, source, stream, seq=0, stamp=None):
+        self.source = source
+        self.seq = seq
+        # FrameStamp of the captured frame, see frame_timing.py
+        self.stamp = stamp
+        self.stream_size = (stream.shape[1], stream.shape[0])
+        self._levels = {"full": stream}
+        # variants of one frame may be encoded on several pool threads
+        self._lock = threading.Lock()
+
+    @property
+    def stream(self):
+        return self._levels["full"]
+
+    def level(self, name):
+        with self._lock:
+            return self._level(name)
+
+    def _level(self, name):
+        image = self._levels.get(name)
+        if image is None:
+            size = level_size(name, self.stream_size)
+            # start from the smallest level already computed that is still larger
+            base = self.stream
+            for other in sorted(self._levels, key=lambda n: -PYRAMID_LEVELS[n]):
+                if PYRAMID_LEVELS[other] < PYRAMID_LEVELS[name]:
+                    base = self._levels[other]
+                    break
+            image = cv2.resize(base, size, interpolation=cv2.INTER_AREA)
+            self._levels[name] = image
+        return image
+
+
+# one encoded output of the producer (pyramid level, roi crop, ...)
+# clients of the same variant share a single encode per frame
+class StreamVariant:
+    def __init__(self, name, render, threshold=2.0, keepalive=1.0, persistent=False):
+        self.name = name
+        # render(pyramid) -> image to encode
+        self.render = render
+        self.change_detector = ChangeDetector(threshold=threshold, keepalive=keepalive)
+        # persistent variants stay registered without subscribers
+        self.persistent = persistent
+
+        self.subscribers = 0
+        self.jpeg = None
+        self.seq = 0
+        self.frame_seq = None        # producer frame the jpeg was made from
+        self.captured = None         # time.monotonic() that frame arrived
+        self.cond = threading.Condition()
+
+        # one encode at a time, frames arriving meanwhile are dropped
+        self.encoding = False
+        self.dropped = 0
+        self.encode_ms = 0.0         # moving average of render + encode time
+
+    # claim the variant for one encode, False if the previous one still runs
+    def begin_encode(self):
+        with self.cond:
+            if self.encoding:
+                self.dropped += 1
+                return False
+            self.encoding = True
+            return True
+
+    def end_encode(self, dropped=False):
+        with self.cond:
+            self.encoding = False
+            if dropped:
+                self.dropped += 1
+
+    # encode the rendered image if it changed, call between begin/end_encode
+    # force skips the change detector (single-shot requests)
+    # encoder: a JpegEncoder, see jpeg_encoders.py
+    def encode(self, pyramid, encoder=None, force=False):
+        start = time.monotonic()
+        image = self.render(pyramid)
+        if not self.change_detector.update(image) and not force:
+            return False
+        data = (encoder or DEFAULT_ENCODER).encode(image)
+        ret = data is not None
+        if ret:
+            self.publish(data, pyramid.seq, pyramid.stamp.arrival if pyramid.stamp else None)
+        elapsed_ms = (time.monotonic() - start) * 1000.0
+        self.encode_ms = elapsed_ms if not self.encode_ms else 0.9 * self.encode_ms + 0.1 * elapsed_ms
+        return ret
+
+    def publish(self, data, frame_seq=None, captured=None):
+        with self.cond:
+            self.jpeg = data
+            self.seq += 1
+            self.frame_seq = frame_seq
+            self.captured = captured
+            self.cond.notify_all()
+
+    # block until a jpeg newer than last_seq exists, is_running() is false or timeout
+    # returns (seq, jpeg bytes or None, frame seq, capture time), read together
+    def wait(self, last_seq, timeout, is_running):
+        with self.cond:
+            self.cond.wait_for(
+                lambda: (self.seq != last_seq and self.jpeg is not None) or not is_running(),
+                timeout,
+            )
+            return self.seq, self.jpeg, self.frame_seq, self.captured
+
+    # (producer frame seq, jpeg) read together
+    def snapshot(self):
+        with self.cond:
+            return self.frame_seq, self.jpeg
+
+    def clear(self):
+        with self.cond:
+            self.jpeg = None
+            self.frame_seq = None
+            self.captured = None
+            self.change_detector.reset()
+            self.cond.notify_all()
+
+    def get_stats(self):
+        stats = self.change_detector.get_stats()
+        stats["subscribers"] = self.subscribers
+        stats["seq"] = self.seq
+        stats["dropped"] = self.dropped
+        stats["encode_ms"] = round(self.encode_ms, 2)
+        return stats
+
+
+def level_view(level):
+    def render(pyramid):
+        return pyramid.level(level)
+    return render
+
+
+# area downscale; sources at least twice the target size are halved first,
+# the integer factor takes cv2's fast path (5440x3648 -> 1920x1080 in about
+# half the time of a single INTER_AREA resize)
+def downscale(image, size):
+    h, w = image.shape[:2]
+    if w >= 2 * size[0] and h >= 2 * size[1]:
+        image = cv2.resize(image, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+# crop a stream-space roi out of the source frame at source resolution
+# the crop is only shrunk if it is larger than max_size, never enlarged
+def roi_view(roi, stream_size, max_size):
+    x, y, w, h = roi
+    boxes = {}
+
+    # crop box and output size for a source shape, worked out once per shape
+    def box(source_shape):
+        sx = source_shape[1] / float(stream_size[0])
+        sy = source_shape[0] / float(stream_size[1])
+        x0, y0 = int(x * sx), int(y * sy)
+        x1, y1 = max(x0 + 1, int((x + w) * sx)), max(y0 + 1, int((y + h) * sy))
+        crop_w, crop_h = x1 - x0, y1 - y0
+        scale = min(1.0, max_size[0] / float(crop_w), max_size[1] / float(crop_h))
+        out_size = (max(1, int(crop_w * scale)), max(1, int(crop_h * scale)))
+        return x0, y0, x1, y1, scale, out_size
+
+    def render(pyramid):
+        shape = pyramid.source.shape[:2]
+        if shape not in boxes:
+            boxes[shape] = box(shape)
+        x0, y0, x1, y1, scale, out_size = boxes[shape]
+        crop = pyramid.source[y0:y1, x0:x1]
+        if scale < 1.0:
+            return cv2.resize(crop, out_size, interpolation=cv2.INTER_AREA)
+        return crop
+    return render
+
+
+# "x,y,w,h" in full-view pixels -> clamped tuple, raises ValueError
+def parse_roi(text, stream_size):
+    try:
+        parts = [int(float(v)) for v in text.split(",")]
+    except OverflowError:
+        raise ValueError("roi values must be finite")
+    if len(parts) != 4:
+        raise ValueError("roi must be x,y,w,h")
+    x, y, w, h = parts
+    width, height = stream_size
+    x = min(max(0, x), width - 1)
+    y = min(max(0, y), height - 1)
+    w = min(max(1, w), width - x)
+    h = min(max(1, h), height - y)
+    return (x, y, w, h)
+
+
+def parse_size(text):
+    size = text or "full"
+    if size not in PYRAMID_LEVELS:
+        raise ValueError("size must be one of " + ", ".join(PYRAMID_LEVELS))
+    return size
@@ -0,0 +1,238 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+# normalized position profiles, s(0) = 0 -> s(1) = 1
+def linear_profile(t):
+    return t
+
+
+# constant acceleration, cruise, constant deceleration
+# accel is the fraction of the move spent speeding up (and again slowing down)
+def trapezoidal_profile(t, accel=0.25):
+    accel = min(max(accel, 1e-6), 0.5)
+    v = 1.0 / (1.0 - accel)          # cruise speed so the area is 1
+    a = v / accel
+    s = np.where(
+        t < accel, 0.5 * a * t ** 2,
+        np.where(t <= 1.0 - accel,
+                 0.5 * a * accel ** 2 + v * (t - accel),
+                 1.0 - 0.5 * a * (1.0 - t) ** 2),
+    )
+    return s
+
+
+# smoothest start and stop, zero velocity and acceleration at both ends
+def min_jerk_profile(t):
+    return 10 * t ** 3 - 15 * t ** 4 + 6 * t ** 5
+
+
+PROFILES = {
+    "linear": linear_profile,
+    "trapezoidal": trapezoidal_profile,
+    "min_jerk": min_jerk_profile,
+}
+
+
+# pulse per tick from start to end, rows = ticks, columns = channels
+def plan_pulses(start, end, duration, rate, profile="linear"):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile: {profile} (use one of {tuple(PROFILES)})")
+    steps = max(1, int(round(duration * rate)))
+    t = np.arange(1, steps + 1, dtype=np.float64) / steps
+    s = PROFILES[profile](t)[:, None]
+    start = np.asarray(start, dtype=np.float64)[None, :]
+    end = np.asarray(end, dtype=np.float64)[None, :]
+    return np.rint(start + (end - start) * s).astype(np.int32)
+
+
+class Move:
+    def __init__(self, channels, pulses, start_tick):
+        self.channels = np.asarray(channels, dtype=np.int32)
+        self.pulses = pulses
+        self.start_tick = start_tick
+        self.cancelled = False
+        self.done = threading.Event()
+
+    @property
+    def end_tick(self):
+        return self.start_tick + len(self.pulses)
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+# runs planned moves on absolute tick deadlines on its own thread
+# every tick the pulses of all active moves go out in one PCA9685 update
+class MotionScheduler:
+    def __init__(self, pca, rate=100.0, history=1000):
+        self.pca = pca
+        self.rate = rate
+        self.period = 1.0 / rate
+
+        self.cond = threading.Condition()
+        self.moves = []
+        self.running = False
+        self.thread = None
+        self.t0 = None
+        self.tick = 0
+
+        # actual minus planned time per executed tick, and time spent writing
+        self.lateness = deque(maxlen=history)
+        self.write_times = deque(maxlen=history)
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.moves_done = 0
+        self.moves_cancelled = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="motion", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            for move in self.moves:
+                move.cancelled = True
+                move.done.set()
+            self.moves = []
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+
+    # plan a move from the channels' current pulses, a new move on a channel
+    # replaces whatever that channel was doing
+    def move_pulses(self, channels, targets, duration, profile="linear"):
+        channels = np.asarray(channels, dtype=np.int32)
+        targets = np.broadcast_to(np.asarray(targets, dtype=np.int32), channels.shape)
+        with self.cond:
+            current = self._current_pulses(channels, targets)
+            pulses = plan_pulses(current, targets, duration, self.rate, profile)
+            start_tick = self._next_tick()
+            for other in self.moves:
+                if np.isin(other.channels, channels).any():
+                    self._cancel(other, keep=~np.isin(other.channels, channels))
+            move = Move(channels, pulses, start_tick)
+            self.moves = [m for m in self.moves if not m.cancelled] + [move]
+            self.cond.notify_all()
+        return move
+
+    # same with angles through a ServoDriver
+    def move_servos(self, servos, angles, duration, profile="linear"):
+        angles = np.broadcast_to(np.asarray(angles, dtype=np.float64), servos.channels.shape)
+        return self.move_pulses(servos.channels, servos.angles_to_pulses(angles), duration, profile)
+
+    def cancel(self, move):
+        with self.cond:
+            self._cancel(move)
+            self.moves = [m for m in self.moves if not m.cancelled]
+
+    def _cancel(self, move, keep=None):
+        if keep is not None and keep.any():
+            # other channels of the move carry on
+            move.channels = move.channels[keep]
+            move.pulses = move.pulses[:, keep]
+            return
+        move.cancelled = True
+        move.done.set()
+        self.moves_cancelled += 1
+
+    # where a channel is now: mid-move position, last written or the target
+    def _current_pulses(self, channels, targets):
+        current = self.pca.pulses[channels].astype(np.int32)
+        for move in self.moves:
+            index = min(max(self.tick - move.start_tick, 0), len(move.pulses)) - 1
+            for i, ch in enumerate(move.channels):
+                hit = np.flatnonzero(channels == ch)
+                if hit.size and index >= 0:
+                    current[hit] = move.pulses[index, i]
+        return np.where(current < 0, targets, current)
+
+    def _next_tick(self):
+        if self.t0 is None or not self.moves:
+            # idle, restart the tick clock so the first step is not late
+            self.t0 = time.monotonic()
+            self.tick = 0
+            return 1
+        return self.tick + 1
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.moves:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                self.tick += 1
+                deadline = self.t0 + self.tick * self.period
+
+            now = time.monotonic()
+            if now - deadline > self.period:
+                # fell a whole tick behind, jump to the current one
+                # moves index by tick, so they stay on schedule
+                skipped = int((now - deadline) / self.period)
+                with self.cond:
+                    self.missed_ticks += skipped
+                    self.tick += skipped
+                    deadline = self.t0 + self.tick * self.period
+            self._sleep_until(deadline)
+            actual = time.monotonic()
+
+            with self.cond:
+                channels = []
+                pulses = []
+                finished = []
+                for move in self.moves:
+                    index = self.tick - move.start_tick
+                    if index >= 0:
+                        # after skipped ticks the final pulse still goes out
+                        channels.append(move.channels)
+                        pulses.append(move.pulses[min(index, len(move.pulses) - 1)])
+                    if self.tick >= move.end_tick - 1:
+                        finished.append(move)
+                self.moves = [m for m in self.moves if m not in finished]
+
+            if channels:
+                self.pca.set_pulses(np.concatenate(channels), np.concatenate(pulses))
+            # a finished move is only reported once its last pulse is written
+            with self.cond:
+                self.moves_done += len(finished)
+                self.write_times.append(time.monotonic() - actual)
+                self.lateness.append(actual - deadline)
+                self.ticks += 1
+            for move in finished:
+                move.done.set()
+
+    # sleep most of the way, then spin for the last half millisecond
+    def _sleep_until(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining > 0.0005:
+            time.sleep(remaining - 0.0005)
+        while time.monotonic() < deadline:
+            pass
+
+    def get_stats(self):
+        # the scheduler thread appends to the deques, snapshot them under its lock
+        with self.cond:
+            lateness = np.array(self.lateness) * 1000.0
+            writes = np.array(self.write_times) * 1000.0
+            stats = {
+                "rate": self.rate,
+                "ticks": self.ticks,
+                "missed_ticks": self.missed_ticks,
+                "moves_done": self.moves_done,
+                "moves_cancelled": self.moves_cancelled,
+            }
+        if lateness.size:
+            stats.update({
+                "late_ms_mean": round(float(lateness.mean()), 3),
+                "late_ms_p95": round(float(np.percentile(lateness, 95)), 3),
+                "late_ms_max": round(float(lateness.max()), 3),
+                "write_ms_mean": round(float(writes.mean()), 3),
+            })
+        return stats
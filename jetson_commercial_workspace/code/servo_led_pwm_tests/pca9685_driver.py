@@ -0,0 +1,194 @@
+import threading
+import time
+
+import numpy as np
+
+
+# PCA9685 registers
+MODE1 = 0x00
+PRESCALE = 0xFE
+LED0_ON_L = 0x06
+
+# MODE1 bits
+RESTART = 0x80
+AI = 0x20          # register auto increment, needed for block writes
+SLEEP = 0x10
+ALLCALL = 0x01
+
+PCA9685_ADDRESS = 0x40
+NUM_CHANNELS = 16
+# smbus block writes carry at most 32 data bytes = 8 channels
+MAX_BLOCK_CHANNELS = 8
+
+SERVO_FREQ = 50
+SERVO_MIN_PULSE = 205  # 0 degrees (1ms at 50Hz, 4096 steps per period)
+SERVO_MAX_PULSE = 410  # 180 degrees (2ms)
+
+# the i2c bus ServoKit uses by default (board.SCL/SDA), pins 3/5 of the
+# 40 pin header on Jetson and Raspberry Pi
+DEFAULT_BUS = 1
+
+
+def open_bus(bus_number=DEFAULT_BUS):
+    # Adafruit_PureIO comes with the Adafruit_PCA9685 install
+    try:
+        from Adafruit_PureIO.smbus import SMBus
+    except ImportError:
+        from smbus2 import SMBus
+    return SMBus(bus_number)
+
+
+# stands in for the i2c bus, keeps the register file and counts transactions
+class FakeSMBus:
+    def __init__(self, write_delay=0.0):
+        self.registers = {}
+        # simulated time per transaction, seconds
+        self.write_delay = write_delay
+        self.transactions = 0
+        self.bytes_written = 0
+        self.log = []
+
+    def _regs(self, addr):
+        return self.registers.setdefault(addr, bytearray(256))
+
+    def write_byte_data(self, addr, cmd, val):
+        self._regs(addr)[cmd] = val & 0xFF
+        self._count(addr, cmd, 1)
+
+    def write_i2c_block_data(self, addr, cmd, vals):
+        if len(vals) > 32:
+            raise ValueError("smbus block write longer than 32 bytes")
+        regs = self._regs(addr)
+        # the chip only moves to the next register with MODE1 AI set
+        if regs[MODE1] & AI:
+            regs[cmd:cmd + len(vals)] = bytes(v & 0xFF for v in vals)
+        else:
+            regs[cmd] = vals[-1] & 0xFF
+        self._count(addr, cmd, len(vals))
+
+    def read_byte_data(self, addr, cmd):
+        self.transactions += 1
+        return self._regs(addr)[cmd]
+
+    def _count(self, addr, cmd, length):
+        self.transactions += 1
+        self.bytes_written += length
+        self.log.append((addr, cmd, length))
+        if self.write_delay:
+            time.sleep(self.write_delay)
+
+    # off count of a channel as the chip sees it
+    def pulse(self, channel, addr=PCA9685_ADDRESS):
+        regs = self._regs(addr)
+        base = LED0_ON_L + 4 * channel
+        return regs[base + 2] | (regs[base + 3] << 8)
+
+
+# writes all changed channels of an update with as few block writes as possible
+# safe to share between threads (a MotionScheduler and direct callers)
+class PCA9685:
+    def __init__(self, bus, address=PCA9685_ADDRESS, frequency=SERVO_FREQ):
+        self.bus = bus
+        self.address = address
+        # one update at a time: the pulse cache has to match what the chip got
+        self.lock = threading.Lock()
+        # off count last written per channel, -1 = unknown
+        self.pulses = np.full(NUM_CHANNELS, -1, dtype=np.int32)
+
+        self.updates = 0
+        self.block_writes = 0
+        self.channels_written = 0
+        self.channels_skipped = 0
+
+        self.bus.write_byte_data(address, MODE1, ALLCALL | AI)
+        time.sleep(0.005)  # wait for oscillator
+        self.set_pwm_freq(frequency)
+
+    def set_pwm_freq(self, freq_hz):
+        prescale = int(round(25000000.0 / (4096.0 * freq_hz) - 1.0))
+        with self.lock:
+            oldmode = self.bus.read_byte_data(self.address, MODE1)
+            self.bus.write_byte_data(self.address, MODE1, (oldmode & 0x7F) | SLEEP)
+            self.bus.write_byte_data(self.address, PRESCALE, prescale)
+            self.bus.write_byte_data(self.address, MODE1, oldmode)
+            time.sleep(0.005)
+            self.bus.write_byte_data(self.address, MODE1, oldmode | RESTART | AI)
+            self.frequency = freq_hz
+
+    # channels, pulses: sequences of equal length, on count is always 0
+    # returns the number of i2c transactions used
+    def set_pulses(self, channels, pulses):
+        channels = np.asarray(channels, dtype=np.int32)
+        pulses = np.clip(np.asarray(pulses, dtype=np.int32), 0, 4095)
+        with self.lock:
+            return self._write(channels, pulses)
+
+    def _write(self, channels, pulses):
+        target = self.pulses.copy()
+        target[channels] = pulses
+
+        changed = np.flatnonzero(target != self.pulses)
+        self.updates += 1
+        self.channels_skipped += len(channels) - len(np.intersect1d(changed, channels))
+        if changed.size == 0:
+            return 0
+
+        writes = 0
+        for first, last in self._runs(changed):
+            data = []
+            for ch in range(first, last + 1):
+                off = int(target[ch])
+                data += [0, 0, off & 0xFF, off >> 8]
+            self.bus.write_i2c_block_data(self.address, LED0_ON_L + 4 * first, data)
+            writes += 1
+            self.channels_written += last - first + 1
+        self.pulses = target
+        self.block_writes += writes
+        return writes
+
+    # group changed channels into (first, last) runs of at most 8 channels
+    # unchanged channels inside a run are rewritten with their current value,
+    # that costs 4 bytes instead of another transaction
+    def _runs(self, changed):
+        runs = []
+        first = last = int(changed[0])
+        for ch in changed[1:]:
+            ch = int(ch)
+            known = (self.pulses[last + 1:ch] >= 0).all()
+            if ch - first < MAX_BLOCK_CHANNELS and known:
+                last = ch
+            else:
+                runs.append((first, last))
+                first = last = ch
+        runs.append((first, last))
+        return runs
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "updates": self.updates,
+                "block_writes": self.block_writes,
+                "channels_written": self.channels_written,
+                "channels_skipped": self.channels_skipped,
+            }
+
+
+# angle -> pulse for a group of servo channels, all written in one update
+class ServoDriver:
+    def __init__(self, pca, channels, min_pulse=SERVO_MIN_PULSE, max_pulse=SERVO_MAX_PULSE):
+        self.pca = pca
+        self.channels = np.asarray(channels, dtype=np.int32)
+        self.min_pulse = min_pulse
+        self.max_pulse = max_pulse
+
+    def angles_to_pulses(self, angles):
+        angles = np.clip(np.asarray(angles, dtype=np.float64), 0.0, 180.0)
+        return (angles / 180.0 * (self.max_pulse - self.min_pulse) + self.min_pulse).astype(np.int32)
+
+    # one angle per channel (or one for all), returns i2c transactions used
+    def set_angles(self, angles):
+        angles = np.broadcast_to(np.asarray(angles, dtype=np.float64), self.channels.shape)
+        return self.pca.set_pulses(self.channels, self.angles_to_pulses(angles))
+
+    def set_pulses(self, pulses):
+        return self.pca.set_pulses(self.channels, pulses)
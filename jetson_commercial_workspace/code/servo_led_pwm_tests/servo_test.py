@@ -1,25 +1,29 @@
-from adafruit_servokit import ServoKit
+import sys
 import time
 
-myKit = ServoKit(channels=16)
+from pca9685_driver import DEFAULT_BUS, PCA9685, ServoDriver, open_bus
+
+# ServoKit's default 750-2250us servo range at 50Hz
+SERVO_MIN_PULSE = 154
+SERVO_MAX_PULSE = 461
+
+# usage: python3 servo_test.py [i2c bus], defaults to the header bus ServoKit used
+bus = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUS
+pca = PCA9685(open_bus(bus))
+# channels 12-14 are written together in one block write per step
+servos = ServoDriver(pca, [12, 13, 14], SERVO_MIN_PULSE, SERVO_MAX_PULSE)
 
 # while True:
-#     myKit.servo[14].duty_cycle = 65000
-#     myKit.servo[13].duty_cycle = 65000
-#     myKit.servo[12].duty_cycle = 65000
+#     servos.set_pulses(4095)
 
 # while True:
 #     inputAngle = int(input("angle: "))
-#     myKit.servo[8].angle = inputAngle
+#     ServoDriver(pca, [8], SERVO_MIN_PULSE, SERVO_MAX_PULSE).set_angles(inputAngle)
 
 while True:
     for i in range (0, 180 + 1):
-        myKit.servo[14].angle = i
-        myKit.servo[13].angle = i
-        myKit.servo[12].angle = i
+        servos.set_angles(i)
         time.sleep(0.005)
     for i in range (180 - 1, -1, -1):
-        myKit.servo[14].angle = i
-        myKit.servo[13].angle = i
-        myKit.servo[12].angle = i
-        time.sleep(0.005)
\ No newline at end of file
+        servos.set_angles(i)
+        time.sleep(0.005)